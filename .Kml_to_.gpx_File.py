@@ -1,4 +1,5 @@
-from xml.etree import ElementTree as ET
+from gpxstream import write_gpx
+from kmlstream import iter_kml_points
 
 def kml_to_gpx(kml_file, gpx_file):
     """
@@ -6,42 +7,16 @@ def kml_to_gpx(kml_file, gpx_file):
     kml_file: Path to the input .kml file
     gpx_file: Path where the .gpx file will be saved
     """
-    # Parse the KML file
-    tree = ET.parse(kml_file)
-    root = tree.getroot()
+    # Stream the KML points (gx:Track, Point and LineString, with their real timestamps)
+    points = iter_kml_points(kml_file)
 
-    # Create the root of the GPX XML file
-    gpx = ET.Element("gpx", version="1.1", creator="My GPS Converter")
+    # Write them straight into a GPX track as they are read
+    count = write_gpx(points, gpx_file, creator="My GPS Converter", name="GPS Track")
 
-    # Create a track (trk) and track segment (trkseg)
-    trk = ET.SubElement(gpx, "trk")
-    trkname = ET.SubElement(trk, "name")
-    trkname.text = "GPS Track"
-    trkseg = ET.SubElement(trk, "trkseg")
-
-    # Iterate through each <Placemark> in the KML file
-    for placemark in root.iter('Placemark'):
-        # Get coordinates from <coordinates> tag
-        coords = placemark.find('.//coordinates')
-        if coords is not None:
-            coord_list = coords.text.strip().split()
-
-            for coord in coord_list:
-                lon, lat, _ = coord.split(',')
-
-                # Create a track point (trkpt)
-                trkpt = ET.SubElement(trkseg, "trkpt", lat=lat, lon=lon)
-                # Add timestamp if available (optional)
-                time = ET.SubElement(trkpt, "time")
-                time.text = "2024-01-01T00:00:00Z"  # Example timestamp, replace with real timestamp if available
-
-    # Write the GPX XML tree to the output file
-    tree = ET.ElementTree(gpx)
-    tree.write(gpx_file, encoding="UTF-8", xml_declaration=True)
-
-    print(f"Converted {kml_file} to {gpx_file}")
+    print(f"Converted {kml_file} to {gpx_file} ({count} points)")
 
 # Example usage:
-kml_file = "/path/to/your/file.kml"
-gpx_file = "/path/to/your/output.gpx"
-kml_to_gpx(kml_file, gpx_file)
+if __name__ == "__main__":
+    kml_file = "/path/to/your/file.kml"
+    gpx_file = "/path/to/your/output.gpx"
+    kml_to_gpx(kml_file, gpx_file)
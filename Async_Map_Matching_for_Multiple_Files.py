@@ -1,37 +1,227 @@
 import os
+import time
 import asyncio
 import aiohttp
-import xml.etree.ElementTree as ET
 
-async def map_matching_async(gpx_file, result_file, vehicle='car'):
+from instrumentation import METRICS, file_size
+from match_cache import MatchCache
+from matching_backend import (DEFAULT_BACKOFF_S, DEFAULT_CONNECT_TIMEOUT_S, DEFAULT_READ_TIMEOUT_S,
+                              DEFAULT_RETRIES, MATCH_URL, CircuitBreaker, MatchError, MatchResult, RequestAttempts,
+                              save_response)
+from trackio import is_output_file, with_suffix
+
+# Requests in flight at once; also the size of the shared connection pool
+DEFAULT_CONCURRENCY = 8
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class BatchStats:
     """
-    Asynchronous map matching using GraphHopper.
+    Per-file latency and overall throughput of a batch run.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latencies = {}
+        self.failed = {}
+        self.bytes_sent = 0
+
+    def record(self, gpx_file, latency, size):
+        self.latencies[gpx_file] = latency
+        self.bytes_sent += size
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        latencies = sorted(self.latencies.values())
+
+        def percentile(q):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            'files_matched': len(latencies),
+            'files_failed': len(self.failed),
+            'elapsed_s': elapsed,
+            'files_per_s': len(latencies) / elapsed if elapsed else 0.0,
+            'mb_per_s': self.bytes_sent / 1e6 / elapsed if elapsed else 0.0,
+            'latency_p50_s': percentile(0.50),
+            'latency_p95_s': percentile(0.95),
+            'latency_max_s': latencies[-1] if latencies else 0.0,
+        }
+
+    def report(self):
+        s = self.summary()
+        print(f"Matched {s['files_matched']} files ({s['files_failed']} failed) in {s['elapsed_s']:.2f} s: "
+              f"{s['files_per_s']:.1f} files/s, {s['mb_per_s']:.2f} MB/s, latency p50 {s['latency_p50_s']:.3f} s, "
+              f"p95 {s['latency_p95_s']:.3f} s, max {s['latency_max_s']:.3f} s")
+        for gpx_file, error in self.failed.items():
+            print(f"  failed: {gpx_file} ({error})")
+
+
+async def _post(session, url, data, params, breaker, retries, backoff_s, metrics):
+    """
+    POST with the retries, backoff and circuit breaking of matching_backend.RequestAttempts.
+    Returns (response body or None, attempts, MatchError or None).
     """
-    url = 'http://localhost:8989/match'
     headers = {'Content-Type': 'application/gpx+xml'}
-    
-    with open(gpx_file, 'rb') as f:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, data=f, params={'vehicle': vehicle, 'type': 'json'}) as response:
-                if response.status == 200:
-                    result_data = await response.json()
-                    with open(result_file, 'w') as result_f:
-                        result_f.write(response.text)
-                    print(f"Map matching completed for {gpx_file}. Result saved to {result_file}")
-                else:
-                    print(f"Error in map matching for {gpx_file}: {response.text}")
-
-async def process_directory(directory):
+    attempts = RequestAttempts(url, breaker, retries, backoff_s, metrics, len(data))
+    for wait_s in attempts:
+        await asyncio.sleep(wait_s)
+        if not attempts.begin():
+            break
+        try:
+            async with session.post(url, headers=headers, data=data, params=params) as response:
+                body = await response.read()
+                status = response.status
+                retry_after = response.headers.get('Retry-After')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            attempts.failed(e)
+            continue
+        if attempts.responded(status, body, retry_after):
+            return body, attempts.count, None
+    return None, attempts.count, attempts.error
+
+
+async def map_matching_async(session, gpx_file, result_file, vehicle='car', url=MATCH_URL, stats=None, cache=None,
+                             breaker=None, retries=DEFAULT_RETRIES, backoff_s=DEFAULT_BACKOFF_S, metrics=None):
     """
-    Process all GPS files in the directory and subdirectories for map matching.
+    Asynchronous map matching using GraphHopper.
+    Uses the caller's pooled session (whose timeouts apply to every attempt); file reads and
+    writes run in worker threads so the event loop keeps other requests moving. With a
+    MatchCache, unchanged requests are answered from disk. Failed requests are retried with
+    backoff, and a CircuitBreaker shared by the batch stops requests while the server keeps
+    failing, so a dead server fails the remaining files quickly instead of stalling on each.
+    The response is decoded once and saved in the format of result_file's extension (see
+    matching_backend.save_response), off the event loop.
+    The read, match (cache lookup, requests and retries) and write stages are timed into metrics
+    (default: instrumentation.METRICS). Returns a MatchResult.
     """
+    params = {'vehicle': vehicle, 'type': 'json'}
+    breaker = breaker if breaker is not None else CircuitBreaker()
+    metrics = metrics if metrics is not None else METRICS
+    with metrics.stage('read') as stage:
+        data = await asyncio.to_thread(_read_bytes, gpx_file)
+        stage.bytes_read = len(data)
+
+    start = time.perf_counter()
+    if cache is not None:
+        key = MatchCache.key(data, url, params)
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            latency = time.perf_counter() - start
+            metrics.record('match', latency, bytes_read=len(cached), bytes_written=len(data))
+            return await _save_result(gpx_file, result_file, data, cached, latency, 0, stats, metrics, True)
+
+    body, attempts, error = await _post(session, url, data, params, breaker, retries, backoff_s, metrics)
+    latency = time.perf_counter() - start
+    metrics.record('match', latency, bytes_read=len(body or b''), bytes_written=len(data), error=error is not None)
+    if error is not None:
+        if stats is not None:
+            stats.failed[gpx_file] = str(error)
+        return MatchResult('graphhopper', attempts=attempts, latency_s=latency, error=error)
+
+    result = await _save_result(gpx_file, result_file, data, body, latency, attempts, stats, metrics)
+    if cache is not None and result.ok:
+        await asyncio.to_thread(cache.put, key, body)
+    return result
+
+
+async def _save_result(gpx_file, result_file, data, body, latency, attempts, stats, metrics, from_cache=False):
+    """
+    Decode and save a response (the 'write' stage) and build the MatchResult of map_matching_async.
+    """
+    try:
+        with metrics.stage('write', bytes_read=len(body)) as stage:
+            matched = await asyncio.to_thread(save_response, body, result_file, data)
+            stage.points = len(matched.track)
+            stage.bytes_written = file_size(result_file)
+    except MatchError as e:
+        if stats is not None:
+            stats.failed[gpx_file] = str(e)
+        return MatchResult('graphhopper', body=body, attempts=attempts, latency_s=latency, from_cache=from_cache,
+                           error=e)
+    if stats is not None:
+        stats.record(gpx_file, latency, len(data))
+    return MatchResult('graphhopper', body=body, track=matched.track, attempts=attempts, latency_s=latency,
+                       from_cache=from_cache, result_file=result_file, metadata=matched.metadata())
+
+
+def find_gpx_files(directory):
+    """
+    All input .gpx files under directory, skipping results and intermediates of earlier runs
+    (see trackio.is_output_file).
+    """
+    gpx_files = []
     for root, _, files in os.walk(directory):
         for file in files:
-            if file.endswith('.gpx'):
-                input_gpx_file = os.path.join(root, file)
-                result_file = input_gpx_file.replace(".gpx", "_snapped.gpx")
-                await map_matching_async(input_gpx_file, result_file)
+            if file.endswith('.gpx') and not is_output_file(file):
+                gpx_files.append(os.path.join(root, file))
+    return gpx_files
+
+
+async def process_directory(directory, vehicle='car', concurrency=DEFAULT_CONCURRENCY, url=MATCH_URL, cache=None,
+                            connect_timeout_s=DEFAULT_CONNECT_TIMEOUT_S, read_timeout_s=DEFAULT_READ_TIMEOUT_S,
+                            retries=DEFAULT_RETRIES, backoff_s=DEFAULT_BACKOFF_S, metrics=None, manifest=None):
+    """
+    Process all GPS files in the directory and subdirectories for map matching.
+    Up to `concurrency` requests run at once over a single pooled session. A request gives up
+    after connect_timeout_s without a connection or read_timeout_s without data, so one slow
+    server does not hold up the batch; failures are retried up to `retries` times.
+    Stage timings and request latencies go to metrics (default: instrumentation.METRICS).
+    With a manifest.Manifest, files matched before and unchanged since are skipped and every
+    file's outcome is recorded, so an interrupted batch resumes where it stopped.
+    """
+    gpx_files = await asyncio.to_thread(find_gpx_files, directory)
+    stats = BatchStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    breaker = CircuitBreaker()
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout_s, sock_read=read_timeout_s)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def match_one(input_gpx_file):
+            result_file = with_suffix(input_gpx_file, "_snapped")
+            claim_config = {'snapped': os.path.abspath(result_file), 'vehicle': vehicle, 'url': url}
+            if manifest is not None and not await asyncio.to_thread(manifest.claim, input_gpx_file, claim_config):
+                return
+            result = await map_matching_async(session, input_gpx_file, result_file, vehicle, url, stats, cache,
+                                              breaker, retries, backoff_s, metrics)
+            if manifest is None:
+                return
+            if result.ok:
+                await asyncio.to_thread(manifest.complete, input_gpx_file, {'snapped': result_file})
+            else:
+                await asyncio.to_thread(manifest.fail, input_gpx_file, result.error, 'match')
+
+        async def guarded(input_gpx_file):
+            # Anything but a MatchError (an unreadable file, a manifest error) fails this file only
+            async with semaphore:
+                try:
+                    await match_one(input_gpx_file)
+                except Exception as e:
+                    stats.failed[input_gpx_file] = f"{type(e).__name__}: {e}"
+                    if manifest is None:
+                        return
+                    try:
+                        await asyncio.to_thread(manifest.fail, input_gpx_file, e)
+                    except Exception as manifest_error:
+                        stats.failed[input_gpx_file] += f" (not recorded in the manifest: {manifest_error})"
+
+        await asyncio.gather(*(guarded(gpx_file) for gpx_file in gpx_files))
+
+    stats.report()
+    if cache is not None:
+        cache.report()
+    return stats
+
 
 # Running the async processing for a directory
-directory = "path_to_your_directory_with_gpx_files"  # Change this to your directory path
-asyncio.run(process_directory(directory))
+if __name__ == "__main__":
+    directory = "path_to_your_directory_with_gpx_files"  # Change this to your directory path
+    asyncio.run(process_directory(directory, cache=MatchCache()))
+    METRICS.report()
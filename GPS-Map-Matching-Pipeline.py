@@ -1,131 +1,51 @@
-//Preprocessing:
+"""
+Preprocessing:
  remove_outliers: Removes GPS points that are far from the previous point (outliers).
 interpolate_gpx: Interpolates missing points by linearly interpolating between existing points.
 Map Matching:
-Uses GraphHopper API to send the cleaned/interpolated GPX file for map matching and get back snapped data.
+Uses GraphHopper API to send the cleaned/interpolated track for map matching and get back snapped data.
+The stages pass the track along in memory; intermediate files are only written with debug=True.
 Post-processing:
-Renames snapped files, cleans up intermediate files (like cleaned or interpolated), and saves the result.
+post_process_gpx_files renames snapped files and cleans up intermediate files left by older runs.
+With a manifest (manifest.Manifest) reruns skip unchanged inputs and only recorded outputs are renamed.
 Validation:
-Validates snapped data by checking if the coordinates fall within acceptable ranges.
+Validates snapped data by checking if the coordinates fall within acceptable ranges and, given a
+road network extract (road_index.RoadIndex), how many points lie off the road.
 Visualization:
 Uses Folium to visualize the snapped track on a map.
 Usage:
-Replace the input_gpx_file, output_gpx_file, and directory variables with appropriate paths and run the process_gpx_file function to execute the complete pipeline.
+Replace the input_gpx_file and output_gpx_file variables with appropriate paths and run the process_gpx_file function to execute the complete pipeline.
 
-Let me know if you need any adjustments or additions to this workflow! 
+Let me know if you need any adjustments or additions to this workflow!
+"""
 
+import contextlib
 import os
-import requests
-import xml.etree.ElementTree as ET
-from geopy.distance import geodesic
-import folium
 
-# Preprocessing: Remove outliers from GPX file
-def remove_outliers(gpx_file, threshold_km=0.1):
-    """
-    Remove outliers by calculating the distance between consecutive points.
-    If the distance between points exceeds the threshold, it's considered an outlier.
-    """
-    tree = ET.parse(gpx_file)
-    root = tree.getroot()
-
-    valid_trkpts = []
-    prev_point = None
-
-    for trkpt in root.findall(".//trkpt"):
-        lat = float(trkpt.attrib['lat'])
-        lon = float(trkpt.attrib['lon'])
-        timestamp = trkpt.find("time").text
-
-        if prev_point:
-            distance = geodesic((prev_point['lat'], prev_point['lon']), (lat, lon)).km
-            if distance <= threshold_km:
-                valid_trkpts.append(trkpt)
-        else:
-            valid_trkpts.append(trkpt)
-
-        prev_point = {'lat': lat, 'lon': lon, 'timestamp': timestamp}
-    
-    # Remove all trkpt elements and re-add valid ones
-    trkseg = root.find(".//trkseg")
-    for trkpt in trkseg.findall("trkpt"):
-        trkseg.remove(trkpt)
-
-    for trkpt in valid_trkpts:
-        trkseg.append(trkpt)
-
-    # Save the cleaned gpx file
-    tree.write("cleaned_" + gpx_file)
-    print(f"Outliers removed and saved as cleaned_{gpx_file}")
-
-# Preprocessing: Interpolate missing points in the GPX file
-def interpolate_gpx(gpx_file):
-    """
-    Interpolate missing points in the GPX file to fill gaps between valid points.
-    """
-    tree = ET.parse(gpx_file)
-    root = tree.getroot()
-    trkseg = root.find(".//trkseg")
-
-    points = []
-    for trkpt in trkseg.findall("trkpt"):
-        lat = float(trkpt.attrib['lat'])
-        lon = float(trkpt.attrib['lon'])
-        timestamp = trkpt.find("time").text
-        points.append((lat, lon, timestamp))
-
-    # Interpolate between points if there are gaps
-    interpolated_points = []
-    for i in range(1, len(points)):
-        point1 = points[i-1]
-        point2 = points[i]
-
-        interpolated_points.append(point1)
-
-        # Linear interpolation between lat, lon and timestamp
-        lat1, lon1, time1 = point1
-        lat2, lon2, time2 = point2
-
-        # You can add logic for interpolating time here if necessary
-
-        interpolated_points.append((lat2, lon2, time2))
-
-    # Rebuild the GPX file with interpolated points
-    trkseg.clear()
-    for lat, lon, timestamp in interpolated_points:
-        trkpt = ET.SubElement(trkseg, "trkpt", lat=str(lat), lon=str(lon))
-        time = ET.SubElement(trkpt, "time")
-        time.text = timestamp
-
-    # Save the interpolated GPX file
-    tree.write("interpolated_" + gpx_file)
-    print(f"Interpolation completed. Saved as interpolated_{gpx_file}")
-
-# Map Matching using GraphHopper
-def map_matching(gpx_file, result_file, vehicle='car'):
-    """
-    Send GPX file to GraphHopper for map matching and get back snapped data.
-    """
-    url = 'http://localhost:8989/match'
-    headers = {'Content-Type': 'application/gpx+xml'}
-    
-    with open(gpx_file, 'rb') as f:
-        response = requests.post(url, headers=headers, data=f, params={'vehicle': vehicle, 'type': 'json'})
-    
-    if response.status_code == 200:
-        result_data = response.json()
-        with open(result_file, 'w') as result_f:
-            # Save the result as a new GPX file
-            result_f.write(response.text)
-        print(f"Map matching completed for {gpx_file}. Result saved to {result_file}")
-    else:
-        print(f"Error in map matching for {gpx_file}: {response.text}")
+# Map matching using GraphHopper (with the optional response cache) or another backend
+from chunked_matching import TrackMatcher, match_track_chunked
+# Per-stage timings, exportable as JSON or Prometheus text
+from instrumentation import METRICS, file_size, profiled
+from match_cache import MatchCache
+from matching_backend import MatchError
+# Preprocessing stages (outlier removal and interpolation) are shared with preprocessing.py
+from preprocessing import preprocess_track
+from trackio import read_track, track_extension, with_suffix, write_track
+# Validation and visualization of the snapped result
+from validation import validate_track
+from visualization import visualize_track
 
 # Post-process: Renaming, cleaning up intermediate files
-def post_process_gpx_files(directory):
+def post_process_gpx_files(directory, manifest=None):
     """
     Post-processing: Renaming snapped files and cleanup.
+    With a manifest only the snapped outputs it recorded for completed inputs under directory are
+    renamed (and the manifest updated) and only their recorded intermediates removed, instead of
+    every *_snapped.gpx found anywhere in the tree.
     """
+    if manifest is not None:
+        _post_process_recorded(directory, manifest)
+        return
     for root, _, files in os.walk(directory):
         for file in files:
             if file.endswith('_snapped.gpx'):
@@ -148,96 +68,154 @@ def post_process_gpx_files(directory):
                     os.remove(interpolated_file)
                     print(f"Removed {interpolated_file}")
 
-# Optional: Validate snapped data
-def validate_snapped_data(gpx_file):
-    """
-    Validate the snapped data by checking if the points are within reasonable proximity to a road.
-    """
-    tree = ET.parse(gpx_file)
-    root = tree.getroot()
-
-    valid = True
-    for trkpt in root.findall(".//trkpt"):
-        lat = float(trkpt.attrib['lat'])
-        lon = float(trkpt.attrib['lon'])
-        
-        if lat < -90 or lat > 90 or lon < -180 or lon > 180:
-            valid = False
-            print(f"Invalid coordinates: {lat}, {lon}")
-    
-    return valid
-
-def validate_all_files(directory):
-    """
-    Validate all snapped GPX files in the directory.
-    """
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('_snapped.gpx'):
-                gpx_file = os.path.join(root, file)
-                if validate_snapped_data(gpx_file):
-                    print(f"Valid snapped data in {gpx_file}")
-                else:
-                    print(f"Invalid snapped data in {gpx_file}")
-
-# Optional: Visualize snapped data on a map
-def visualize_gpx_on_map(gpx_file):
-    """
-    Visualize the GPX file on a map using Folium.
-    """
-    tree = ET.parse(gpx_file)
-    root = tree.getroot()
-
-    # Create a map centered on the first GPS point
-    first_point = root.find(".//trkpt")
-    lat = float(first_point.attrib['lat'])
-    lon = float(first_point.attrib['lon'])
-    m = folium.Map(location=[lat, lon], zoom_start=12)
-
-    # Add the GPS points to the map
-    points = []
-    for trkpt in root.findall(".//trkpt"):
-        lat = float(trkpt.attrib['lat'])
-        lon = float(trkpt.attrib['lon'])
-        points.append((lat, lon))
-
-    # Add polyline of the snapped track
-    folium.PolyLine(points, color='blue', weight=2.5, opacity=1).add_to(m)
-    return m
-
-def save_map_as_html(gpx_file, output_html):
-    """
-    Save the visualization as an HTML file.
-    """
-    m = visualize_gpx_on_map(gpx_file)
-    m.save(output_html)
-    print(f"Map saved as {output_html}")
+def _post_process_recorded(directory, manifest):
+    root = os.path.abspath(directory) + os.sep
+    for input_file, _, _, _ in manifest.entries('done'):
+        outputs = manifest.outputs(input_file)
+        original_file = outputs.get('snapped')
+        if not original_file or not original_file.startswith(root) or not os.path.exists(original_file):
+            continue
+        extension = track_extension(original_file)
+        base = original_file[:len(original_file) - len(extension)]
+        if not base.endswith('_snapped'):
+            continue
+        final_file = base[:-len('_snapped')] + '_matched' + extension
+        os.rename(original_file, final_file)
+        manifest.move_output(original_file, final_file)
+        print(f"File {original_file} renamed to {final_file}")
+
+        for stage in ('cleaned', 'interpolated'):
+            intermediate = outputs.get(stage)
+            if intermediate and os.path.exists(intermediate):
+                os.remove(intermediate)
+                print(f"Removed {intermediate}")
+
+def _intermediate_path(gpx_file, prefix, extension):
+    """
+    Path of a debug intermediate (cleaned_/interpolated_) next to the input file.
+    """
+    directory, name = os.path.split(gpx_file)
+    return os.path.join(directory, prefix + name[:len(name) - len(track_extension(name))] + extension)
+
+def _claim_config(output_gpx_file, vehicle, output_html, debug, backend):
+    """
+    What decides the outputs of process_gpx_file, for the manifest: a rerun with other values
+    processes the input again.
+    """
+    return {
+        'snapped': os.path.abspath(with_suffix(output_gpx_file, "_matched")),
+        'map': os.path.abspath(output_html) if output_html else None,
+        'vehicle': vehicle,
+        'debug': debug,
+        'backend': repr(backend) if backend is not None else None,
+    }
 
 # Complete workflow: Process, Map Match, Validate, and Visualize
-def process_gpx_file(input_gpx_file, output_gpx_file, directory):
-    """
-    Complete workflow: Remove outliers, interpolate, map matching, post-process, validate, and visualize.
+def process_gpx_file(input_gpx_file, output_gpx_file, cache=None, vehicle='car', output_html="snapped_map.html",
+                     debug=False, road_index=None, backend=None, metrics=None, profile_file=None, manifest=None):
+    """
+    Complete workflow: Remove outliers, interpolate, map matching, validate, and visualize.
+    The track is parsed once and handed from stage to stage in memory; the interpolated track is
+    serialized straight into the /match request body and the snapped track is validated and
+    rendered without being read back from disk.
+    With debug=True the cleaned_ and interpolated_ intermediates are also written next to the input.
+    The input can be any format trackio reads; the result (and intermediates) are written in the
+    format of output_gpx_file's extension, e.g. .npy for the binary columnar format.
+    Pass a MatchCache to skip the GraphHopper request when the preprocessed track has not changed,
+    and a RoadIndex to have validation check the snapped points against a local road network.
+    A backend (matching_backend.load_backend) replaces the default GraphHopper matcher, e.g. to
+    set timeouts and retries or to fall back to the offline matcher.
+    Every stage (parse, preprocess, match and its HTTP requests, write, validate, render) is timed
+    into metrics (default: instrumentation.METRICS); with profile_file the run is also profiled
+    with cProfile and the profile saved there.
+    With a manifest.Manifest the input is skipped if it was processed before into the same
+    outputs with the same vehicle and backend and has not changed since (the earlier result is
+    read back instead), and its status and outputs are recorded.
+    Returns the snapped Track, or None if map matching failed.
+    """
+    metrics = metrics if metrics is not None else METRICS
+    claim_config = _claim_config(output_gpx_file, vehicle, output_html, debug, backend)
+    if manifest is not None and not manifest.claim(input_gpx_file, claim_config):
+        previous = manifest.outputs(input_gpx_file).get('snapped')
+        print(f"Skipping {input_gpx_file}: unchanged since it was last processed")
+        return read_track(previous) if previous and os.path.exists(previous) else None
+
+    outputs = {}
+    try:
+        with profiled(profile_file) if profile_file else contextlib.nullcontext():
+            snapped = _process_gpx_file(input_gpx_file, output_gpx_file, cache, vehicle, output_html, debug,
+                                        road_index, backend, metrics, outputs)
+    except MatchError as e:
+        print(f"Error in map matching for {input_gpx_file}: {e}")
+        if manifest is not None:
+            manifest.fail(input_gpx_file, e, 'match')
+        return None
+    except BaseException as e:
+        if manifest is not None:
+            manifest.fail(input_gpx_file, e)
+        raise
+    if manifest is not None:
+        manifest.complete(input_gpx_file, outputs)
+    return snapped
+
+def _process_gpx_file(input_gpx_file, output_gpx_file, cache, vehicle, output_html, debug, road_index, backend,
+                      metrics, outputs):
+    """
+    The stages of process_gpx_file; the files written are added to outputs by stage name.
     """
     # Step 1: Remove outliers and interpolate the GPX file
-    remove_outliers(input_gpx_file)
-    interpolate_gpx("cleaned_" + input_gpx_file)
-    
+    with metrics.stage('parse', bytes_read=file_size(input_gpx_file)) as stage:
+        track = read_track(input_gpx_file)
+        stage.points = len(track)
+    with metrics.stage('preprocess', points=len(track)):
+        cleaned, interpolated = preprocess_track(track)
+    if debug:
+        extension = track_extension(output_gpx_file)
+        with metrics.stage('write_intermediate') as stage:
+            for prefix, intermediate in (("cleaned_", cleaned), ("interpolated_", interpolated)):
+                path = _intermediate_path(input_gpx_file, prefix, extension)
+                write_track(intermediate, path)
+                outputs[prefix.rstrip('_')] = path
+                stage.points += len(intermediate)
+                stage.bytes_written += file_size(path)
+
     # Step 2: Map matching
-    result_file = output_gpx_file.replace(".gpx", "_snapped.gpx")
-    map_matching("interpolated_" + input_gpx_file, result_file)
-    
-    # Step 3: Post-process (rename and cleanup)
-    post_process_gpx_files(directory)
-    
+    matcher = backend if backend is not None else TrackMatcher(vehicle, cache=cache, metrics=metrics)
+    try:
+        with metrics.stage('match', points=len(interpolated)):
+            snapped = match_track_chunked(interpolated, vehicle, matcher=matcher)
+    finally:
+        if backend is None:
+            matcher.close()
+
+    # Step 3: Save under the final name (no rename/cleanup pass over the directory needed)
+    result_file = with_suffix(output_gpx_file, "_matched")
+    with metrics.stage('write', points=len(snapped)) as stage:
+        write_track(snapped, result_file)
+        stage.bytes_written = file_size(result_file)
+    outputs['snapped'] = result_file
+    print(f"Map matching completed for {input_gpx_file}. Result saved to {result_file}")
+
     # Step 4: Validate snapped data
-    validate_all_files(directory)
-    
+    with metrics.stage('validate', points=len(snapped)):
+        valid = validate_track(snapped, road_index)
+    if valid:
+        print(f"Valid snapped data in {result_file}")
+    else:
+        print(f"Invalid snapped data in {result_file}")
+
     # Step 5: Visualize the result
-    save_map_as_html(result_file, "snapped_map.html")
+    if output_html and len(snapped):
+        with metrics.stage('render', points=len(snapped)) as stage:
+            visualize_track(snapped).save(output_html)
+            stage.bytes_written = file_size(output_html)
+        outputs['map'] = output_html
+        print(f"Map saved as {output_html}")
+    return snapped
 
 # Example usage
-input_gpx_file = "path_to_input_file.gpx"  # Replace with the path to your GPX file
-output_gpx_file = "path_to_output_file.gpx"  # Replace with the path to the output file
-directory = "path_to_directory_with_gpx_files"  # Replace with the directory path containing your files
-process_gpx_file(input_gpx_file, output_gpx_file, directory)
-
+if __name__ == "__main__":
+    input_gpx_file = "path_to_input_file.gpx"  # Replace with the path to your GPX file
+    output_gpx_file = "path_to_output_file.gpx"  # Replace with the path to the output file
+    process_gpx_file(input_gpx_file, output_gpx_file, cache=MatchCache())
+    METRICS.report()
@@ -0,0 +1,323 @@
+"""
+Directory-level driver for the full pipeline.
+
+CPU-bound stages (GPX parsing, outlier removal, interpolation, validation, Folium rendering)
+run in a ProcessPoolExecutor, one file per task, while the network-bound GraphHopper requests
+run concurrently in a thread pool. A bounded number of files may be in flight between
+preprocessing and the end of postprocessing at once, so a slow server or a slow save/validate/
+render stage throttles preprocessing instead of filling memory.
+
+Runs are incremental: a manifest (by default .pipeline_manifest.sqlite in the directory) records
+the content hash, status and outputs of every input, so a re-run only processes new, changed and
+previously failed files, and picks up where an interrupted run stopped.
+
+Usage:
+    python batch_pipeline.py path/to/gpx_directory --workers 8 --match-workers 8
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from chunked_matching import DEFAULT_OVERLAP_POINTS, DEFAULT_WINDOW_POINTS, TrackMatcher, match_track_chunked
+from manifest import DEFAULT_MANIFEST_NAME, Manifest
+from match_cache import MatchCache
+from matching_backend import MATCH_URL, load_backend
+from preprocessing import preprocess_track
+from road_index import load_road_index
+from trackio import WRITE_EXTENSIONS, is_output_file, read_track, track_extension, write_track
+from validation import validate_track
+from visualization import visualize_track
+
+STAGES = ('preprocess', 'match', 'validate', 'render')
+
+
+INPUT_EXTENSIONS = ('.gpx', '.gpx.gz', '.npy')
+
+
+def find_input_files(directory):
+    """
+    Input tracks (.gpx, .gpx.gz or binary .npy) under directory, skipping outputs and
+    intermediates of earlier runs.
+    """
+    gpx_files = []
+    for root, _, files in os.walk(directory):
+        for file in sorted(files):
+            extension = track_extension(file)
+            if extension not in INPUT_EXTENSIONS or is_output_file(file):
+                continue
+            gpx_files.append(os.path.join(root, file))
+    return gpx_files
+
+
+def preprocess_file(input_gpx_file, threshold_km=0.1, interval_s=1.0, max_gap_s=30.0):
+    """
+    Worker-process stage: parse, remove outliers and interpolate one file.
+    Returns (track, seconds, points read).
+    """
+    start = time.perf_counter()
+    track = read_track(input_gpx_file)
+    _, interpolated = preprocess_track(track, threshold_km=threshold_km, interval_s=interval_s, max_gap_s=max_gap_s)
+    return interpolated, time.perf_counter() - start, len(track)
+
+
+def postprocess_file(snapped, result_file, output_html=None, roads=None):
+    """
+    Worker-process stage: save (in the format of result_file's extension), validate and
+    optionally render one snapped track. With roads (a GeoJSON/OSM extract) the track is also
+    checked for off-road points; each worker loads the road index once.
+    Returns (valid, validate seconds, render seconds).
+    """
+    start = time.perf_counter()
+    write_track(snapped, result_file)
+    valid = validate_track(snapped, load_road_index(roads) if roads else None)
+    validated = time.perf_counter()
+
+    if output_html and len(snapped):
+        visualize_track(snapped).save(output_html)
+    return valid, validated - start, time.perf_counter() - validated
+
+
+class _Permit:
+    """
+    One file's slot in the in-flight bound of process_directory: taken from semaphore on
+    creation (blocking while the pipeline is full) and given back by the first release() only,
+    whichever path of the file gets there.
+    """
+
+    def __init__(self, semaphore):
+        semaphore.acquire()
+        self._semaphore = semaphore
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._semaphore.release()
+
+
+class PipelineReport:
+    """
+    Per-stage timings and outcome of a directory run. Thread-safe.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stage_times = {stage: [] for stage in STAGES}
+        self.points = 0
+        self.succeeded = []
+        self.invalid = []
+        self.skipped = []
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stage_times[stage].append(seconds)
+
+    def add_points(self, points):
+        with self._lock:
+            self.points += points
+
+    def add_result(self, gpx_file, valid):
+        with self._lock:
+            (self.succeeded if valid else self.invalid).append(gpx_file)
+
+    def add_skipped(self, gpx_file):
+        with self._lock:
+            self.skipped.append(gpx_file)
+
+    def add_failure(self, gpx_file, stage, error):
+        with self._lock:
+            self.failed[gpx_file] = f"{stage}: {error}"
+        print(f"Error in {stage} for {gpx_file}: {error}")
+
+    def summary(self):
+        wall = (self.finished or time.perf_counter()) - self.started
+        stages = {}
+        for stage, times in self.stage_times.items():
+            total = sum(times)
+            stages[stage] = {
+                'files': len(times),
+                'total_s': total,
+                'mean_s': total / len(times) if times else 0.0,
+                'max_s': max(times) if times else 0.0,
+                # Average number of files in this stage at any moment
+                'parallelism': total / wall if wall else 0.0,
+            }
+        return {
+            'wall_s': wall,
+            'files_ok': len(self.succeeded),
+            'files_invalid': len(self.invalid),
+            'files_skipped': len(self.skipped),
+            'files_failed': len(self.failed),
+            'points_in': self.points,
+            'files_per_s': len(self.succeeded) / wall if wall else 0.0,
+            'stages': stages,
+        }
+
+    def report(self):
+        s = self.summary()
+        print(f"Processed {s['files_ok']} files ({s['files_invalid']} invalid, {s['files_failed']} failed, "
+              f"{s['files_skipped']} skipped as up to date), "
+              f"{s['points_in']} points in {s['wall_s']:.2f} s ({s['files_per_s']:.2f} files/s)")
+        for stage, t in s['stages'].items():
+            print(f"  {stage:<10} {t['files']:6d} files  total {t['total_s']:8.2f} s  mean {t['mean_s']:7.3f} s  "
+                  f"max {t['max_s']:7.3f} s  parallelism {t['parallelism']:5.2f}")
+        for gpx_file, error in self.failed.items():
+            print(f"  failed: {gpx_file} ({error})")
+
+
+def process_directory(directory, workers=None, match_workers=8, max_pending=None, vehicle='car', url=MATCH_URL,
+                      cache=None, render=True, window_points=DEFAULT_WINDOW_POINTS,
+                      overlap_points=DEFAULT_OVERLAP_POINTS, output_format='.gpx', roads=None, backend=None,
+                      manifest=None):
+    """
+    Run the whole pipeline over every input GPX file under directory.
+
+    workers        processes for the CPU-bound stages (default: all cores)
+    match_workers  concurrent GraphHopper requests
+    max_pending    files that may be preprocessed but not yet postprocessed (default: 2 * match_workers);
+                   the producer blocks once this many are in flight, which bounds memory use
+    output_format  '.gpx', '.gpx.gz' or '.npy' for the <name>_snapped results
+    roads          road network extract (.geojson or .osm) for the off-road check in validation
+    backend        map-matching backend configuration (dict or JSON file, see matching_backend)
+                   used instead of a GraphHopper matcher for vehicle and url
+    manifest       manifest.Manifest; files it has done with the same settings and that are unchanged
+                   are skipped, and every file's status, failing stage and outputs are recorded in it
+    """
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 2 * match_workers
+    gpx_files = find_input_files(directory)
+    report = PipelineReport()
+
+    # What decides the outputs: a rerun with other values processes done files again
+    claim_config = {'format': output_format, 'render': render, 'roads': roads, 'vehicle': vehicle,
+                    'backend': backend if backend is not None else url, 'window_points': window_points,
+                    'overlap_points': overlap_points}
+    # A permit is held from preprocessing until the snapped track is saved, validated and rendered
+    in_flight = threading.BoundedSemaphore(max_pending)
+    if backend is not None:
+        matcher = load_backend(backend, cache)
+    else:
+        matcher = TrackMatcher(vehicle, url, match_workers, cache)
+
+    def failed(gpx_file, stage, error):
+        report.add_failure(gpx_file, stage, error)
+        if manifest is not None:
+            manifest.fail(gpx_file, error, stage)
+
+    with ProcessPoolExecutor(max_workers=workers) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=match_workers) as net_pool, matcher:
+
+        def abort(gpx_file, permit, stage, error):
+            try:
+                failed(gpx_file, stage, error)
+            finally:
+                permit.release()
+
+        # Callbacks and pool tasks swallow exceptions, so every step after a file's permit is taken
+        # either hands the permit on to the next step or ends in abort() or permit.release()
+
+        def postprocessed(gpx_file, future, outputs, permit):
+            try:
+                valid, validate_s, render_s = future.result()
+                report.add_time('validate', validate_s)
+                if render:
+                    report.add_time('render', render_s)
+                if manifest is not None:
+                    manifest.complete(gpx_file, outputs)
+                report.add_result(gpx_file, valid)
+            except Exception as e:
+                failed(gpx_file, 'postprocess', e)
+            finally:
+                permit.release()
+
+        def match(gpx_file, track, permit):
+            stage = 'match'
+            try:
+                start = time.perf_counter()
+                snapped = match_track_chunked(track, vehicle, window_points, overlap_points, matcher=matcher)
+                report.add_time('match', time.perf_counter() - start)
+                if manifest is not None:
+                    manifest.record_stage(gpx_file, 'match')
+
+                stage = 'postprocess'
+                base = gpx_file[:len(gpx_file) - len(track_extension(gpx_file))]
+                result_file = base + '_snapped' + output_format
+                outputs = {'snapped': result_file, 'map': base + '_map.html' if render else None}
+                future = cpu_pool.submit(postprocess_file, snapped, result_file, outputs['map'], roads)
+                future.add_done_callback(lambda f: postprocessed(gpx_file, f, outputs, permit))
+            except Exception as e:
+                abort(gpx_file, permit, stage, e)
+
+        def preprocessed(gpx_file, future, permit):
+            stage = 'preprocess'
+            try:
+                track, seconds, points = future.result()
+                report.add_time('preprocess', seconds)
+                report.add_points(points)
+                stage = 'match'
+                net_pool.submit(match, gpx_file, track, permit)
+            except Exception as e:
+                abort(gpx_file, permit, stage, e)
+
+        for gpx_file in gpx_files:
+            if manifest is not None and not manifest.claim(gpx_file, claim_config):
+                report.add_skipped(gpx_file)
+                continue
+            # Backpressure: wait until matching has caught up before preprocessing more files
+            permit = _Permit(in_flight)
+            try:
+                future = cpu_pool.submit(preprocess_file, gpx_file)
+                future.add_done_callback(lambda f, gpx_file=gpx_file, permit=permit: preprocessed(gpx_file, f, permit))
+            except Exception as e:
+                abort(gpx_file, permit, 'preprocess', e)
+
+        # Every file has been postprocessed (or has failed) once all permits are back
+        for _ in range(max_pending):
+            in_flight.acquire()
+
+    report.finished = time.perf_counter()
+    report.report()
+    if cache is not None:
+        cache.report()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--workers', type=int, default=None, help="Processes for CPU stages (default: all cores)")
+    parser.add_argument('--match-workers', type=int, default=8, help="Concurrent GraphHopper requests")
+    parser.add_argument('--max-pending', type=int, default=None, help="Preprocessed files waiting for matching")
+    parser.add_argument('--vehicle', default='car')
+    parser.add_argument('--url', default=MATCH_URL)
+    parser.add_argument('--backend', default=None,
+                        help="JSON map-matching backend configuration (endpoint, timeouts, retries, fallback)")
+    parser.add_argument('--format', choices=WRITE_EXTENSIONS, default='.gpx', help="Format of the snapped tracks")
+    parser.add_argument('--roads', default=None, help="GeoJSON/OSM road extract for the off-road check")
+    parser.add_argument('--no-render', action='store_true', help="Skip the Folium HTML maps")
+    parser.add_argument('--no-cache', action='store_true', help="Do not use the on-disk /match response cache")
+    parser.add_argument('--manifest', default=None,
+                        help=f"Manifest of processed files (default: {DEFAULT_MANIFEST_NAME} in the directory)")
+    parser.add_argument('--no-manifest', action='store_true', help="Process every file, record nothing")
+    args = parser.parse_args()
+
+    manifest = None
+    if not args.no_manifest:
+        manifest = Manifest(args.manifest or os.path.join(args.directory, DEFAULT_MANIFEST_NAME))
+
+    process_directory(args.directory, workers=args.workers, match_workers=args.match_workers,
+                      max_pending=args.max_pending, vehicle=args.vehicle, url=args.url,
+                      cache=None if args.no_cache else MatchCache(), render=not args.no_render,
+                      output_format=args.format, roads=args.roads, backend=args.backend, manifest=manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+End-to-end latency of chunked map matching against a single /match request.
+
+Needs a running GraphHopper (or compatible) /match endpoint. Run from the repository root:
+    python -m benchmarks.bench_chunked_matching --gpx long_track.gpx --window 500 1000 2000 --overlap 100
+    python -m benchmarks.bench_chunked_matching --out-and-back --points 3000 --window 500
+
+--out-and-back drives the synthetic track out and back the same way, so seams fall where the
+track passes each place twice; the chunked runs should then give about as many snapped points
+as the single request.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_outliers import synthetic_track
+from chunked_matching import match_track_chunked, split_windows
+from map_matchinggrasshopper import MATCH_URL
+from track import Track
+
+
+def timed_match(track, window_points, overlap_points, workers, url, vehicle):
+    start = time.perf_counter()
+    snapped = match_track_chunked(track, vehicle, window_points, overlap_points, workers, url=url)
+    return snapped, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gpx', help="Track to match (default: a synthetic 1 Hz track)")
+    parser.add_argument('--points', type=int, default=20_000, help="Length of the synthetic track")
+    parser.add_argument('--out-and-back', action='store_true',
+                        help="Return along the synthetic track's own path (half the points each way)")
+    parser.add_argument('--window', type=int, nargs='+', default=[500, 1000, 2000])
+    parser.add_argument('--overlap', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--url', default=MATCH_URL)
+    parser.add_argument('--vehicle', default='car')
+    args = parser.parse_args()
+
+    if args.gpx:
+        track = Track.from_gpx(args.gpx)
+    else:
+        if args.out_and_back:
+            lat, lon = synthetic_track(args.points // 2, rate_hz=1.0, outlier_fraction=0.0)
+            lat, lon = np.concatenate((lat, lat[::-1])), np.concatenate((lon, lon[::-1]))
+        else:
+            lat, lon = synthetic_track(args.points, rate_hz=1.0, outlier_fraction=0.0)
+        track = Track(lat, lon, time=1.7e9 + np.arange(len(lat), dtype=np.float64))
+    print(f"Track: {len(track)} points, {len(track.to_gpx_bytes()) / 1e6:.1f} MB of GPX")
+
+    runs = [('single request', len(track), 0)] + [(f"window {w}", w, args.overlap) for w in args.window]
+    for label, window, overlap in runs:
+        times = []
+        for _ in range(args.repeat):
+            snapped, elapsed = timed_match(track, window, overlap, args.workers, args.url, args.vehicle)
+            times.append(elapsed)
+        chunks = len(split_windows(len(track), window, overlap)) if overlap < window else 1
+        print(f"{label:<16}: {chunks:4d} requests, best {min(times):7.3f} s, "
+              f"median {sorted(times)[len(times) // 2]:7.3f} s, {len(snapped)} snapped points")
+
+
+if __name__ == "__main__":
+    main()
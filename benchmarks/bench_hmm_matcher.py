@@ -0,0 +1,176 @@
+"""
+Throughput and accuracy of the offline HMM matcher, optionally side by side with GraphHopper.
+
+Synthetic mode (default): random drives over a synthetic city grid (see bench_road_index),
+sampled at 1 Hz with GPS noise. The matcher is scored against the known route: the share of
+points matched to the edge they were driven on, and the distance of matched to true positions.
+
+Real data: --roads with a GeoJSON/OSM extract and --gpx with tracks inside it. With --url the
+same tracks are also sent to GraphHopper (which must serve a map of the same area), and the
+agreement of the two is the share of HMM route vertices within --agree-m of GraphHopper's route.
+
+Run from the repository root:
+    python -m benchmarks.bench_hmm_matcher --tracks 20 --points 1000
+    python -m benchmarks.bench_hmm_matcher --roads delhi.osm --gpx a.gpx b.gpx --url http://localhost:8989/match
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.bench_outliers import timed
+from benchmarks.bench_road_index import synthetic_road_grid
+from chunked_matching import TrackMatcher
+from hmm_matcher import HmmMatcher, RoadGraph
+from road_index import METERS_PER_DEGREE, RoadIndex
+from track import Track
+
+
+def random_drive(graph, n, speed_mps=12.0, noise_m=5.0, seed=0):
+    """
+    A 1 Hz drive of n points along a random walk over graph (no U-turns).
+    Returns (noisy Track, true edge per point, true lat, true lon).
+    """
+    rng = np.random.default_rng(seed)
+    indptr, neighbours = graph._indptr, graph._neighbours
+    edge_of = {}
+    for e, (u, v) in enumerate(zip(graph.edge_u.tolist(), graph.edge_v.tolist())):
+        edge_of[u, v] = edge_of[v, u] = e
+
+    node = int(rng.integers(len(graph.node_lat)))
+    previous = -1
+    edges, lat, lon = [], [], []
+    position = 0.0
+    while len(lat) < n:
+        choices = [m for m in neighbours[indptr[node]:indptr[node + 1]] if m != previous] or [previous]
+        following = int(rng.choice(choices))
+        edge = edge_of[node, following]
+        length = graph.edge_length[edge]
+        while position < length and len(lat) < n:
+            f = position / length
+            edges.append(edge)
+            lat.append(graph.node_lat[node] + f * (graph.node_lat[following] - graph.node_lat[node]))
+            lon.append(graph.node_lon[node] + f * (graph.node_lon[following] - graph.node_lon[node]))
+            position += speed_mps
+        position -= length
+        previous, node = node, following
+
+    true_lat, true_lon = np.asarray(lat), np.asarray(lon)
+    noisy_lat = true_lat + rng.normal(0, noise_m, n) / METERS_PER_DEGREE
+    noisy_lon = true_lon + rng.normal(0, noise_m, n) / (METERS_PER_DEGREE * np.cos(np.radians(true_lat)))
+    time = 1.7e9 + np.arange(n, dtype=np.float64)
+    return Track(noisy_lat, noisy_lon, time=time), np.asarray(edges), true_lat, true_lon
+
+
+def matched_points(matcher, track):
+    """
+    Matched edge and position of every point (-1 / NaN where unmatched).
+    """
+    edge = np.full(len(track), -1)
+    lat = np.full(len(track), np.nan)
+    lon = np.full(len(track), np.nan)
+    for chain in matcher.viterbi(track):
+        for candidates, i in chain:
+            edge[candidates.point] = candidates.edge[i]
+            lat[candidates.point], lon[candidates.point] = matcher._position(candidates, i)
+    return edge, lat, lon
+
+
+def route_agreement(route, reference, agree_m):
+    """
+    Share of route vertices within agree_m of the reference geometry.
+    """
+    if len(route) == 0 or len(reference) < 2:
+        return 0.0
+    segments = np.column_stack((reference.lat[:-1], reference.lon[:-1], reference.lat[1:], reference.lon[1:]))
+    distances = RoadIndex(segments, agree_m).distances_m(route.lat, route.lon)
+    return float(np.isfinite(distances).mean())
+
+
+def edge_nodes(graph, edge):
+    """
+    Sorted end nodes of edges, so parallel duplicate roads compare equal.
+    """
+    return np.sort(np.column_stack((graph.edge_u[edge], graph.edge_v[edge])), axis=1)
+
+
+def bench_synthetic(args):
+    graph, t_build = timed(RoadGraph, [s.reshape(2, 2) for s in synthetic_road_grid(args.blocks)])
+    print(f"{graph} built in {t_build:.3f} s")
+    matcher = HmmMatcher(graph)
+
+    points = correct = 0
+    errors = []
+    elapsed = 0.0
+    for seed in range(args.tracks):
+        track, true_edge, true_lat, true_lon = random_drive(graph, args.points, noise_m=args.noise_m, seed=seed)
+        (edge, lat, lon), t_match = timed(matched_points, matcher, track)
+        elapsed += t_match
+        points += len(track)
+        matched = edge >= 0
+        same_edge = (edge_nodes(graph, edge) == edge_nodes(graph, true_edge)).all(axis=1)
+        correct += int(np.count_nonzero(same_edge & matched))
+        errors.append(np.hypot((lat - true_lat)[matched] * METERS_PER_DEGREE,
+                               (lon - true_lon)[matched] * METERS_PER_DEGREE * np.cos(np.radians(true_lat[matched]))))
+
+    errors = np.concatenate(errors)
+    print(f"HMM matcher : {points} points in {elapsed:.3f} s  {points / elapsed:,.0f} points/s  "
+          f"edge accuracy {correct / points:.1%}  position error median {np.median(errors):.1f} m, "
+          f"p95 {np.percentile(errors, 95):.1f} m (GPS noise {args.noise_m:g} m)")
+
+
+def bench_files(args):
+    graph, t_build = timed(RoadGraph.from_file, args.roads)
+    print(f"{graph} built from {args.roads} in {t_build:.3f} s")
+    matcher = HmmMatcher(graph)
+    remote = TrackMatcher(url=args.url) if args.url else None
+
+    totals = {'points': 0, 'hmm': 0.0, 'graphhopper': 0.0}
+    agreement = []
+    try:
+        for gpx_file in args.gpx:
+            track = Track.from_gpx(gpx_file)
+            route, t_hmm = timed(matcher.match, track)
+            totals['points'] += len(track)
+            totals['hmm'] += t_hmm
+            line = f"{gpx_file}: {len(track)} points  HMM {t_hmm:.3f} s"
+            if remote is not None:
+                try:
+                    reference, t_remote = timed(remote.match, track)
+                except Exception as e:
+                    print(f"{line}  GraphHopper failed: {e}")
+                    continue
+                totals['graphhopper'] += t_remote
+                agreement.append(route_agreement(route, reference, args.agree_m))
+                line += f"  GraphHopper {t_remote:.3f} s  agreement {agreement[-1]:.1%}"
+            print(line)
+    finally:
+        if remote is not None:
+            remote.close()
+
+    if totals['hmm']:
+        print(f"HMM matcher : {totals['points'] / totals['hmm']:,.0f} points/s")
+    if totals['graphhopper']:
+        print(f"GraphHopper : {totals['points'] / totals['graphhopper']:,.0f} points/s  "
+              f"mean agreement {np.mean(agreement):.1%} within {args.agree_m:g} m")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=10, help="Synthetic drives")
+    parser.add_argument('--points', type=int, default=1000, help="Points per synthetic drive")
+    parser.add_argument('--blocks', type=int, default=40, help="Synthetic grid size in blocks per side")
+    parser.add_argument('--noise-m', type=float, default=5.0)
+    parser.add_argument('--roads', help="Road network extract (.geojson/.osm) for --gpx tracks")
+    parser.add_argument('--gpx', nargs='+', default=[])
+    parser.add_argument('--url', help="GraphHopper /match endpoint to compare against")
+    parser.add_argument('--agree-m', type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.roads:
+        bench_files(args)
+    else:
+        bench_synthetic(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+End-to-end latency of live_stream against a local stand-in for a receiver.
+
+A synthetic drive (see benchmarks.synthetic) is replayed as RTKLIB .pos records in real time (or
+--speedup times faster), either served over TCP like RTKLIB's tcpsvr or appended to a file that
+live_stream tails. Matching goes to the local /match stub (benchmarks.stub_server) with
+--latency-ms per request. The latency of a snapped batch is measured from the moment the
+replayer sent the newest record it covers to the moment live_stream emitted it.
+
+Run from the repository root:
+    python -m benchmarks.bench_live_stream --source tcp --points 3000 --rate-hz 10 --speedup 10
+    python -m benchmarks.bench_live_stream --source file --max-delay-ms 200 --latency-ms 20
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.stub_server import StubMatchServer
+from benchmarks.synthetic import synthetic_drive, write_pos
+from instrumentation import Metrics
+from live_stream import (DEFAULT_BATCH_POINTS, DEFAULT_MAX_DELAY_S, DEFAULT_OVERLAP_POINTS, StreamPreprocessor,
+                         iter_tail, iter_tcp, run_stream)
+from matching_backend import GraphHopperBackend
+
+# How often the replayer sends the records that have become due
+TICK_S = 0.01
+
+
+class Replayer:
+    """
+    Sends the records of a .pos file at their recording rate times speedup, through write(data)
+    (a socket's sendall or a file's write), and notes when each record went out.
+    """
+
+    def __init__(self, pos_file, rate_hz, speedup=1.0):
+        with open(pos_file, 'rb') as f:
+            lines = f.readlines()
+        self.header = b''.join(line for line in lines if line.startswith(b'%'))
+        self.records = [line for line in lines if not line.startswith(b'%')]
+        self.interval_s = 1.0 / (rate_hz * speedup)
+        self.sent_at = np.full(len(self.records), np.nan)
+
+    def run(self, write, flush=None):
+        write(self.header)
+        start = time.perf_counter()
+        sent = 0
+        while sent < len(self.records):
+            due = min(len(self.records), int((time.perf_counter() - start) / self.interval_s) + 1)
+            if due > sent:
+                write(b''.join(self.records[sent:due]))
+                if flush is not None:
+                    flush()
+                self.sent_at[sent:due] = time.perf_counter()
+                sent = due
+            time.sleep(TICK_S)
+
+
+def serve_tcp(replayer):
+    """
+    Listen on a free local port and replay to the first client in a background thread.
+    Returns the (host, port) address.
+    """
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve():
+        with server:
+            connection, _ = server.accept()
+            with connection:
+                replayer.run(connection.sendall)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()
+
+
+def append_file(replayer, path):
+    """
+    Replay into path in a background thread; returns the thread.
+    """
+    def write():
+        with open(path, 'ab') as f:
+            replayer.run(f.write, f.flush)
+
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    return thread
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', choices=('tcp', 'file'), default='tcp')
+    parser.add_argument('--points', type=int, default=3000, help="Records of the synthetic drive")
+    parser.add_argument('--rate-hz', type=float, default=10.0)
+    parser.add_argument('--speedup', type=float, default=10.0, help="Replay this many times faster than real time")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Stub /match latency per request")
+    parser.add_argument('--batch-points', type=int, default=DEFAULT_BATCH_POINTS)
+    parser.add_argument('--overlap-points', type=int, default=DEFAULT_OVERLAP_POINTS)
+    parser.add_argument('--max-delay-ms', type=float, default=DEFAULT_MAX_DELAY_S * 1000)
+    parser.add_argument('--interval-s', type=float, default=1.0)
+    args = parser.parse_args()
+
+    drive = synthetic_drive(args.points, args.rate_hz)
+    metrics = Metrics()
+    latencies = []
+    snapped_points = batches = 0
+    with tempfile.TemporaryDirectory() as directory, StubMatchServer(args.latency_ms / 1000) as stub, \
+            GraphHopperBackend(stub.url) as backend:
+        pos_file = os.path.join(directory, 'drive.pos')
+        write_pos(drive, pos_file)
+        replayer = Replayer(pos_file, args.rate_hz, args.speedup)
+
+        if args.source == 'tcp':
+            chunks = iter_tcp(serve_tcp(replayer))
+        else:
+            live_file = os.path.join(directory, 'live.pos')
+            open(live_file, 'wb').close()
+            append_file(replayer, live_file)
+            chunks = iter_tail(live_file, idle_timeout_s=1.0)
+
+        preprocessor = StreamPreprocessor(interval_s=args.interval_s or None)
+        start = time.perf_counter()
+        for batch in run_stream(chunks, backend, preprocessor, args.batch_points, args.overlap_points,
+                                args.max_delay_ms / 1000, metrics=metrics):
+            emitted = time.perf_counter()
+            batches += 1
+            snapped_points += len(batch.snapped)
+            # The newest record the batch needed: the first one at or after its last point
+            newest = min(int(np.searchsorted(drive.time, batch.points.time[-1])), len(drive) - 1)
+            latencies.append(emitted - replayer.sent_at[newest])
+        elapsed = time.perf_counter() - start
+
+    print(f"{args.points} records over {args.source} at {args.rate_hz * args.speedup:g} Hz, "
+          f"stub latency {args.latency_ms:g} ms: {batches} batches, {snapped_points} snapped points in {elapsed:.2f} s "
+          f"({stub.requests} requests)")
+    print(f"Send-to-emit latency: p50 {percentile(latencies, 50) * 1000:.1f} ms, "
+          f"p95 {percentile(latencies, 95) * 1000:.1f} ms, max {max(latencies, default=0.0) * 1000:.1f} ms")
+    metrics.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark the vectorized outlier kernel against the per-pair geopy geodesic loop.
+
+Run from the repository root:
+    python -m benchmarks.bench_outliers --points 200000 --threshold-km 0.1
+"""
+import argparse
+import time
+
+import numpy as np
+from geopy.distance import geodesic
+
+from geodistance import outlier_mask, step_distances_km
+
+
+def synthetic_track(n, rate_hz=10.0, speed_mps=15.0, outlier_fraction=0.01, seed=0):
+    """
+    Random-walk track around New Delhi with occasional large jumps.
+    """
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.05, n))
+    step_m = speed_mps / rate_hz
+    dy = step_m * np.cos(heading)
+    dx = step_m * np.sin(heading)
+    lat = 28.6 + np.cumsum(dy) / 111_320.0
+    lon = 77.2 + np.cumsum(dx) / (111_320.0 * np.cos(np.radians(28.6)))
+
+    jumps = rng.random(n) < outlier_fraction
+    lat[jumps] += rng.normal(0, 0.01, jumps.sum())
+    lon[jumps] += rng.normal(0, 0.01, jumps.sum())
+    return lat, lon
+
+
+def geopy_mask(lat, lon, threshold_km):
+    """
+    The original remove_outliers loop, kept here as the reference implementation.
+    """
+    keep = [True]
+    for i in range(1, len(lat)):
+        distance = geodesic((lat[i - 1], lon[i - 1]), (lat[i], lon[i])).km
+        keep.append(distance <= threshold_km)
+    return np.array(keep, dtype=bool)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=100_000)
+    parser.add_argument('--threshold-km', type=float, default=0.1)
+    parser.add_argument('--geopy-points', type=int, default=20_000,
+                        help="Only the first N points go through geopy (it is slow); timings are scaled up")
+    args = parser.parse_args()
+
+    lat, lon = synthetic_track(args.points)
+    n_ref = min(args.geopy_points, args.points)
+
+    ref_mask, t_geopy = timed(geopy_mask, lat[:n_ref], lon[:n_ref], args.threshold_km)
+    t_geopy_scaled = t_geopy * args.points / n_ref
+    print(f"geopy geodesic loop : {t_geopy_scaled:9.3f} s for {args.points} points "
+          f"(measured {t_geopy:.3f} s on {n_ref})")
+
+    for method in ('haversine', 'ellipsoidal'):
+        mask, t = timed(outlier_mask, lat, lon, args.threshold_km, method)
+        mismatches = int(np.count_nonzero(mask[:n_ref] != ref_mask))
+        ref_d = np.array([geodesic((lat[i - 1], lon[i - 1]), (lat[i], lon[i])).km for i in range(1, min(n_ref, 2000))])
+        d = step_distances_km(lat[:min(n_ref, 2000)], lon[:min(n_ref, 2000)], method=method)
+        rel_err = float(np.max(np.abs(d - ref_d) / np.maximum(ref_d, 1e-12)))
+        print(f"{method:<20}: {t:9.3f} s  speedup x{t_geopy_scaled / t:,.0f}  "
+              f"mask mismatches {mismatches}/{n_ref}  max rel. distance error {rel_err:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark the bulk .pos loader against per-line parsing with float() and strptime.
+
+Run from the repository root:
+    python -m benchmarks.bench_pos_loader --lines 2000000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from pos_loader import load_pos
+
+RTKLIB_HEADER = (
+    "% program   : RTKPOST ver.2.4.3\n"
+    "% (lat/lon/height=WGS84/ellipsoidal,Q=1:fix,2:float,3:sbas,4:dgps,5:single,6:ppp,ns=# of satellites)\n"
+    "%  GPST                  latitude(deg) longitude(deg)  height(m)   Q  ns   sdn(m)   sde(m)   sdu(m)\n"
+)
+
+
+def write_rtklib_pos(path, n, rate_hz=10.0):
+    """
+    Synthetic RTKLIB solution file with n epochs.
+    """
+    rng = np.random.default_rng(0)
+    start = np.datetime64('2024-01-15T08:30:00', 'ms')
+    stamps = start + (np.arange(n) * (1000 / rate_hz)).astype('timedelta64[ms]')
+    lat = 28.6 + np.cumsum(rng.normal(0, 1e-6, n))
+    lon = 77.2 + np.cumsum(rng.normal(0, 1e-6, n))
+    height = 215 + rng.normal(0, 0.05, n)
+    with open(path, 'w') as f:
+        f.write(RTKLIB_HEADER)
+        for i in range(0, n, 100_000):
+            block = slice(i, min(i + 100_000, n))
+            text = np.datetime_as_string(stamps[block], unit='ms')
+            f.writelines(
+                f"{t[:10].replace('-', '/')} {t[11:]}   {a:.9f}   {o:.9f}   {h:9.4f}   1   8   0.0123   0.0098   0.0311\n"
+                for t, a, o, h in zip(text, lat[block], lon[block], height[block]))
+
+
+def parse_per_line(path):
+    """
+    The original approach: split every line in Python, float() each field, strptime each timestamp.
+    """
+    times, lat, lon = [], [], []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('%'):
+                continue
+            parts = line.split()
+            times.append(datetime.strptime(parts[0] + ' ' + parts[1], "%Y/%m/%d %H:%M:%S.%f").timestamp())
+            lat.append(float(parts[2]))
+            lon.append(float(parts[3]))
+    return times, lat, lon
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.pos')
+        write_rtklib_pos(path, args.lines)
+        print(f"{args.lines} lines, {os.path.getsize(path) / 1e6:.0f} MB")
+
+        _, t_lines = timed(parse_per_line, path)
+        print(f"per-line float/strptime : {t_lines:7.2f} s")
+        for use_mmap in (False, True):
+            track, t = timed(load_pos, path, use_mmap=use_mmap)
+            label = "load_pos (mmap)" if use_mmap else "load_pos"
+            print(f"{label:<24}: {t:7.2f} s  speedup x{t_lines / t:.1f}  ({len(track)} points)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark RoadIndex nearest-road distances against a brute-force scan over every segment.
+
+A synthetic city grid (150 m blocks plus random diagonal roads) is indexed and points scattered
+along its roads with a few meters of noise, plus some off-road points, are validated.
+
+Run from the repository root:
+    python -m benchmarks.bench_road_index --points 2000000 --blocks 100
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.bench_outliers import timed
+from road_index import DEFAULT_MAX_DISTANCE_M, METERS_PER_DEGREE, RoadIndex, point_segment_distance_m
+
+
+def synthetic_road_grid(blocks, block_m=150.0, diagonals=2000, lat0=28.6, lon0=77.2, seed=0):
+    """
+    (lat1, lon1, lat2, lon2) segments of a blocks x blocks street grid around (lat0, lon0),
+    one segment per block edge, plus random short diagonal roads.
+    """
+    rng = np.random.default_rng(seed)
+    dlat = block_m / METERS_PER_DEGREE
+    dlon = block_m / (METERS_PER_DEGREE * np.cos(np.radians(lat0)))
+    half = blocks // 2
+    i, j = np.meshgrid(np.arange(-half, half), np.arange(-half, half), indexing='ij')
+    lat = lat0 + i.ravel() * dlat
+    lon = lon0 + j.ravel() * dlon
+    east = np.column_stack((lat, lon, lat, lon + dlon))
+    north = np.column_stack((lat, lon, lat + dlat, lon))
+
+    start = rng.integers(0, len(lat), diagonals)
+    diagonal = np.column_stack((lat[start], lon[start], lat[start] + dlat, lon[start] + dlon))
+    return np.concatenate((east, north, diagonal))
+
+
+def points_along_roads(segments, n, noise_m=5.0, off_road_fraction=0.02, seed=1):
+    """
+    Snapped-track-like points: random positions on random segments with Gaussian noise, and a
+    few points thrown up to 500 m away.
+    """
+    rng = np.random.default_rng(seed)
+    seg = segments[rng.integers(0, len(segments), n)]
+    f = rng.random(n)
+    lat = seg[:, 0] + f * (seg[:, 2] - seg[:, 0])
+    lon = seg[:, 1] + f * (seg[:, 3] - seg[:, 1])
+    noise = np.where(rng.random(n) < off_road_fraction, 500.0, noise_m)
+    lat += rng.normal(0, 1, n) * noise / METERS_PER_DEGREE
+    lon += rng.normal(0, 1, n) * noise / (METERS_PER_DEGREE * np.cos(np.radians(lat)))
+    return lat, lon
+
+
+def brute_force_m(segments, lat, lon, max_distance_m):
+    best = np.array([point_segment_distance_m(la, lo, *segments.T).min() for la, lo in zip(lat, lon)])
+    best[best > max_distance_m] = np.inf
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=1_000_000)
+    parser.add_argument('--blocks', type=int, default=100, help="Grid size in blocks per side")
+    parser.add_argument('--max-distance-m', type=float, default=DEFAULT_MAX_DISTANCE_M)
+    parser.add_argument('--brute-points', type=int, default=500,
+                        help="Only the first N points are checked by brute force; timings are scaled up")
+    args = parser.parse_args()
+
+    segments = synthetic_road_grid(args.blocks)
+    index, t_build = timed(RoadIndex, segments, args.max_distance_m)
+    print(f"{index} built in {t_build:.3f} s")
+
+    lat, lon = points_along_roads(segments, args.points)
+    distances, t_index = timed(index.distances_m, lat, lon)
+
+    n_ref = min(args.brute_points, args.points)
+    ref, t_brute = timed(brute_force_m, segments, lat[:n_ref], lon[:n_ref], args.max_distance_m)
+    t_brute_scaled = t_brute * args.points / n_ref
+    mismatches = int(np.count_nonzero(np.isfinite(ref) != np.isfinite(distances[:n_ref])))
+    near = np.isfinite(ref)
+    error = float(np.max(np.abs(distances[:n_ref][near] - ref[near]))) if near.any() else 0.0
+
+    print(f"brute force         : {t_brute_scaled:9.3f} s for {args.points} points "
+          f"(measured {t_brute:.3f} s on {n_ref})")
+    print(f"RoadIndex           : {t_index:9.3f} s  {args.points / t_index / 1e6:.2f} M points/s  "
+          f"speedup x{t_brute_scaled / t_index:,.0f}  mismatches {mismatches}/{n_ref}  max error {error:.2e} m  "
+          f"({np.isfinite(distances).mean():.0%} of points near a road)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+HTML size and render time of Folium maps with and without polyline simplification.
+
+Synthetic 10 Hz random-walk tracks (see bench_outliers, without outliers) are rendered into one
+map with every point, with Ramer-Douglas-Peucker and with Visvalingam-Whyatt, and once more as a
+grid-aggregated heatmap.
+
+Run from the repository root:
+    python -m benchmarks.bench_visualization --tracks 10 --points 200000 --tolerance-m 1
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.bench_outliers import synthetic_track
+from track import Track
+from visualization import DEFAULT_MAX_POINTS, DEFAULT_TOLERANCE_M, visualize_tracks
+
+
+def render(tracks, path, **options):
+    """
+    Build and save one map. Returns (seconds, bytes).
+    """
+    start = time.perf_counter()
+    visualize_tracks(tracks, **options).save(path)
+    return time.perf_counter() - start, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=10)
+    parser.add_argument('--points', type=int, default=100_000, help="Points per track")
+    parser.add_argument('--tolerance-m', type=float, default=DEFAULT_TOLERANCE_M)
+    parser.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS)
+    args = parser.parse_args()
+
+    tracks = [Track(*synthetic_track(args.points, outlier_fraction=0.0, seed=seed)) for seed in range(args.tracks)]
+    total = args.tracks * args.points
+    cases = [
+        ('every point', dict(tolerance_m=0)),
+        ('rdp', dict(tolerance_m=args.tolerance_m, method='rdp', max_points=args.max_points)),
+        ('visvalingam', dict(tolerance_m=args.tolerance_m, method='visvalingam', max_points=args.max_points)),
+        ('heatmap only', dict(heatmap=True, show_tracks=False)),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        for label, options in cases:
+            seconds, size = render(tracks, os.path.join(directory, 'map.html'), **options)
+            print(f"{label:<13}: {total} points  {seconds:7.3f} s  {size / 1e6:8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
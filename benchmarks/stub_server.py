@@ -0,0 +1,167 @@
+"""
+Local stand-in for a GraphHopper /match endpoint, so matching can be benchmarked without a
+routing server.
+
+The stub parses the posted GPX and answers with the points unchanged, shaped like a /match
+response: JSON with encoded points (GraphHopper's default), GeoJSON points with
+points_encoded=false, or GPX with type=gpx. Each request waits latency_s (plus up to jitter_s,
+seeded) before answering, and a share error_rate of requests fails with 503, so retry and
+backoff costs show up in the numbers too.
+
+Run from the repository root to serve on a fixed port:
+    python -m benchmarks.stub_server --port 8989 --latency-ms 50 --jitter-ms 20
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from geodistance import haversine_km
+from match_response import encode_polyline
+from track import Track
+
+
+def match_response(track, params):
+    """
+    Body of the stub's answer for track: (content type, bytes).
+    """
+    if params.get('type') == 'gpx':
+        return 'application/gpx+xml', track.to_gpx_bytes()
+    distance = float(haversine_km(track.lat[:-1], track.lon[:-1], track.lat[1:], track.lon[1:]).sum()
+                     * 1000.0) if len(track) > 1 else 0.0
+    path = {'distance': distance, 'time': int(distance / 15.0 * 1000)}
+    if params.get('points_encoded', 'true') == 'false':
+        path['points_encoded'] = False
+        path['points'] = {'type': 'LineString',
+                          'coordinates': [[lon, lat] for lat, lon in zip(track.lat.tolist(), track.lon.tolist())]}
+    else:
+        path['points_encoded'] = True
+        path['points'] = encode_polyline(np.column_stack((track.lat, track.lon)))
+    body = {'map_matching': {'distance': distance, 'time': path['time'], 'original_distance': distance},
+            'paths': [path]}
+    return 'application/json', json.dumps(body).encode('utf-8')
+
+
+class StubMatchServer:
+    """
+    The stub on 127.0.0.1 in a background thread; port=0 picks a free port. Use as a context
+    manager, or start() and stop(). requests and failures count what it has answered.
+    """
+
+    def __init__(self, latency_s=0.05, jitter_s=0.0, error_rate=0.0, port=0, seed=0):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/match"
+
+    def __repr__(self):
+        return f"StubMatchServer({self.url}, latency_s={self.latency_s}, jitter_s={self.jitter_s})"
+
+    def _draw(self):
+        """
+        Delay and failure of the next request.
+        """
+        with self._lock:
+            self.requests += 1
+            delay = self.latency_s + self._random.uniform(0, self.jitter_s)
+            fail = self._random.random() < self.error_rate
+            self.failures += fail
+        return delay, fail
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                delay, fail = stub._draw()
+                time.sleep(delay)
+                if url.path != '/match':
+                    self._send(404, 'text/plain', b'Not found')
+                elif fail:
+                    self._send(503, 'text/plain', b'Stub failure')
+                else:
+                    params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                    try:
+                        track = Track.from_gpx(io.BytesIO(data))
+                    except SyntaxError as e:
+                        self._send(400, 'application/json', json.dumps({'message': str(e)}).encode('utf-8'))
+                        return
+                    self._send(200, *match_response(track, params))
+
+        return Handler
+
+    def serve_forever(self):
+        """
+        Serve in the calling thread until interrupted.
+        """
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8989)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubMatchServer(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.port)
+    print(f"Serving {server.url} (Ctrl-C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Answered {server.requests} requests ({server.failures} failed)")
+
+
+if __name__ == "__main__":
+    main()
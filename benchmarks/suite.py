@@ -0,0 +1,255 @@
+"""
+Reproducible benchmark suite: every pipeline stage on a synthetic recording, with the results
+saved as JSON so versions can be compared.
+
+A seeded drive (see benchmarks.synthetic) is written as .pos, .kml and GPX into a temporary
+directory, and the stages run on it in pipeline order, each on the previous stage's output:
+
+    parse_pos_file        mergeintosinglegpx, the receiver's .pos log
+    parse_kml_file        mergeintosinglegpx, the phone's .kml log
+    merge_data            the two parsed tracks
+    remove_outliers       preprocessing, streaming the receiver GPX
+    interpolate_gpx       preprocessing, the cleaned GPX
+    map_matching          map_matchinggrasshopper against a local /match stub (benchmarks.stub_server)
+                          with --latency-ms per request, the interpolated GPX
+    visualize_gpx_on_map  visualization, the snapped result, including saving the HTML
+
+Each stage is timed --repeat times; its peak memory (Python and NumPy allocations, traced with
+tracemalloc) is taken in one more run, so tracing does not slow the timed runs. The JSON holds
+points, best and median seconds, points/s and peak MB per stage, plus the configuration and the
+environment (Python, NumPy, git commit). With --baseline, stages whose points/s dropped or whose
+peak memory grew by more than --max-regression are reported and the exit status is 1.
+
+Run from the repository root:
+    python -m benchmarks.suite --points 200000 --latency-ms 50 --output results/new.json --baseline results/old.json
+    python -m benchmarks.suite --compare results/old.json results/new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.stub_server import StubMatchServer
+from benchmarks.synthetic import generate_dataset
+from map_matchinggrasshopper import map_matching
+from matching_backend import GraphHopperBackend
+from mergeintosinglegpx import merge_data, parse_kml_file, parse_pos_file
+from preprocessing import interpolate_gpx, remove_outliers
+from trackio import read_track
+from visualization import visualize_gpx_on_map
+
+SUITE_VERSION = 1
+DEFAULT_MAX_REGRESSION = 0.10
+
+
+def _quiet(fn, *args, **kwargs):
+    """
+    Call fn with its progress prints swallowed.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def measure(fn, repeat=3):
+    """
+    Time fn() repeat times, then once more under tracemalloc. Returns (seconds of each timed
+    run, peak traced bytes).
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return runs, peak
+
+
+def stage_result(points, runs, peak):
+    best = min(runs)
+    return {
+        'points': points,
+        'runs_s': runs,
+        'best_s': best,
+        'median_s': float(np.median(runs)),
+        'points_per_s': points / best if best else None,
+        'peak_mb': peak / 1e6,
+    }
+
+
+def environment():
+    """
+    What produced a result: Python, NumPy, platform and the git commit of the tree.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+    }
+
+
+def run_suite(points=100_000, rate_hz=10.0, noise_m=2.0, outlier_fraction=0.001, latency_s=0.05, repeat=3, seed=0,
+              stages=None):
+    """
+    Run the stages (default: all) on a fresh synthetic dataset. Returns the result dict that
+    --output saves.
+    """
+    config = {'points': points, 'rate_hz': rate_hz, 'noise_m': noise_m, 'outlier_fraction': outlier_fraction,
+              'latency_s': latency_s, 'repeat': repeat, 'seed': seed}
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory, StubMatchServer(latency_s, seed=seed) as stub, \
+            GraphHopperBackend(stub.url) as backend:
+        paths = generate_dataset(directory, points, rate_hz, noise_m, outlier_fraction, seed=seed)
+        # remove_outliers and interpolate_gpx write next to the working directory
+        os.chdir(directory)
+        try:
+            gpx = os.path.basename(paths['gpx'])
+            pos_track = parse_pos_file(paths['pos'])
+            kml_track = parse_kml_file(paths['kml'])
+            snapped = 'drive_snapped.gpx'
+            suite = [
+                ('parse_pos_file', lambda: parse_pos_file(paths['pos']), lambda: len(pos_track)),
+                ('parse_kml_file', lambda: parse_kml_file(paths['kml']), lambda: len(kml_track)),
+                ('merge_data', lambda: merge_data(pos_track, kml_track, tolerance_s=0.5),
+                 lambda: len(pos_track) + len(kml_track)),
+                ('remove_outliers', lambda: _quiet(remove_outliers, gpx), lambda: len(read_track(gpx))),
+                ('interpolate_gpx', lambda: _quiet(interpolate_gpx, 'cleaned_' + gpx),
+                 lambda: len(read_track('cleaned_' + gpx))),
+                ('map_matching', lambda: _match(backend, 'interpolated_cleaned_' + gpx, snapped),
+                 lambda: len(read_track('interpolated_cleaned_' + gpx))),
+                ('visualize_gpx_on_map', lambda: visualize_gpx_on_map(snapped).save('map.html'),
+                 lambda: len(read_track(snapped))),
+            ]
+            for name, fn, count in suite:
+                if stages and name not in stages:
+                    # Run once untimed anyway: later stages read its output
+                    _quiet(fn)
+                    continue
+                runs, peak = measure(fn, repeat)
+                results[name] = stage_result(count(), runs, peak)
+                print(format_stage(name, results[name]), flush=True)
+        finally:
+            os.chdir(cwd)
+
+    return {
+        'suite_version': SUITE_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': environment(),
+        'config': config,
+        'stages': results,
+    }
+
+
+def _match(backend, gpx_file, result_file):
+    result = map_matching(gpx_file, result_file, backend=backend)
+    if not result.ok:
+        raise RuntimeError(f"Map matching against the stub failed: {result.error}")
+
+
+def format_stage(name, result):
+    return (f"{name:<21}: {result['points']:9d} points  best {result['best_s']:8.3f} s  "
+            f"median {result['median_s']:8.3f} s  {result['points_per_s'] or 0:12,.0f} points/s  "
+            f"peak {result['peak_mb']:8.1f} MB")
+
+
+def compare(baseline, current, max_regression=DEFAULT_MAX_REGRESSION):
+    """
+    Regressions of current against baseline: (stage, what, baseline value, current value) for
+    every stage whose points/s fell, or whose peak memory rose, by more than max_regression.
+    """
+    regressions = []
+    for name, now in current['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None:
+            continue
+        if before['points_per_s'] and now['points_per_s'] < before['points_per_s'] * (1 - max_regression):
+            regressions.append((name, 'points_per_s', before['points_per_s'], now['points_per_s']))
+        if before['peak_mb'] and now['peak_mb'] > before['peak_mb'] * (1 + max_regression):
+            regressions.append((name, 'peak_mb', before['peak_mb'], now['peak_mb']))
+    return regressions
+
+
+def report_comparison(baseline, current, max_regression=DEFAULT_MAX_REGRESSION):
+    """
+    Print the change of every stage against baseline and the regressions; returns their count.
+    """
+    if baseline.get('config') != current.get('config'):
+        print("Warning: the runs used different configurations; the numbers are not comparable")
+    print(f"Against {baseline['environment'].get('commit')} ({baseline['created']}):")
+    for name, now in current['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None:
+            continue
+        speed = now['points_per_s'] / before['points_per_s'] - 1 if before['points_per_s'] else 0.0
+        memory = now['peak_mb'] / before['peak_mb'] - 1 if before['peak_mb'] else 0.0
+        print(f"  {name:<21}: points/s {speed:+7.1%}  peak memory {memory:+7.1%}")
+    regressions = compare(baseline, current, max_regression)
+    for name, what, before, now in regressions:
+        print(f"REGRESSION {name} {what}: {before:.4g} -> {now:.4g}")
+    return len(regressions)
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=100_000, help="Receiver fixes of the synthetic drive")
+    parser.add_argument('--rate-hz', type=float, default=10.0)
+    parser.add_argument('--noise-m', type=float, default=2.0)
+    parser.add_argument('--outlier-fraction', type=float, default=0.001)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="Stub /match latency per request")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', help="Only these stages")
+    parser.add_argument('--output', help="Save the results as JSON")
+    parser.add_argument('--baseline', help="Results JSON of an earlier version to compare against")
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION)
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="Only compare two saved results")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = report_comparison(_load(args.compare[0]), _load(args.compare[1]), args.max_regression)
+        sys.exit(1 if regressions else 0)
+
+    result = run_suite(args.points, args.rate_hz, args.noise_m, args.outlier_fraction, args.latency_ms / 1000,
+                       args.repeat, args.seed, args.stages)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+        print(f"Results saved to {args.output}")
+    if args.baseline:
+        regressions = report_comparison(_load(args.baseline), result, args.max_regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Synthetic GNSS recordings for the benchmarks: one simulated drive written as the project's input
+formats.
+
+    <name>.pos  RTKLIB solution at the receiver rate (the precise source)
+    <name>.kml  gx:Track of a phone logging the same drive at phone_rate_hz with its own noise
+    <name>.gpx  the receiver track as GPX
+
+The drive is a smooth random walk around New Delhi; every fix gets Gaussian noise of noise_m
+and a share outlier_fraction of fixes jumps outlier_m away, as multipath fixes do. Everything is
+seeded, so the same arguments give byte-identical files.
+
+Run from the repository root:
+    python -m benchmarks.synthetic out/ --points 1000000 --rate-hz 10 --noise-m 3 --outlier-fraction 0.001
+"""
+import argparse
+import os
+
+import numpy as np
+
+from benchmarks.bench_pos_loader import RTKLIB_HEADER
+from road_index import METERS_PER_DEGREE
+from track import Track
+
+ORIGIN_LAT, ORIGIN_LON = 28.6, 77.2
+METERS_PER_DEGREE_LON = METERS_PER_DEGREE * np.cos(np.radians(ORIGIN_LAT))
+START_EPOCH = 1_705_307_400.0  # 2024-01-15T08:30:00Z
+# GPS time runs ahead of UTC by the leap seconds since 1980, 18 s since 2017
+GPS_UTC_OFFSET_S = 18.0
+# Rows formatted per write, bounds the temporary strings for long recordings
+WRITE_BLOCK = 100_000
+
+
+def synthetic_drive(points, rate_hz=10.0, speed_mps=15.0, noise_m=2.0, outlier_fraction=0.001, outlier_m=500.0,
+                    start=START_EPOCH, seed=0):
+    """
+    Track of a simulated drive: points fixes at rate_hz with timestamps and elevation.
+    """
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.02, points))
+    step_m = speed_mps / rate_hz
+    north = np.cumsum(step_m * np.cos(heading)) + rng.normal(0, noise_m, points)
+    east = np.cumsum(step_m * np.sin(heading)) + rng.normal(0, noise_m, points)
+
+    jumps = np.flatnonzero(rng.random(points) < outlier_fraction)
+    angle = rng.uniform(0, 2 * np.pi, len(jumps))
+    north[jumps] += outlier_m * np.cos(angle)
+    east[jumps] += outlier_m * np.sin(angle)
+
+    lat = ORIGIN_LAT + north / METERS_PER_DEGREE
+    lon = ORIGIN_LON + east / METERS_PER_DEGREE_LON
+    ele = 215.0 + np.cumsum(rng.normal(0, 0.05, points))
+    return Track(lat, lon, ele, start + np.arange(points) / rate_hz)
+
+
+def write_pos(track, path):
+    """
+    Write a Track as an RTKLIB .pos solution. Timestamps are GPST, as RTKLIB writes them, so
+    load_pos gives back the track's UTC times.
+    """
+    with open(path, 'w') as f:
+        f.write(RTKLIB_HEADER)
+        for i in range(0, len(track), WRITE_BLOCK):
+            block = track.slice(i, i + WRITE_BLOCK)
+            gpst = (block.time + GPS_UTC_OFFSET_S) * 1000
+            stamps = np.datetime_as_string(np.round(gpst).astype('datetime64[ms]'), unit='ms')
+            f.writelines(
+                f"{t[:10].replace('-', '/')} {t[11:]}   {a:.9f}   {o:.9f}   {h:9.4f}   1   8   0.0123   0.0098   0.0311\n"
+                for t, a, o, h in zip(stamps, block.lat.tolist(), block.lon.tolist(), block.ele.tolist()))
+
+
+def write_kml(track, path, name="Synthetic drive"):
+    """
+    Write a Track as a KML gx:Track (parallel <when> and <gx:coord> lists).
+    """
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">\n'
+                f'<Document><Placemark><name>{name}</name><gx:Track>\n')
+        for i in range(0, len(track), WRITE_BLOCK):
+            block = track.slice(i, i + WRITE_BLOCK)
+            stamps = np.datetime_as_string(np.round(block.time * 1000).astype('datetime64[ms]'), unit='ms')
+            f.writelines(f"<when>{t}Z</when>\n" for t in stamps)
+            f.writelines(f"<gx:coord>{o:.7f} {a:.7f} {h:.1f}</gx:coord>\n"
+                         for a, o, h in zip(block.lat.tolist(), block.lon.tolist(), block.ele.tolist()))
+        f.write('</gx:Track></Placemark></Document>\n</kml>\n')
+
+
+def generate_dataset(directory, points=100_000, rate_hz=10.0, noise_m=2.0, outlier_fraction=0.001,
+                     phone_rate_hz=1.0, phone_noise_m=5.0, name='drive', seed=0):
+    """
+    Write <name>.pos, <name>.kml and <name>.gpx of one synthetic drive into directory.
+    Returns {'pos': path, 'kml': path, 'gpx': path}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    receiver = synthetic_drive(points, rate_hz, noise_m=noise_m, outlier_fraction=outlier_fraction, seed=seed)
+    # The phone sees the same drive, sampled less often and with its own error
+    step = max(1, int(round(rate_hz / phone_rate_hz)))
+    truth = synthetic_drive(points, rate_hz, noise_m=0.0, outlier_fraction=0.0, seed=seed).take(
+        np.arange(0, points, step))
+    rng = np.random.default_rng(seed + 1)
+    phone = Track(truth.lat + rng.normal(0, phone_noise_m, len(truth)) / METERS_PER_DEGREE,
+                  truth.lon + rng.normal(0, phone_noise_m, len(truth)) / METERS_PER_DEGREE_LON,
+                  truth.ele, truth.time)
+
+    paths = {extension: os.path.join(directory, f"{name}.{extension}") for extension in ('pos', 'kml', 'gpx')}
+    write_pos(receiver, paths['pos'])
+    write_kml(phone, paths['kml'])
+    receiver.to_gpx(paths['gpx'], name=name)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--points', type=int, default=100_000, help="Receiver fixes")
+    parser.add_argument('--rate-hz', type=float, default=10.0)
+    parser.add_argument('--noise-m', type=float, default=2.0)
+    parser.add_argument('--outlier-fraction', type=float, default=0.001)
+    parser.add_argument('--phone-rate-hz', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_dataset(args.directory, args.points, args.rate_hz, args.noise_m, args.outlier_fraction,
+                             args.phone_rate_hz, seed=args.seed)
+    for path in paths.values():
+        print(f"{path}: {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from geodistance import haversine_km
+from matching_backend import MATCH_URL, GraphHopperBackend, MatchError
+from track import Track
+
+DEFAULT_WINDOW_POINTS = 1000
+DEFAULT_OVERLAP_POINTS = 100
+DEFAULT_WORKERS = 4
+# How much further along the snapped geometry than the distance between two consecutive input
+# points the seam alignment looks for the second point's vertex
+ALIGN_MARGIN_M = 200.0
+
+
+def split_windows(n, window_points=DEFAULT_WINDOW_POINTS, overlap_points=DEFAULT_OVERLAP_POINTS):
+    """
+    (start, stop) index ranges of overlapping windows covering n points.
+    Consecutive windows share overlap_points points; the last window may be shorter.
+    """
+    if overlap_points >= window_points:
+        raise ValueError("overlap_points must be smaller than window_points")
+    if n <= window_points:
+        return [(0, n)]
+
+    step = window_points - overlap_points
+    windows = []
+    start = 0
+    while True:
+        stop = min(start + window_points, n)
+        windows.append((start, stop))
+        if stop == n:
+            return windows
+        start += step
+
+
+def _along_m(lat, lon):
+    """
+    Distance along a polyline to each of its vertices, in meters.
+    """
+    return np.concatenate(([0.0], np.cumsum(haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:]) * 1000.0)))
+
+
+def _aligned_vertex(vertex_lat, vertex_lon, lat, lon):
+    """
+    Index of the polyline vertex that the last of the input points (lat, lon) corresponds to,
+    following the points in order from the polyline's first vertex. Each point is looked up from
+    the previous point's vertex onwards, no further along the polyline than the distance between
+    the two points plus ALIGN_MARGIN_M, so where a track passes the same place twice (out and
+    back, loops) the points stay on their own pass.
+    """
+    along = _along_m(vertex_lat, vertex_lon)
+    step_m = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:]) * 1000.0
+    vertex = 0
+    for j in range(len(lat)):
+        reach = along[vertex] + (step_m[j - 1] if j else 0.0) + ALIGN_MARGIN_M
+        stop = max(int(np.searchsorted(along, reach, side='right')), vertex + 1)
+        distance = haversine_km(vertex_lat[vertex:stop], vertex_lon[vertex:stop], lat[j], lon[j])
+        vertex += int(np.argmin(distance))
+    return vertex
+
+
+def stitch_chunks(track, windows, snapped_chunks):
+    """
+    Join the snapped geometry of overlapping windows into one continuous track.
+    Each seam is cut at the input point in the middle of the overlap: the earlier chunk is kept
+    up to its vertex for that point and the later chunk continues after its own, so the
+    overlapping stretch appears only once. The vertices are found by aligning the input points
+    with the snapped geometry in order, from the end of the earlier chunk backwards and from the
+    start of the later one forwards (see _aligned_vertex), never by a nearest-vertex search over
+    a whole chunk, which picks the wrong pass where the track comes back the same way.
+    """
+    pieces = []
+    begin = 0
+    for i, snapped in enumerate(snapped_chunks):
+        if i + 1 == len(snapped_chunks):
+            pieces.append(snapped.slice(begin, len(snapped)))
+            break
+
+        following = snapped_chunks[i + 1]
+        seam = (windows[i + 1][0] + windows[i][1]) // 2
+
+        end = 0
+        if len(snapped):
+            # Backwards from the last input point of this window to the seam
+            back = slice(windows[i][1] - 1, seam - 1 if seam else None, -1)
+            end = len(snapped) - _aligned_vertex(snapped.lat[::-1], snapped.lon[::-1], track.lat[back],
+                                                 track.lon[back])
+        pieces.append(snapped.slice(begin, max(begin, end)))
+
+        begin = 0
+        if len(following):
+            forward = slice(windows[i + 1][0], seam + 1)
+            begin = _aligned_vertex(following.lat, following.lon, track.lat[forward], track.lon[forward]) + 1
+    return Track.concatenate(pieces)
+
+
+class TrackMatcher(GraphHopperBackend):
+    """
+    GraphHopperBackend with the (vehicle, url, workers, cache) signature used by the chunked
+    matcher: sends tracks (or windows of a track) over one pooled session, with timeouts,
+    retries and a circuit breaker, and returns the snapped geometry as a Track.
+    Safe to share between threads.
+    """
+
+    def __init__(self, vehicle='car', url=MATCH_URL, workers=DEFAULT_WORKERS, cache=None, metrics=None):
+        super().__init__(url, vehicle, cache=cache, pool_size=workers, metrics=metrics)
+
+
+def match_track_chunked(track, vehicle='car', window_points=DEFAULT_WINDOW_POINTS,
+                        overlap_points=DEFAULT_OVERLAP_POINTS, workers=DEFAULT_WORKERS, url=MATCH_URL, cache=None,
+                        matcher=None):
+    """
+    Map-match a Track in overlapping windows, matched in parallel, and stitch the snapped
+    geometry back into a single Track. Raises MatchError (a RuntimeError) if any window fails.
+    Pass a shared matcher (a TrackMatcher or any matching_backend backend, e.g. the offline
+    matcher) to reuse it across tracks; it is then left open.
+    """
+    windows = split_windows(len(track), window_points, overlap_points)
+    owns_matcher = matcher is None
+    if owns_matcher:
+        matcher = TrackMatcher(vehicle, url, workers, cache)
+    try:
+        if len(windows) == 1:
+            return matcher.match(track)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            snapped_chunks = list(pool.map(matcher.match, (track.slice(start, stop) for start, stop in windows)))
+    finally:
+        if owns_matcher:
+            matcher.close()
+    return stitch_chunks(track, windows, snapped_chunks)
+
+
+def map_matching_chunked(gpx_file, result_file, vehicle='car', window_points=DEFAULT_WINDOW_POINTS,
+                         overlap_points=DEFAULT_OVERLAP_POINTS, workers=DEFAULT_WORKERS, cache=None, backend=None):
+    """
+    Chunked counterpart of map_matching for long tracks: the snapped track is saved as GPX.
+    A backend (see matching_backend) replaces the default GraphHopper matcher.
+    """
+    track = Track.from_gpx(gpx_file)
+    start = time.perf_counter()
+    try:
+        snapped = match_track_chunked(track, vehicle, window_points, overlap_points, workers, cache=cache,
+                                      matcher=backend)
+    except MatchError as e:
+        print(f"Error in map matching for {gpx_file}: {e}")
+        return None
+
+    snapped.to_gpx(result_file)
+    windows = len(split_windows(len(track), window_points, overlap_points))
+    print(f"Map matching completed for {gpx_file} in {windows} chunks ({time.perf_counter() - start:.2f} s). "
+          f"Result saved to {result_file}")
+    return snapped
@@ -0,0 +1,178 @@
+"""
+Batch converter: every .pos and .kml log under a directory tree to GPX, in parallel.
+
+Each input is converted by a worker process. Outputs that are already up to date are skipped,
+so re-running over a growing archive only converts new and changed logs:
+
+    mtime  the output is newer than its input (default, costs one stat per file)
+    hash   the input's SHA-256 matches the one recorded next to the output when it was
+           written (<output>.sha256); survives copies and touch, costs a read per file
+
+The output of "logs/a.pos" is "out/a.pos.gpx" (or .gpx.gz with --gzip, or the binary columnar
+.npy with --format .npy), so a .pos and a .kml of the same recording do not overwrite each other.
+
+Usage:
+    python convert_tracks.py path/to/logs --output-dir path/to/gpx --workers 8 --gzip --check hash
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gpxstream import write_gpx
+from kmlstream import iter_kml_points
+from manifest import file_sha256
+from pos_loader import load_pos
+from trackio import WRITE_EXTENSIONS, read_track, track_extension, write_track
+
+INPUT_EXTENSIONS = ('.pos', '.kml')
+CHECKS = ('mtime', 'hash')
+
+
+def find_inputs(directory):
+    """
+    All .pos and .kml files under directory, in a stable order.
+    """
+    inputs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith(INPUT_EXTENSIONS):
+                inputs.append(os.path.join(root, file))
+    return inputs
+
+
+def output_path(input_file, directory, output_dir=None, output_format='.gpx'):
+    """
+    Where the output for input_file goes: the same relative path under output_dir (default: next
+    to the input), with the output_format extension appended to the file name.
+    """
+    relative = os.path.relpath(input_file, directory)
+    return os.path.join(output_dir or directory, relative + output_format)
+
+
+def _hash_record(output_file):
+    return output_file + '.sha256'
+
+
+def is_up_to_date(input_file, output_file, check='mtime'):
+    """
+    Whether output_file already holds the conversion of the current input_file.
+    Returns (up to date, input hash or None) so a hash computed here is not computed twice.
+    """
+    if not os.path.exists(output_file):
+        return False, None
+    if check == 'mtime':
+        return os.path.getmtime(output_file) >= os.path.getmtime(input_file), None
+
+    digest = file_sha256(input_file)
+    try:
+        with open(_hash_record(output_file), encoding='ascii') as f:
+            return f.read().strip() == digest, digest
+    except FileNotFoundError:
+        return False, digest
+
+
+def iter_input_points(input_file):
+    """
+    (lat, lon, ele, time) points of a .pos or .kml file.
+    """
+    if input_file.lower().endswith('.kml'):
+        return iter_kml_points(input_file)
+    return iter(load_pos(input_file, use_mmap=True))
+
+
+def convert_file(input_file, output_file, check='mtime', force=False):
+    """
+    Worker-process task: convert one file unless its output is up to date.
+    GPX output is streamed; .npy output is built from the loaded Track.
+    The output is written to a temporary name and renamed into place, so an interrupted run never
+    leaves a truncated output that a later run would take as up to date.
+    Returns (status, points written, seconds) with status 'converted' or 'skipped'.
+    """
+    start = time.perf_counter()
+    digest = None
+    if not force:
+        up_to_date, digest = is_up_to_date(input_file, output_file, check)
+        if up_to_date:
+            return 'skipped', 0, time.perf_counter() - start
+
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    # Keep the format extension on the temporary name, it selects the writer
+    extension = track_extension(output_file)
+    tmp = f"{output_file[:len(output_file) - len(extension)]}.{os.getpid()}.tmp{extension}"
+    try:
+        if extension == '.npy':
+            track = read_track(input_file)
+            write_track(track, tmp)
+            count = len(track)
+        else:
+            count = write_gpx(iter_input_points(input_file), tmp, creator="My GPS Converter", name="GPS Track")
+        os.replace(tmp, output_file)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if check == 'hash':
+        with open(_hash_record(output_file), 'w', encoding='ascii') as f:
+            f.write((digest or file_sha256(input_file)) + '\n')
+    return 'converted', count, time.perf_counter() - start
+
+
+def convert_directory(directory, output_dir=None, workers=None, output_format='.gpx', check='mtime', force=False):
+    """
+    Convert every .pos/.kml file under directory with a pool of worker processes.
+    output_format is '.gpx', '.gpx.gz' or '.npy'.
+    Returns a dict of counts: converted, skipped, failed and points.
+    """
+    if check not in CHECKS:
+        raise ValueError(f"check must be one of {CHECKS}")
+    if output_format not in WRITE_EXTENSIONS:
+        raise ValueError(f"output_format must be one of {WRITE_EXTENSIONS}")
+    started = time.perf_counter()
+    inputs = find_inputs(directory)
+    totals = {'converted': 0, 'skipped': 0, 'failed': 0, 'points': 0}
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {}
+        for input_file in inputs:
+            output_file = output_path(input_file, directory, output_dir, output_format)
+            futures[pool.submit(convert_file, input_file, output_file, check, force)] = input_file
+
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                status, points, _ = future.result()
+            except Exception as e:
+                totals['failed'] += 1
+                print(f"Error converting {input_file}: {e}")
+                continue
+            totals[status] += 1
+            totals['points'] += points
+
+    elapsed = time.perf_counter() - started
+    print(f"Converted {totals['converted']} files ({totals['points']} points), skipped {totals['skipped']} "
+          f"up to date, {totals['failed']} failed, in {elapsed:.2f} s")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--output-dir', default=None, help="Mirror the tree here (default: next to the inputs)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--format', choices=WRITE_EXTENSIONS, default='.gpx', help="Output format")
+    parser.add_argument('--gzip', action='store_true', help="Shorthand for --format .gpx.gz")
+    parser.add_argument('--check', choices=CHECKS, default='mtime', help="How to detect up-to-date outputs")
+    parser.add_argument('--force', action='store_true', help="Convert everything, even if up to date")
+    args = parser.parse_args()
+
+    totals = convert_directory(args.directory, output_dir=args.output_dir, workers=args.workers,
+                               output_format='.gpx.gz' if args.gzip else args.format, check=args.check,
+                               force=args.force)
+    raise SystemExit(1 if totals['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import numpy as np
+
+# Mean Earth radius (IUGG) used by the spherical model
+EARTH_RADIUS_KM = 6371.0088
+
+# WGS-84 ellipsoid, the same one geopy.distance.geodesic uses by default
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in km between arrays of points on a sphere.
+    Inputs are degrees and broadcast like any NumPy ufunc.
+    Error against the WGS-84 geodesic is at most ~0.5% (worst near the poles / along meridians).
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def andoyer_lambert_km(lat1, lon1, lat2, lon2):
+    """
+    Ellipsoidal (WGS-84) distance in km using the Andoyer-Lambert first-order flattening correction.
+    The error is of order f^2 relative to the true geodesic (about 1e-5 of the distance in practice,
+    i.e. below 1 mm for 100 m steps and a few metres at 1000 km), so threshold decisions match
+    geopy.distance.geodesic except for distances within ~0.001% of the threshold.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    # Reduced (parametric) latitudes
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    dlon = lon2 - lon1
+
+    # Central angle on the auxiliary sphere (haversine form, stable for short steps)
+    h = np.sin(q) ** 2 + np.cos(beta1) * np.cos(beta2) * np.sin(dlon / 2) ** 2
+    h = np.clip(h, 0.0, 1.0)
+    sigma = 2 * np.arcsin(np.sqrt(h))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - np.sin(sigma)) * (np.sin(p) * np.cos(q)) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * (np.cos(p) * np.sin(q)) ** 2 / np.sin(sigma / 2) ** 2
+        d = WGS84_A_KM * (sigma - WGS84_F / 2 * (x + y))
+
+    # Coincident points give 0/0 in the correction term
+    return np.where(sigma == 0, 0.0, d)
+
+
+DISTANCE_METHODS = {
+    'haversine': haversine_km,
+    'ellipsoidal': andoyer_lambert_km,
+}
+
+
+def distance_km(lat1, lon1, lat2, lon2, method='haversine'):
+    """
+    Vectorized distance in km between point arrays using the chosen method.
+    """
+    try:
+        kernel = DISTANCE_METHODS[method]
+    except KeyError:
+        raise ValueError(f"Unknown distance method {method!r}, expected one of {sorted(DISTANCE_METHODS)}")
+    return kernel(lat1, lon1, lat2, lon2)
+
+
+def step_distances_km(lat, lon, method='haversine'):
+    """
+    Distance in km between each pair of consecutive points (length n - 1).
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    return distance_km(lat[:-1], lon[:-1], lat[1:], lon[1:], method=method)
+
+
+def outlier_mask(lat, lon, threshold_km=0.1, method='haversine'):
+    """
+    Keep/drop mask for a track in one pass.
+    A point is kept if it lies within threshold_km of the point recorded just before it
+    (whether or not that point was kept), and the first point is always kept.
+    This is exactly the rule the per-pair geodesic loop in remove_outliers used.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    mask = np.ones(lat.shape[0], dtype=bool)
+    if lat.shape[0] > 1:
+        mask[1:] = step_distances_km(lat, lon, method=method) <= threshold_km
+    return mask
+
+
+def interpolate_positions(lat1, lon1, lat2, lon2, fraction, mode='linear'):
+    """
+    Positions at `fraction` (0..1) of the way from point 1 to point 2, vectorized.
+    mode='linear' interpolates lat/lon directly (taking the short way across the antimeridian);
+    mode='great_circle' follows the great circle through both points (spherical slerp).
+    Returns (lat, lon) arrays in degrees.
+    """
+    lat1, lon1, lat2, lon2, fraction = np.broadcast_arrays(
+        *(np.asarray(a, dtype=np.float64) for a in (lat1, lon1, lat2, lon2, fraction)))
+
+    if mode == 'linear':
+        dlon = (lon2 - lon1 + 180.0) % 360.0 - 180.0
+        lat = lat1 + fraction * (lat2 - lat1)
+        lon = (lon1 + fraction * dlon + 180.0) % 360.0 - 180.0
+        return lat, lon
+
+    if mode != 'great_circle':
+        raise ValueError(f"Unknown interpolation mode {mode!r}, expected 'linear' or 'great_circle'")
+
+    phi1, lam1, phi2, lam2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    v1 = np.stack([np.cos(phi1) * np.cos(lam1), np.cos(phi1) * np.sin(lam1), np.sin(phi1)])
+    v2 = np.stack([np.cos(phi2) * np.cos(lam2), np.cos(phi2) * np.sin(lam2), np.sin(phi2)])
+    omega = np.arccos(np.clip(np.sum(v1 * v2, axis=0), -1.0, 1.0))
+    sin_omega = np.sin(omega)
+
+    # Very short steps: slerp weights become 0/0, the linear weights are exact enough there
+    short = sin_omega < 1e-12
+    safe = np.where(short, 1.0, sin_omega)
+    w1 = np.where(short, 1.0 - fraction, np.sin((1.0 - fraction) * omega) / safe)
+    w2 = np.where(short, fraction, np.sin(fraction * omega) / safe)
+    v = w1 * v1 + w2 * v2
+
+    lat = np.degrees(np.arctan2(v[2], np.hypot(v[0], v[1])))
+    lon = np.degrees(np.arctan2(v[1], v[0]))
+    return lat, lon
@@ -0,0 +1,215 @@
+import gzip
+import io
+import math
+from array import array
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape, quoteattr
+
+# A streamed track point is a plain tuple: (lat, lon, ele, time)
+# ele and time are NaN when the source has no <ele> / <time>; time is seconds since the Unix epoch (UTC).
+NAN = float('nan')
+
+# Level used for .gpx.gz output; GPX compresses about 10x already at 6, and 9 is much slower
+GZIP_LEVEL = 6
+
+
+def parse_time(text):
+    """
+    Parse an ISO 8601 timestamp (as found in GPX <time>) to epoch seconds.
+    Timestamps without a zone are taken as UTC. Returns NaN for empty input.
+    """
+    if not text:
+        return NAN
+    text = text.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def format_time(epoch):
+    """
+    Format epoch seconds as a GPX timestamp, with milliseconds only when they are non-zero.
+    Returns None for NaN.
+    """
+    if epoch != epoch:
+        return None
+    dt = datetime.fromtimestamp(epoch, timezone.utc)
+    if dt.microsecond:
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _local_name(tag):
+    """
+    Strip the '{namespace}' prefix ElementTree puts on qualified tags.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def open_input(path):
+    """
+    Open a file for parsing, transparently decompressing .gz files.
+    Anything that is not a path (an open file object) is returned as is.
+    """
+    if isinstance(path, str) and path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return path
+
+
+def _iter_point_elements(gpx_file, tag):
+    """
+    Yield each point element of a GPX file (optionally gzip-compressed) and detach it from its
+    parent afterwards, so neither the element nor the tree above it keeps growing.
+    """
+    stack = []
+    source = open_input(gpx_file)
+    try:
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if _local_name(elem.tag) != tag:
+                continue
+
+            yield elem
+
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+    finally:
+        if source is not gpx_file:
+            source.close()
+
+
+def _read_point(elem):
+    """
+    Extract (lat, lon, ele, time) from a <trkpt> element.
+    """
+    ele = NAN
+    timestamp = NAN
+    for child in elem:
+        name = _local_name(child.tag)
+        if name == 'ele' and child.text:
+            ele = float(child.text)
+        elif name == 'time':
+            timestamp = parse_time(child.text)
+    return float(elem.attrib['lat']), float(elem.attrib['lon']), ele, timestamp
+
+
+def iter_trackpoints(gpx_file, tag='trkpt'):
+    """
+    Stream track points from a GPX file without building the whole tree.
+    Works with and without the GPX 1.0/1.1 namespace. Each point element is detached
+    from its parent as soon as it has been read, so memory use does not grow with file size.
+    """
+    for elem in _iter_point_elements(gpx_file, tag):
+        yield _read_point(elem)
+
+
+def read_columns(gpx_file, tag='trkpt'):
+    """
+    Read all track points of a GPX file straight into four array('d') columns
+    (lat, lon, ele, time) without building per-point tuples.
+    """
+    lat, lon, ele, times = array('d'), array('d'), array('d'), array('d')
+    for elem in _iter_point_elements(gpx_file, tag):
+        lat.append(float(elem.attrib['lat']))
+        lon.append(float(elem.attrib['lon']))
+        ele.append(NAN)
+        times.append(NAN)
+        for child in elem:
+            name = _local_name(child.tag)
+            if name == 'ele' and child.text:
+                ele[-1] = float(child.text)
+            elif name == 'time':
+                times[-1] = parse_time(child.text)
+    return lat, lon, ele, times
+
+
+class GpxWriter:
+    """
+    Incremental GPX writer: points are written to the file as they arrive.
+    gpx_file is a path or an open text stream (which is left open on close);
+    paths ending in .gz are written gzip-compressed.
+
+    with GpxWriter("out.gpx") as writer:
+        for point in points:
+            writer.write_point(*point)
+    """
+
+    def __init__(self, gpx_file, creator="SIH2024 GPS Pipeline", name=None):
+        self.gpx_file = gpx_file
+        self.creator = creator
+        self.name = name
+        self.count = 0
+        self._f = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        if hasattr(self.gpx_file, 'write'):
+            self._f = self.gpx_file
+            self._owns_file = False
+        elif self.gpx_file.endswith('.gz'):
+            self._f = gzip.open(self.gpx_file, 'wt', encoding='UTF-8', compresslevel=GZIP_LEVEL)
+            self._owns_file = True
+        else:
+            self._f = open(self.gpx_file, 'w', encoding='UTF-8')
+            self._owns_file = True
+        self._f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        self._f.write(f'<gpx version="1.1" creator={quoteattr(self.creator)}><trk>')
+        if self.name:
+            self._f.write(f'<name>{escape(self.name)}</name>')
+        self._f.write('<trkseg>')
+
+    def write_point(self, lat, lon, ele=NAN, timestamp=NAN):
+        # float() so NumPy scalars are written as plain numbers
+        parts = [f'<trkpt lat="{float(lat)!r}" lon="{float(lon)!r}">']
+        if not math.isnan(ele):
+            parts.append(f'<ele>{float(ele)!r}</ele>')
+        time_text = format_time(timestamp)
+        if time_text is not None:
+            parts.append(f'<time>{time_text}</time>')
+        parts.append('</trkpt>')
+        self._f.write(''.join(parts))
+        self.count += 1
+
+    def write_points(self, points):
+        for point in points:
+            self.write_point(*point)
+
+    def close(self):
+        if self._f is not None:
+            self._f.write('</trkseg></trk></gpx>\n')
+            if self._owns_file:
+                self._f.close()
+            self._f = None
+
+
+def write_gpx(points, gpx_file, creator="SIH2024 GPS Pipeline", name=None):
+    """
+    Write an iterable of (lat, lon, ele, time) points to a GPX file and return the point count.
+    """
+    with GpxWriter(gpx_file, creator=creator, name=name) as writer:
+        writer.write_points(points)
+    return writer.count
+
+
+def gpx_bytes(points, creator="SIH2024 GPS Pipeline"):
+    """
+    Serialize (lat, lon, ele, time) points to GPX in memory, e.g. as an HTTP request body.
+    """
+    buffer = io.StringIO()
+    write_gpx(points, buffer, creator=creator)
+    return buffer.getvalue().encode('utf-8')
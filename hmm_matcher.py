@@ -0,0 +1,341 @@
+"""
+Offline hidden-Markov-model map matcher (Newson & Krumm, 2009) over a local road network.
+
+Used as a fallback when the GraphHopper server is down or overloaded, or to spread load:
+
+- The road network (GeoJSON or OSM XML extract, see road_index) becomes a RoadGraph: vertices
+  shared between lines are joined into nodes, consecutive vertices into edges.
+- Candidate road positions of every GPS point come from the RoadIndex grid in one vectorized
+  query (the k nearest edges within search_radius_m).
+- Emission log-probabilities are Gaussian in the point-to-road distance; transition
+  log-probabilities are exponential in |route distance - great-circle distance| between
+  consecutive points. Route distances come from bounded Dijkstra searches, cached per node.
+- Viterbi runs one NumPy max-plus step per point over the K x K transition matrix. Where no
+  candidate of a point can be reached from the previous one, the chain is cut and restarted.
+
+Roads are treated as two-way and vehicle profiles are not modelled.
+"""
+import functools
+import heapq
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from geodistance import haversine_km
+from road_index import RoadIndex, read_polylines, segment_lengths_m
+from track import Track
+
+DEFAULT_SEARCH_RADIUS_M = 30.0
+DEFAULT_CANDIDATES = 5
+# GPS noise (m): standard deviation of the point-to-road distance
+DEFAULT_SIGMA_M = 5.0
+# Scale (m) of the route vs. straight-line difference between consecutive points
+DEFAULT_BETA_M = 10.0
+# Route searches stop at this multiple of the straight-line distance (plus the search radius)
+ROUTE_FACTOR = 3.0
+MIN_ROUTE_LIMIT_M = 200.0
+# Dijkstra results kept per RoadGraph
+ROUTE_CACHE_SIZE = 4096
+
+# Vertices closer than this many degrees (about 1 cm) are the same node
+_NODE_RESOLUTION = 1e-7
+
+
+class RoadGraph:
+    """
+    Undirected road graph with a spatial index over its edges.
+
+    polylines        (k, 2) lat/lon arrays, one per road
+    search_radius_m  how far from a GPS point candidate road positions are looked for
+    """
+
+    def __init__(self, polylines, search_radius_m=DEFAULT_SEARCH_RADIUS_M):
+        polylines = [np.asarray(line, dtype=np.float64) for line in polylines if len(line) > 1]
+        if polylines:
+            coords = np.concatenate(polylines)
+        else:
+            coords = np.empty((0, 2))
+        keys = np.round(coords / _NODE_RESOLUTION).astype(np.int64)
+        _, first, vertex_node = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        vertex_node = vertex_node.ravel()
+        self.node_lat = coords[first, 0]
+        self.node_lon = coords[first, 1]
+
+        # Consecutive vertices of the same polyline form an edge
+        ends = np.cumsum([len(line) for line in polylines])
+        same_line = np.ones(max(len(coords) - 1, 0), dtype=bool)
+        same_line[ends[:-1] - 1] = False
+        u, v = vertex_node[:-1][same_line], vertex_node[1:][same_line]
+        keep = u != v
+        self.edge_u, self.edge_v = u[keep], v[keep]
+        segments = np.column_stack((self.node_lat[self.edge_u], self.node_lon[self.edge_u],
+                                    self.node_lat[self.edge_v], self.node_lon[self.edge_v]))
+        self.edge_length = segment_lengths_m(segments)
+        self.index = RoadIndex(segments, search_radius_m)
+
+        # CSR adjacency over both directions, as Python lists for the Dijkstra loop
+        src = np.concatenate((self.edge_u, self.edge_v))
+        order = np.argsort(src, kind='stable')
+        self._indptr = np.searchsorted(src[order], np.arange(len(self.node_lat) + 1)).tolist()
+        self._neighbours = np.concatenate((self.edge_v, self.edge_u))[order].tolist()
+        self._weights = np.concatenate((self.edge_length, self.edge_length))[order].tolist()
+        self._routes = OrderedDict()
+        self._routes_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"RoadGraph({len(self.node_lat)} nodes, {len(self.edge_u)} edges)"
+
+    @classmethod
+    def from_file(cls, path, search_radius_m=DEFAULT_SEARCH_RADIUS_M):
+        """
+        Build the graph from a GeoJSON (.geojson/.json) or OSM XML (.osm) road network extract.
+        """
+        return cls(read_polylines(path), search_radius_m)
+
+    def routes_from(self, node, limit_m):
+        """
+        Dijkstra from node, stopping at limit_m. Returns (distance, predecessor) dicts.
+        Results are cached per node and reused for any limit up to the one they were searched to.
+        """
+        with self._routes_lock:
+            cached = self._routes.get(node)
+            if cached is not None and cached[0] >= limit_m:
+                self._routes.move_to_end(node)
+                return cached[1], cached[2]
+
+        indptr, neighbours, weights = self._indptr, self._neighbours, self._weights
+        distance = {node: 0.0}
+        predecessor = {}
+        heap = [(0.0, node)]
+        while heap:
+            d, n = heapq.heappop(heap)
+            if d > distance[n]:
+                continue
+            for i in range(indptr[n], indptr[n + 1]):
+                m = neighbours[i]
+                dm = d + weights[i]
+                if dm <= limit_m and dm < distance.get(m, np.inf):
+                    distance[m] = dm
+                    predecessor[m] = n
+                    heapq.heappush(heap, (dm, m))
+
+        with self._routes_lock:
+            self._routes[node] = (limit_m, distance, predecessor)
+            if len(self._routes) > ROUTE_CACHE_SIZE:
+                self._routes.popitem(last=False)
+        return distance, predecessor
+
+    def node_path(self, source, target, limit_m):
+        """
+        Nodes of the shortest path source..target (found within limit_m).
+        """
+        _, predecessor = self.routes_from(source, limit_m)
+        path = [target]
+        while path[-1] != source:
+            path.append(predecessor[path[-1]])
+        return path[::-1]
+
+
+@functools.lru_cache(maxsize=4)
+def load_road_graph(path, search_radius_m=DEFAULT_SEARCH_RADIUS_M):
+    """
+    RoadGraph.from_file, built once per process and path.
+    """
+    return RoadGraph.from_file(path, search_radius_m)
+
+
+class _Candidates:
+    """
+    Candidate road positions of one GPS point: edge, offset along it (m) and emission score.
+    """
+    __slots__ = ('point', 'edge', 'offset', 'emission', 'ends', 'end_cost')
+
+    def __init__(self, graph, point, edge, distance, fraction, sigma_m):
+        self.point = point
+        self.edge = edge
+        self.offset = fraction * graph.edge_length[edge]
+        self.emission = -0.5 * (distance / sigma_m) ** 2
+        # Both end nodes of every candidate edge and the cost of reaching each from the candidate
+        self.ends = np.column_stack((graph.edge_u[edge], graph.edge_v[edge]))
+        self.end_cost = np.column_stack((self.offset, graph.edge_length[edge] - self.offset))
+
+    def __len__(self):
+        return len(self.edge)
+
+
+class HmmMatcher:
+    """
+    Map-matches Tracks against a RoadGraph; .match has the same contract as TrackMatcher.match
+    (snapped route geometry as a Track), so it can stand in for the GraphHopper client.
+    Safe to share between threads.
+    """
+
+    def __init__(self, graph, sigma_m=DEFAULT_SIGMA_M, beta_m=DEFAULT_BETA_M, candidates=DEFAULT_CANDIDATES):
+        self.graph = graph
+        self.sigma_m = sigma_m
+        self.beta_m = beta_m
+        self.candidates = candidates
+
+    def _candidates(self, track):
+        point, edge, distance, fraction = self.graph.index.nearest_segments(track.lat, track.lon, self.candidates)
+        bounds = np.flatnonzero(np.r_[True, point[1:] != point[:-1], True])
+        return [_Candidates(self.graph, int(point[a]), edge[a:b], distance[a:b], fraction[a:b], self.sigma_m)
+                for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def _route_limit(self, straight_m):
+        return max(MIN_ROUTE_LIMIT_M, ROUTE_FACTOR * straight_m + 2 * self.graph.index.max_distance_m)
+
+    def _route_matrix(self, prev, cur, limit_m):
+        """
+        Route distances (m) from every candidate of prev to every candidate of cur; inf if
+        farther than limit_m.
+        """
+        ends = np.full((len(prev), 2, len(cur), 2), np.inf)
+        targets = cur.ends.tolist()
+        for i, pair in enumerate(prev.ends.tolist()):
+            for a, node in enumerate(pair):
+                distance, _ = self.graph.routes_from(node, limit_m)
+                for j, (u, v) in enumerate(targets):
+                    ends[i, a, j, 0] = distance.get(u, np.inf)
+                    ends[i, a, j, 1] = distance.get(v, np.inf)
+
+        routes = (prev.end_cost[:, :, None, None] + ends + cur.end_cost[None, None, :, :]).min(axis=(1, 3))
+        same = prev.edge[:, None] == cur.edge[None, :]
+        routes = np.where(same, np.abs(prev.offset[:, None] - cur.offset[None, :]), routes)
+        routes[routes > limit_m] = np.inf
+        return routes
+
+    def viterbi(self, track):
+        """
+        Most likely candidate of every matchable point. Returns a list of chains; each chain is
+        a list of (candidates, chosen index) in track order. Points without any road within the
+        search radius are skipped.
+        """
+        steps = self._candidates(track)
+        chains = []
+        chain = []
+        backpointers = []
+        score = None
+        for step in steps:
+            if chain:
+                prev = chain[-1]
+                straight_m = float(haversine_km(track.lat[prev.point], track.lon[prev.point],
+                                                track.lat[step.point], track.lon[step.point])) * 1000.0
+                routes = self._route_matrix(prev, step, self._route_limit(straight_m))
+                transition = -np.abs(routes - straight_m) / self.beta_m
+                total = score[:, None] + transition
+                best_prev = total.argmax(axis=0)
+                best = total[best_prev, np.arange(len(step))]
+                if np.isfinite(best).any():
+                    chain.append(step)
+                    backpointers.append(best_prev)
+                    score = best + step.emission
+                    continue
+                # No candidate is reachable from the previous point: close the chain here
+                chains.append(self._backtrack(chain, backpointers, score))
+            chain = [step]
+            backpointers = []
+            score = step.emission.copy()
+        if chain:
+            chains.append(self._backtrack(chain, backpointers, score))
+        return chains
+
+    @staticmethod
+    def _backtrack(chain, backpointers, score):
+        index = int(np.argmax(score))
+        picked = [index]
+        for pointers in reversed(backpointers):
+            index = int(pointers[index])
+            picked.append(index)
+        return list(zip(chain, reversed(picked)))
+
+    def _position(self, candidates, i):
+        graph = self.graph
+        edge = candidates.edge[i]
+        f = candidates.offset[i] / graph.edge_length[edge]
+        u, v = graph.edge_u[edge], graph.edge_v[edge]
+        return (graph.node_lat[u] + f * (graph.node_lat[v] - graph.node_lat[u]),
+                graph.node_lon[u] + f * (graph.node_lon[v] - graph.node_lon[u]))
+
+    def _connecting_nodes(self, track, prev, i, cur, j):
+        """
+        Graph nodes passed between candidate i of prev and candidate j of cur.
+        """
+        if prev.edge[i] == cur.edge[j]:
+            return []
+        straight_m = float(haversine_km(track.lat[prev.point], track.lon[prev.point],
+                                        track.lat[cur.point], track.lon[cur.point])) * 1000.0
+        limit_m = self._route_limit(straight_m)
+        best = None
+        for a in range(2):
+            distance, _ = self.graph.routes_from(int(prev.ends[i, a]), limit_m)
+            for b in range(2):
+                d = prev.end_cost[i, a] + distance.get(int(cur.ends[j, b]), np.inf) + cur.end_cost[j, b]
+                if best is None or d < best[0]:
+                    best = (d, a, b)
+        _, a, b = best
+        return self.graph.node_path(int(prev.ends[i, a]), int(cur.ends[j, b]), limit_m)
+
+    def match(self, track):
+        """
+        Snapped route geometry of a Track: the matched position of every point joined by the
+        road nodes in between. Chains cut by unreachable points are concatenated.
+        """
+        graph = self.graph
+        lat, lon = [], []
+        for chain in self.viterbi(track):
+            previous = None
+            for candidates, i in chain:
+                if previous is not None:
+                    for node in self._connecting_nodes(track, previous[0], previous[1], candidates, i):
+                        lat.append(graph.node_lat[node])
+                        lon.append(graph.node_lon[node])
+                position = self._position(candidates, i)
+                lat.append(position[0])
+                lon.append(position[1])
+                previous = (candidates, i)
+        if not lat:
+            return Track.empty()
+
+        lat, lon = np.asarray(lat), np.asarray(lon)
+        keep = np.ones(len(lat), dtype=bool)
+        keep[1:] = (lat[1:] != lat[:-1]) | (lon[1:] != lon[:-1])
+        return Track(lat[keep], lon[keep])
+
+
+def to_graphhopper_json(snapped):
+    """
+    A GraphHopper-style /match response (points_encoded=false) for a snapped Track, so results
+    of either engine can be read by the same code.
+    """
+    distance = float(haversine_km(snapped.lat[:-1], snapped.lon[:-1], snapped.lat[1:], snapped.lon[1:]).sum()
+                     * 1000.0) if len(snapped) > 1 else 0.0
+    return {
+        'info': {'engine': 'hmm_matcher'},
+        'paths': [{
+            'distance': distance,
+            'points_encoded': False,
+            'points': {'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in
+                                                             zip(snapped.lat.tolist(), snapped.lon.tolist())]},
+        }],
+    }
+
+
+def map_matching_offline(gpx_file, result_file, roads, vehicle='car'):
+    """
+    Offline counterpart of map_matching: match a GPX file against a local road network extract
+    (path or RoadGraph) and save a GraphHopper-style JSON response to result_file.
+    vehicle is accepted for compatibility; the graph has no vehicle profiles.
+    """
+    graph = roads if isinstance(roads, RoadGraph) else load_road_graph(roads)
+    snapped = HmmMatcher(graph).match(Track.from_gpx(gpx_file))
+    if not len(snapped):
+        print(f"Error in map matching for {gpx_file}: no road within {graph.index.max_distance_m:g} m")
+        return None
+
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(to_graphhopper_json(snapped), f)
+    print(f"Map matching completed for {gpx_file}. Result saved to {result_file}")
+    return snapped
@@ -0,0 +1,202 @@
+"""
+Lightweight per-stage instrumentation: wall time, points processed and bytes read/written per
+pipeline stage, with latency percentiles.
+
+    metrics = Metrics()
+    with metrics.stage('parse', bytes_read=file_size(path)) as stage:
+        track = read_track(path)
+        stage.points = len(track)
+    metrics.report()                      # table on stdout
+    metrics.write_json('metrics.json')    # summary() as JSON
+    metrics.write_prometheus('pipeline.prom')
+
+The Prometheus text output suits node_exporter's textfile collector. Stage durations are
+exported as summaries (quantiles, _sum, _count); points, bytes and errors as counters.
+Calls, totals and maxima are exact; percentiles are taken over the last max_samples calls of
+each stage, so a long-running process (see live_stream) keeps its memory bounded.
+
+profiled() runs a block under cProfile, for digging into a single slow file.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+PROMETHEUS_PREFIX = 'sih_pipeline'
+# Durations kept per stage for the percentiles, about 3 MB per stage when full
+DEFAULT_MAX_SAMPLES = 100_000
+
+
+def file_size(path):
+    """
+    Size of path in bytes, 0 if it does not exist.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _write_text_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class StageTimer:
+    """
+    Handle yielded by Metrics.stage; set the counts once they are known inside the block.
+    """
+    __slots__ = ('points', 'bytes_read', 'bytes_written')
+
+    def __init__(self, points=0, bytes_read=0, bytes_written=0):
+        self.points = points
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+
+
+class Metrics:
+    """
+    Thread-safe registry of stage timings. Calls, total and maximum seconds, points and bytes
+    are running totals; the durations of the last max_samples calls of each stage are kept in a
+    ring buffer for the percentiles (None keeps all of them, for exact percentiles of a batch).
+    """
+
+    def __init__(self, max_samples=DEFAULT_MAX_SAMPLES):
+        self.started = time.perf_counter()
+        self.max_samples = max_samples
+        self._durations = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, points=0, bytes_read=0, bytes_written=0, error=False):
+        with self._lock:
+            durations = self._durations.get(stage)
+            if durations is None:
+                durations = self._durations[stage] = deque(maxlen=self.max_samples)
+            durations.append(seconds)
+            counters = self._counters.setdefault(stage, {'calls': 0, 'total_s': 0.0, 'max_s': 0.0, 'points': 0,
+                                                         'bytes_read': 0, 'bytes_written': 0, 'errors': 0})
+            counters['calls'] += 1
+            counters['total_s'] += seconds
+            counters['max_s'] = max(counters['max_s'], seconds)
+            counters['points'] += points
+            counters['bytes_read'] += bytes_read
+            counters['bytes_written'] += bytes_written
+            counters['errors'] += int(error)
+
+    @contextlib.contextmanager
+    def stage(self, name, points=0, bytes_read=0, bytes_written=0):
+        """
+        Time the enclosed block as one call of stage name. A block that raises is recorded
+        with error=True and the exception propagates.
+        """
+        timer = StageTimer(points, bytes_read, bytes_written)
+        start = time.perf_counter()
+        error = False
+        try:
+            yield timer
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, timer.points, timer.bytes_read, timer.bytes_written, error)
+
+    def summary(self):
+        """
+        Per-stage calls, errors, total/mean/max and percentile seconds, points, points/s and bytes.
+        """
+        with self._lock:
+            durations = {stage: np.fromiter(times, dtype=np.float64, count=len(times))
+                         for stage, times in self._durations.items()}
+            counters = {stage: dict(c) for stage, c in self._counters.items()}
+
+        stages = {}
+        for stage, times in durations.items():
+            c = counters[stage]
+            total = c['total_s']
+            stages[stage] = {
+                'calls': c['calls'],
+                'errors': c['errors'],
+                'total_s': total,
+                'mean_s': total / c['calls'],
+                'max_s': c['max_s'],
+                'quantiles_s': {str(q): float(np.quantile(times, q)) for q in QUANTILES},
+                'points': c['points'],
+                'points_per_s': c['points'] / total if total else 0.0,
+                'bytes_read': c['bytes_read'],
+                'bytes_written': c['bytes_written'],
+            }
+        return {'wall_s': time.perf_counter() - self.started, 'stages': stages}
+
+    def report(self):
+        s = self.summary()
+        print(f"Stage timings over {s['wall_s']:.2f} s:")
+        for stage, t in s['stages'].items():
+            q = t['quantiles_s']
+            print(f"  {stage:<12} {t['calls']:6d} calls  total {t['total_s']:8.3f} s  p50 {q['0.5']:7.3f} s  "
+                  f"p95 {q['0.95']:7.3f} s  max {t['max_s']:7.3f} s  {t['points_per_s']:12,.0f} points/s  "
+                  f"read {t['bytes_read'] / 1e6:8.2f} MB  written {t['bytes_written'] / 1e6:8.2f} MB"
+                  + (f"  errors {t['errors']}" if t['errors'] else ""))
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def write_json(self, path):
+        _write_text_atomic(path, self.to_json() + '\n')
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        stages = self.summary()['stages']
+        lines = [f"# HELP {prefix}_stage_seconds Wall time of one call of a pipeline stage.",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, t in stages.items():
+            for q, value in t['quantiles_s'].items():
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6g}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {t["total_s"]:.6g}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {t["calls"]}')
+
+        for counter, help_text in (('points', "Track points processed"), ('bytes_read', "Bytes read"),
+                                   ('bytes_written', "Bytes written"), ('errors', "Calls that raised")):
+            lines.append(f"# HELP {prefix}_stage_{counter}_total {help_text} by a pipeline stage.")
+            lines.append(f"# TYPE {prefix}_stage_{counter}_total counter")
+            for stage, t in stages.items():
+                lines.append(f'{prefix}_stage_{counter}_total{{stage="{stage}"}} {t[counter]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix=PROMETHEUS_PREFIX):
+        _write_text_atomic(path, self.to_prometheus(prefix))
+
+
+# Process-wide registry used when no Metrics is passed in
+METRICS = Metrics()
+
+
+@contextlib.contextmanager
+def profiled(output_file=None, sort='cumulative', limit=25):
+    """
+    Run the enclosed block under cProfile and print the top `limit` functions by `sort`.
+    With output_file the raw profile is also saved (open it with pstats or snakeviz).
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_file:
+            profiler.dump_stats(output_file)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+        print(out.getvalue())
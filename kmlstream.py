@@ -0,0 +1,120 @@
+"""
+Incremental KML reader.
+
+Yields the same (lat, lon, ele, time) points as gpxstream, with times as epoch seconds (UTC),
+from the geometry KML loggers and Google Earth write:
+
+    <gx:Track>       <when>/<gx:coord> pairs (also KML 2.3 <Track>, inside <gx:MultiTrack>)
+    <Point>          one point, timed by its Placemark's <TimeStamp><when>
+    <LineString>     and <LinearRing> vertices, which carry no per-vertex time (NaN)
+
+Tags are matched by local name, so KML 2.2 files with the default namespace work as well as
+un-namespaced ones. Elements are cleared and detached as soon as they have been read.
+"""
+from array import array
+from collections import deque
+import xml.etree.ElementTree as ET
+
+from gpxstream import NAN, _local_name, open_input, parse_time
+
+LINE_GEOMETRIES = ('LineString', 'LinearRing')
+
+
+def _parse_when(text):
+    try:
+        return parse_time(text)
+    except ValueError:  # Coarser KML dates such as "2024" or "2024-01"
+        return NAN
+
+
+def _parse_coordinates(text):
+    """
+    Points of a <coordinates> element: whitespace-separated "lon,lat[,alt]" tuples.
+    """
+    for tuple_text in text.split():
+        values = tuple_text.split(',')
+        ele = float(values[2]) if len(values) > 2 and values[2] else NAN
+        yield float(values[1]), float(values[0]), ele, NAN
+
+
+def _parse_coord(text):
+    """
+    A <gx:coord> value: "lon lat [alt]".
+    """
+    values = text.split()
+    ele = float(values[2]) if len(values) > 2 else NAN
+    return float(values[1]), float(values[0]), ele
+
+
+def iter_kml_points(kml_file):
+    """
+    Stream (lat, lon, ele, time) points from a KML file in document order without building the tree.
+
+    A gx:Track lists its <when> and <gx:coord> values as two parallel sequences; pairs are yielded
+    as soon as both halves have been read, so only the unmatched values of the current track are
+    buffered. Point coordinates are held until the end of their Placemark, where its TimeStamp
+    is known.
+    """
+    stack = []
+    whens = deque()
+    coords = deque()
+    placemark_time = NAN
+    placemark_points = []
+
+    source = open_input(kml_file)
+    try:
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            name = _local_name(elem.tag)
+            parent = _local_name(stack[-1].tag) if stack else None
+
+            if name == 'when':
+                if parent == 'Track':
+                    whens.append(_parse_when(elem.text))
+                elif parent == 'TimeStamp':
+                    placemark_time = _parse_when(elem.text)
+            elif name == 'coord' and parent == 'Track':
+                coords.append(_parse_coord(elem.text))
+            elif name == 'coordinates' and elem.text:
+                if parent == 'Point':
+                    placemark_points.extend(_parse_coordinates(elem.text))
+                elif parent in LINE_GEOMETRIES:
+                    yield from _parse_coordinates(elem.text)
+            elif name == 'Track':
+                # Unpaired values (a malformed track) are dropped
+                whens.clear()
+                coords.clear()
+            elif name == 'Placemark':
+                for lat, lon, ele, _ in placemark_points:
+                    yield lat, lon, ele, placemark_time
+                placemark_points = []
+                placemark_time = NAN
+            else:
+                continue
+
+            while whens and coords:
+                yield (*coords.popleft(), whens.popleft())
+
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+    finally:
+        if source is not kml_file:
+            source.close()
+
+
+def read_kml_columns(kml_file):
+    """
+    Read all points of a KML file into four array('d') columns (lat, lon, ele, time).
+    """
+    lat, lon, ele, times = array('d'), array('d'), array('d'), array('d')
+    for point in iter_kml_points(kml_file):
+        lat.append(point[0])
+        lon.append(point[1])
+        ele.append(point[2])
+        times.append(point[3])
+    return lat, lon, ele, times
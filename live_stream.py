@@ -0,0 +1,365 @@
+"""
+Live map matching of streaming GNSS positions.
+
+Positions arrive as .pos records (RTKLIB solution lines, CSV or ISO columns; see pos_loader)
+from a TCP socket, e.g. an RTKLIB tcpsvr output stream, or from a growing file that is tailed
+like tail -f. They go through the batch pipeline's steps incrementally, with bounded state:
+
+    decode       complete lines are parsed in bulk as they arrive; a partial line waits for the rest
+    outliers     the remove_outliers rule (geodistance.outlier_mask), carrying the last raw point
+    interpolate  interpolate_track, carrying the last emitted point as iter_interpolate does
+    match        micro-batches of new points, sent with the last overlap_points points as context;
+                 only the snapped geometry past the context is emitted
+
+A batch goes to the matcher once batch_points new points are waiting or the oldest of them has
+waited max_delay_s. Matching runs in the ingest loop, so while a request is in flight new input
+queues up in the socket or file and the next batch takes all of it: batches grow with the load
+instead of requests piling up behind a slow matcher.
+
+The time from reading a point to emitting its snapped geometry is recorded as the 'end_to_end'
+stage of an instrumentation.Metrics, next to 'decode', 'preprocess' and 'match'. Metrics keeps
+running totals and only the last max_samples durations per stage, so a stream that runs for days
+does not grow its memory with them.
+
+Usage:
+    python live_stream.py --tcp 192.168.1.20:9000 --output snapped.csv
+    python live_stream.py --tail rover.pos --from-end --backend backend.json --max-delay-ms 500
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+import numpy as np
+
+from geodistance import haversine_km, outlier_mask
+from instrumentation import METRICS
+from matching_backend import MatchError, load_backend
+from pos_loader import detect_layout, parse_pos_lines
+from preprocessing import interpolate_track
+from track import Track
+
+DEFAULT_BATCH_POINTS = 20
+DEFAULT_OVERLAP_POINTS = 30
+DEFAULT_MAX_DELAY_S = 1.0
+DEFAULT_POLL_S = 0.05
+READ_BYTES = 1024 * 1024
+
+
+def iter_tcp(address, poll_s=DEFAULT_POLL_S, connect_timeout_s=10.0):
+    """
+    Bytes from a TCP server at (host, port) as they arrive, and b'' whenever nothing arrived
+    for poll_s. Ends when the server closes the connection.
+    """
+    with socket.create_connection(address, timeout=connect_timeout_s) as sock:
+        sock.settimeout(poll_s)
+        while True:
+            try:
+                data = sock.recv(READ_BYTES)
+            except TimeoutError:
+                yield b''
+                continue
+            if not data:
+                return
+            yield data
+
+
+def iter_tail(path, poll_s=DEFAULT_POLL_S, from_start=True, idle_timeout_s=None):
+    """
+    Bytes appended to the file at path, like tail -f, and b'' whenever nothing new arrived for
+    poll_s. With from_start=False the records already in the file are skipped (its header is
+    still passed on, it tells the record layout). A truncated or replaced file is read again
+    from the start. Ends after idle_timeout_s without new data, if given.
+    """
+    f = open(path, 'rb')
+    try:
+        if not from_start:
+            existing = f.read()
+            try:
+                header_end = detect_layout(existing).data_offset
+            except ValueError:  # No records yet: nothing to skip
+                header_end = len(existing)
+            yield existing[:header_end]
+            f.seek(existing.rfind(b'\n') + 1 if header_end < len(existing) else len(existing))
+
+        idle_since = time.monotonic()
+        while True:
+            data = f.read(READ_BYTES)
+            if data:
+                idle_since = time.monotonic()
+                yield data
+                continue
+            if idle_timeout_s is not None and time.monotonic() - idle_since > idle_timeout_s:
+                return
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and (stat.st_ino != os.fstat(f.fileno()).st_ino or stat.st_size < f.tell()):
+                f.close()
+                f = open(path, 'rb')
+                continue
+            time.sleep(poll_s)
+            yield b''
+    finally:
+        f.close()
+
+
+class PosStreamDecoder:
+    """
+    Incremental .pos parser: feed() it bytes in pieces of any size and get back a Track of the
+    records completed by each piece. Holds at most the header (until the layout is known) and
+    one partial line.
+    """
+
+    def __init__(self, time_system=None):
+        self.time_system = time_system
+        self.layout = None
+        self._buffer = b''
+
+    def feed(self, data):
+        self._buffer += data
+        if self.layout is None:
+            try:
+                layout = detect_layout(self._buffer, self.time_system)
+            except ValueError:  # Only header lines so far
+                return Track.empty()
+            if self._buffer.find(b'\n', layout.data_offset) == -1:
+                return Track.empty()  # The first record is still incomplete
+            self.layout = layout
+            self._buffer = self._buffer[layout.data_offset:]
+
+        end = self._buffer.rfind(b'\n') + 1
+        if not end:
+            return Track.empty()
+        lines, self._buffer = self._buffer[:end], self._buffer[end:]
+        return parse_pos_lines(lines, self.layout)
+
+
+class StreamPreprocessor:
+    """
+    Outlier removal and interpolation of a point stream, pushed a batch at a time. Gives the same
+    points as remove_outliers followed by interpolate_gpx over the whole recording, keeping only
+    the last raw point and the last emitted point between batches. interval_s=None skips the
+    interpolation.
+    """
+
+    def __init__(self, threshold_km=0.1, interval_s=1.0, max_gap_s=30.0, mode='linear', method='haversine'):
+        self.threshold_km = threshold_km
+        self.interval_s = interval_s
+        self.max_gap_s = max_gap_s
+        self.mode = mode
+        self.method = method
+        self._last_raw = None
+        self._last_emitted = None
+
+    def push(self, track):
+        """
+        Preprocess the next points; returns the new output points.
+        """
+        if not len(track):
+            return track
+        window = track if self._last_raw is None else Track.concatenate([self._last_raw, track])
+        keep = outlier_mask(window.lat, window.lon, self.threshold_km, self.method)
+        if self._last_raw is not None:
+            keep = keep[1:]
+        self._last_raw = track.slice(len(track) - 1, len(track))
+        cleaned = track.select(keep)
+        if not len(cleaned) or self.interval_s is None:
+            return cleaned
+
+        window = cleaned if self._last_emitted is None else Track.concatenate([self._last_emitted, cleaned])
+        resampled = interpolate_track(window, self.interval_s, self.max_gap_s, self.mode)
+        if self._last_emitted is not None:
+            resampled = resampled.slice(1, len(resampled))  # Already emitted with the previous batch
+        if len(resampled):
+            self._last_emitted = resampled.slice(len(resampled) - 1, len(resampled))
+        return resampled
+
+
+class SnappedBatch:
+    """
+    What one micro-batch produced.
+
+    snapped    snapped geometry of the new points (empty if matching failed)
+    points     the new preprocessed input points
+    latency_s  from reading the oldest of the points to emitting the batch
+    error      the MatchError, or None
+    """
+    __slots__ = ('snapped', 'points', 'latency_s', 'error')
+
+    def __init__(self, snapped, points, latency_s, error=None):
+        self.snapped = snapped
+        self.points = points
+        self.latency_s = latency_s
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'error={self.error}'
+        return (f"SnappedBatch({len(self.points)} points -> {len(self.snapped)} snapped, {status}, "
+                f"latency_s={self.latency_s:.3f})")
+
+
+class MicroBatcher:
+    """
+    Sliding-window micro-batching of a point stream to a map-matching backend (any backend of
+    matching_backend). Each request holds the new points and the overlap_points points before
+    them, so the matcher sees where the vehicle came from; the snapped geometry is cut after
+    its vertex nearest the last context point, where the previous batch's geometry ended.
+    """
+
+    def __init__(self, backend, batch_points=DEFAULT_BATCH_POINTS, overlap_points=DEFAULT_OVERLAP_POINTS,
+                 max_delay_s=DEFAULT_MAX_DELAY_S, metrics=None):
+        self.backend = backend
+        self.batch_points = batch_points
+        self.overlap_points = overlap_points
+        self.max_delay_s = max_delay_s
+        self.metrics = metrics if metrics is not None else METRICS
+        self._context = Track.empty()
+        self._pending = []  # (points, time read) of every push since the last batch
+        self._pending_points = 0
+
+    def push(self, track, received):
+        """
+        Queue new points, read at perf_counter() time received.
+        """
+        if len(track):
+            self._pending.append((track, received))
+            self._pending_points += len(track)
+
+    def _matchable(self):
+        # A /match request needs at least two points
+        return self._pending_points and len(self._context) + self._pending_points >= 2
+
+    def due(self, now=None):
+        """
+        Whether a batch should be sent now: enough points are waiting, or the oldest has
+        waited max_delay_s.
+        """
+        if not self._matchable():
+            return False
+        now = time.perf_counter() if now is None else now
+        return self._pending_points >= self.batch_points or now - self._pending[0][1] >= self.max_delay_s
+
+    def match(self):
+        """
+        Send the waiting points and return their SnappedBatch.
+        """
+        points = Track.concatenate([track for track, _ in self._pending])
+        window = Track.concatenate([self._context, points])
+        error = None
+        start = time.perf_counter()
+        try:
+            snapped = self.backend.match(window)
+        except MatchError as e:
+            snapped = Track.empty()
+            error = e
+        self.metrics.record('match', time.perf_counter() - start, points=len(window), error=error is not None)
+
+        if len(self._context) and len(snapped):
+            seam = int(np.argmin(haversine_km(snapped.lat, snapped.lon, self._context.lat[-1],
+                                              self._context.lon[-1])))
+            snapped = snapped.slice(seam + 1, len(snapped))
+
+        emitted = time.perf_counter()
+        for track, received in self._pending:
+            self.metrics.record('end_to_end', emitted - received, points=len(track), error=error is not None)
+        batch = SnappedBatch(snapped, points, emitted - self._pending[0][1], error)
+
+        self._context = window.slice(max(0, len(window) - self.overlap_points), len(window))
+        self._pending = []
+        self._pending_points = 0
+        return batch
+
+    def flush(self):
+        """
+        Send whatever is waiting; returns its SnappedBatch, or None.
+        """
+        return self.match() if self._matchable() else None
+
+
+def run_stream(source, backend, preprocessor=None, batch_points=DEFAULT_BATCH_POINTS,
+               overlap_points=DEFAULT_OVERLAP_POINTS, max_delay_s=DEFAULT_MAX_DELAY_S, time_system=None,
+               metrics=None):
+    """
+    Snap a live stream: source yields .pos bytes as they arrive (b'' when idle, see iter_tcp
+    and iter_tail); yields a SnappedBatch per micro-batch, and a last one for the points still
+    waiting when the source ends. preprocessor defaults to StreamPreprocessor().
+    """
+    metrics = metrics if metrics is not None else METRICS
+    decoder = PosStreamDecoder(time_system)
+    preprocessor = preprocessor if preprocessor is not None else StreamPreprocessor()
+    batcher = MicroBatcher(backend, batch_points, overlap_points, max_delay_s, metrics)
+
+    for data in source:
+        received = time.perf_counter()
+        if data:
+            with metrics.stage('decode', bytes_read=len(data)) as stage:
+                try:
+                    points = decoder.feed(data)
+                except ValueError as e:
+                    print(f"Skipping unreadable records: {e}", file=sys.stderr)
+                    points = Track.empty()
+                stage.points = len(points)
+            with metrics.stage('preprocess', points=len(points)):
+                batcher.push(preprocessor.push(points), received)
+        if batcher.due():
+            yield batcher.match()
+
+    batch = batcher.flush()
+    if batch is not None:
+        yield batch
+
+
+def _address(text):
+    host, _, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--tcp', type=_address, metavar='HOST:PORT', help="Read records from a TCP server")
+    source.add_argument('--tail', metavar='POS_FILE', help="Follow a growing .pos file")
+    parser.add_argument('--from-end', action='store_true', help="With --tail, skip the records already there")
+    parser.add_argument('--backend', help="Map-matching backend configuration (see matching_backend)")
+    parser.add_argument('--output', help="Append snapped points here as lat,lon lines (default: stdout)")
+    parser.add_argument('--batch-points', type=int, default=DEFAULT_BATCH_POINTS)
+    parser.add_argument('--overlap-points', type=int, default=DEFAULT_OVERLAP_POINTS)
+    parser.add_argument('--max-delay-ms', type=float, default=DEFAULT_MAX_DELAY_S * 1000)
+    parser.add_argument('--threshold-km', type=float, default=0.1, help="Outlier jump threshold")
+    parser.add_argument('--interval-s', type=float, default=1.0, help="Resampling interval (0 disables)")
+    parser.add_argument('--max-gap-s', type=float, default=30.0)
+    parser.add_argument('--time-system', choices=('GPST', 'UTC'), default=None)
+    parser.add_argument('--metrics-json', help="Write the stage timings here on exit")
+    args = parser.parse_args()
+
+    chunks = iter_tcp(args.tcp) if args.tcp else iter_tail(args.tail, from_start=not args.from_end)
+    preprocessor = StreamPreprocessor(args.threshold_km, args.interval_s or None, args.max_gap_s)
+    out = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    try:
+        with load_backend(args.backend) as backend:
+            for batch in run_stream(chunks, backend, preprocessor, args.batch_points, args.overlap_points,
+                                    args.max_delay_ms / 1000, args.time_system):
+                if not batch.ok:
+                    print(f"Matching failed for {len(batch.points)} points: {batch.error}", file=sys.stderr)
+                out.writelines(f"{lat:.7f},{lon:.7f}\n"
+                               for lat, lon in zip(batch.snapped.lat.tolist(), batch.snapped.lon.tolist()))
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        METRICS.report()
+        if args.metrics_json:
+            METRICS.write_json(args.metrics_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Manifest of processed inputs: a SQLite checkpoint store that makes directory runs incremental
+and resumable.
+
+For every input it records the SHA-256 of its content (with size and mtime, so unchanged files
+are recognised without being read again), the configuration it was processed with (output paths,
+profile, parameters), its status (running, done or failed), the stage a failed run stopped at
+with its error, and the outputs each stage wrote. A worker claims an input before processing it
+and marks it done or failed afterwards, so that
+
+- a re-run skips inputs that are done, unchanged and whose outputs still exist;
+- failed inputs, inputs whose content changed and inputs claimed with a different configuration
+  are processed again;
+- an interrupted run is resumed: inputs left 'running' are claimed again once the process that
+  held them is gone (same host) or its lease_s has expired.
+
+Several threads and processes can share one manifest file: it uses WAL journaling (readers never
+block the writer), a busy timeout, and claims are compare-and-set inside BEGIN IMMEDIATE
+transactions. Keep the file on a local disk; SQLite locking is not reliable on network shares.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+DEFAULT_MANIFEST_NAME = '.pipeline_manifest.sqlite'
+# Inputs 'running' for longer than this are considered abandoned even if their owner looks alive
+DEFAULT_LEASE_S = 6 * 3600.0
+BUSY_TIMEOUT_S = 60.0
+
+HASH_BLOCK_BYTES = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inputs (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    error TEXT,
+    owner TEXT,
+    updated REAL NOT NULL,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    input TEXT NOT NULL REFERENCES inputs(path) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (input, stage)
+);
+"""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def config_key(config):
+    """
+    Canonical text of a claim configuration (a JSON-serializable dict, or None).
+    """
+    return None if config is None else json.dumps(config, sort_keys=True, default=str)
+
+
+def _current_owner():
+    """
+    'host:pid:thread' of the calling thread, recorded on the inputs it claims.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def _owner_alive(owner):
+    """
+    Whether the process of owner may still be running. Processes on other hosts cannot be
+    checked and count as alive until their lease expires.
+    """
+    host, pid, _ = owner.rsplit(':', 2)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+class Manifest:
+    """
+    Checkpoint store of one pipeline (see the module docstring). Input paths are stored as
+    absolute paths; every method takes them in any form. Each thread and process gets its own
+    SQLite connection, and a Manifest can be pickled into worker processes.
+    """
+
+    def __init__(self, path, lease_s=DEFAULT_LEASE_S):
+        self.path = path
+        self.lease_s = lease_s
+        self._local = threading.local()
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+        if 'config' not in {row[1] for row in connection.execute('PRAGMA table_info(inputs)')}:
+            # Manifests written before configurations were recorded
+            try:
+                connection.execute('ALTER TABLE inputs ADD COLUMN config TEXT')
+            except sqlite3.OperationalError:
+                # Another process added it meanwhile
+                pass
+
+    def __getstate__(self):
+        return {'path': self.path, 'lease_s': self.lease_s}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['lease_s'])
+
+    def __repr__(self):
+        return f"Manifest({self.path})"
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = connection
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        A write transaction: taken with BEGIN IMMEDIATE, so concurrent writers queue up on the
+        busy timeout instead of failing halfway through.
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def close(self):
+        """
+        Close this thread's connection.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _key(input_file):
+        return os.path.abspath(input_file)
+
+    def _row(self, db, key):
+        return db.execute('SELECT sha256, size, mtime, status, owner, updated, config FROM inputs WHERE path = ?',
+                          (key,)).fetchone()
+
+    def _outputs_exist(self, db, key):
+        paths = [path for (path,) in db.execute('SELECT path FROM outputs WHERE input = ?', (key,))]
+        return all(os.path.exists(path) for path in paths)
+
+    def _held_by_other(self, status, owner, updated):
+        return (status == 'running' and owner != _current_owner() and _owner_alive(owner)
+                and time.time() - updated < self.lease_s)
+
+    def claim(self, input_file, config=None):
+        """
+        Take input_file for processing with config, a JSON-serializable dict of whatever decides
+        its outputs (output paths, profile, parameters). Returns False if there is nothing to do:
+        it is done with the same config, unchanged and its outputs exist, or another live worker
+        is processing it right now. Otherwise marks it running (forgetting earlier outputs) and
+        returns True.
+        """
+        key = self._key(input_file)
+        config = config_key(config)
+        stat = os.stat(key)
+        db = self._connection()
+        row = self._row(db, key)
+        if row is not None:
+            sha256, size, mtime, status, owner, updated, done_config = row
+            if self._held_by_other(status, owner, updated):
+                return False
+            if (status == 'done' and done_config == config and (size, mtime) == (stat.st_size, stat.st_mtime)
+                    and self._outputs_exist(db, key)):
+                return False
+
+        # Hash outside the transaction so other workers are not kept waiting meanwhile
+        digest = file_sha256(key)
+        with self._transaction() as db:
+            row = self._row(db, key)
+            if row is not None:
+                sha256, size, mtime, status, owner, updated, done_config = row
+                if self._held_by_other(status, owner, updated):
+                    return False
+                if status == 'done' and done_config == config and sha256 == digest and self._outputs_exist(db, key):
+                    # Touched but not changed: remember the new mtime so the next run skips the hash
+                    db.execute('UPDATE inputs SET size = ?, mtime = ? WHERE path = ?',
+                               (stat.st_size, stat.st_mtime, key))
+                    return False
+
+            db.execute('INSERT INTO inputs (path, sha256, size, mtime, status, stage, error, owner, updated, config) '
+                       "VALUES (?, ?, ?, ?, 'running', NULL, NULL, ?, ?, ?) "
+                       'ON CONFLICT (path) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size, '
+                       "mtime = excluded.mtime, status = 'running', stage = NULL, error = NULL, "
+                       'owner = excluded.owner, updated = excluded.updated, config = excluded.config',
+                       (key, digest, stat.st_size, stat.st_mtime, _current_owner(), time.time(), config))
+            db.execute('DELETE FROM outputs WHERE input = ?', (key,))
+        return True
+
+    def record_stage(self, input_file, stage, output_file=None):
+        """
+        Note that input_file has reached stage, optionally with the file that stage wrote.
+        """
+        key = self._key(input_file)
+        with self._transaction() as db:
+            db.execute('UPDATE inputs SET stage = ?, updated = ? WHERE path = ?', (stage, time.time(), key))
+            if output_file is not None:
+                db.execute('INSERT OR REPLACE INTO outputs (input, stage, path) VALUES (?, ?, ?)',
+                           (key, stage, os.path.abspath(output_file)))
+
+    def complete(self, input_file, outputs=None):
+        """
+        Mark input_file done; outputs maps stage names to the files they wrote.
+        """
+        key = self._key(input_file)
+        with self._transaction() as db:
+            for stage, output_file in (outputs or {}).items():
+                if output_file is not None:
+                    db.execute('INSERT OR REPLACE INTO outputs (input, stage, path) VALUES (?, ?, ?)',
+                               (key, stage, os.path.abspath(output_file)))
+            db.execute("UPDATE inputs SET status = 'done', error = NULL, updated = ? WHERE path = ?",
+                       (time.time(), key))
+
+    def fail(self, input_file, error, stage=None):
+        """
+        Mark input_file failed with error; stage defaults to the last one recorded.
+        """
+        key = self._key(input_file)
+        with self._transaction() as db:
+            db.execute("UPDATE inputs SET status = 'failed', error = ?, stage = COALESCE(?, stage), updated = ? "
+                       'WHERE path = ?', (str(error), stage, time.time(), key))
+
+    def outputs(self, input_file):
+        """
+        {stage: output path} recorded for input_file.
+        """
+        rows = self._connection().execute('SELECT stage, path FROM outputs WHERE input = ?',
+                                          (self._key(input_file),))
+        return dict(rows.fetchall())
+
+    def move_output(self, old_path, new_path):
+        """
+        Record that an output file was renamed.
+        """
+        with self._transaction() as db:
+            db.execute('UPDATE outputs SET path = ? WHERE path = ?',
+                       (os.path.abspath(new_path), os.path.abspath(old_path)))
+
+    def entries(self, status=None):
+        """
+        (input path, status, stage, error) of every input, or of those with the given status.
+        """
+        query = 'SELECT path, status, stage, error FROM inputs'
+        if status is None:
+            return self._connection().execute(query + ' ORDER BY path').fetchall()
+        return self._connection().execute(query + ' WHERE status = ? ORDER BY path', (status,)).fetchall()
+
+    def summary(self):
+        rows = self._connection().execute('SELECT status, COUNT(*) FROM inputs GROUP BY status').fetchall()
+        return dict(rows)
+
+    def report(self):
+        counts = self.summary()
+        print(f"Manifest {self.path}: {counts.get('done', 0)} done, {counts.get('failed', 0)} failed, "
+              f"{counts.get('running', 0)} running")
+        for path, _, stage, error in self.entries('failed'):
+            print(f"  failed: {path} ({stage}: {error})")
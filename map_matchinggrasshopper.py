@@ -1,24 +1,19 @@
-import requests
-import xml.etree.ElementTree as ET
+from match_cache import MatchCache
+from matching_backend import MATCH_URL, GraphHopperBackend, load_backend
 
-def map_matching(gpx_file, result_file, vehicle='car'):
+def map_matching(gpx_file, result_file, vehicle='car', cache=None, backend=None, url=MATCH_URL):
     """
-    Send GPX file to GraphHopper for map matching and get back snapped data.
+    Send GPX file to GraphHopper (the /match endpoint at url) for map matching and get back snapped data.
+    If a MatchCache is given, an identical earlier request (same GPX body, vehicle and
+    parameters) is answered from the cache without contacting the server.
+    Requests time out, are retried with backoff and stop while the server keeps failing (see
+    matching_backend); pass a backend (e.g. from load_backend) to choose the endpoint, profile,
+    response format or an offline fallback. Returns a MatchResult instead of printing.
     """
-    url = 'http://localhost:8989/match'
-    headers = {'Content-Type': 'application/gpx+xml'}
-    
-    with open(gpx_file, 'rb') as f:
-        response = requests.post(url, headers=headers, data=f, params={'vehicle': vehicle, 'type': 'json'})
-    
-    if response.status_code == 200:
-        result_data = response.json()
-        with open(result_file, 'w') as result_f:
-            # Save the result as a new GPX file
-            result_f.write(response.text)
-        print(f"Map matching completed for {gpx_file}. Result saved to {result_file}")
-    else:
-        print(f"Error in map matching for {gpx_file}: {response.text}")
+    if backend is not None:
+        return backend.match_file(gpx_file, result_file)
+    with GraphHopperBackend(url, profile=vehicle, cache=cache) as backend:
+        return backend.match_file(gpx_file, result_file)
 
 
 def main(input_gpx_file, output_gpx_file):
@@ -27,11 +22,17 @@ def main(input_gpx_file, output_gpx_file):
     """
     # Step 1: Map Matching using GraphHopper
     result_file = output_gpx_file.replace(".gpx", "_snapped.gpx")
-    map_matching(input_gpx_file, result_file)
+    with load_backend(cache=MatchCache()) as backend:
+        result = map_matching(input_gpx_file, result_file, backend=backend)
+    if result.ok:
+        print(f"Map matching completed for {input_gpx_file} in {result.latency_s:.2f} s. Result saved to {result_file}")
+    else:
+        print(f"Error in map matching for {input_gpx_file} after {result.attempts} attempts: {result.error}")
 
 
 # Example usage
-input_gpx_file = "interpolated_trajectory.gpx"  # Path to the interpolated GPX file
-output_gpx_file = "final_snapped_trajectory.gpx"  # Path for the final output
+if __name__ == "__main__":
+    input_gpx_file = "interpolated_trajectory.gpx"  # Path to the interpolated GPX file
+    output_gpx_file = "final_snapped_trajectory.gpx"  # Path for the final output
 
-main(input_gpx_file, output_gpx_file)
+    main(input_gpx_file, output_gpx_file)
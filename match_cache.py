@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_CACHE_DIR = '.match_cache'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class MatchCache:
+    """
+    On-disk cache of GraphHopper /match responses, keyed by a SHA-256 of the URL,
+    the query parameters (vehicle, type, ...) and the request body.
+
+    Entries are plain files under directory/<2 hex chars>/<key>. A hit refreshes the file's
+    mtime, and once the cache grows past max_bytes the least recently used entries are
+    deleted until it is back under 90% of the budget. Writes go through a temp file and
+    os.replace, so several processes can share one cache directory.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path, _ in self._entries())
+
+    @staticmethod
+    def key(body, url, params):
+        """
+        Cache key for one request: identical body, URL and parameters give the same key.
+        """
+        h = hashlib.sha256()
+        h.update(url.encode('utf-8'))
+        h.update(b'\0')
+        h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        h.update(b'\0')
+        h.update(body)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        """
+        (path, mtime) of every cached response.
+        """
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    yield path, os.path.getmtime(path)
+                except FileNotFoundError:  # Evicted by another worker meanwhile
+                    continue
+
+    def get(self, key):
+        """
+        Cached response body (bytes) for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        Store a response body under key and evict old entries if the cache is over budget.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Delete least recently used entries until the cache is under 90% of max_bytes.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = 0
+        sizes = []
+        for path, _ in entries:
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                size = 0
+            sizes.append(size)
+            self._size += size
+
+        target = self.max_bytes * 0.9
+        for (path, _), size in zip(entries, sizes):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'bytes': self._size,
+        }
+
+    def report(self):
+        s = self.stats()
+        print(f"Match cache: {s['hits']} hits, {s['misses']} misses ({s['hit_rate']:.0%} hit rate), "
+              f"{s['evictions']} evictions, {s['bytes'] / 1e6:.1f} MB on disk")
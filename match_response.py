@@ -0,0 +1,236 @@
+"""
+Decoding of GraphHopper /match responses into Tracks, in one pass over the parsed JSON.
+
+Handles every geometry a /match response can carry:
+
+    points as GeoJSON          points_encoded=false: a LineString of [lon, lat(, ele)]
+    points as encoded polyline points_encoded=true (GraphHopper's default): Google's polyline
+                               format, with elevation in centimetres as a third dimension when the
+                               path has one, and points_encoded_multiplier (1e5 unless given)
+    points-only responses      calc_points=false: no route geometry, only snapped_waypoints (the
+                               input points moved onto the road), in either encoding
+
+Polylines are decoded with NumPy: the characters become a byte array, value boundaries are found
+with one comparison, the 5-bit chunks of all values are combined with one reduceat and the
+deltas are summed with one cumsum, so long routes decode at array speed instead of one Python
+loop iteration per character.
+
+Alongside the geometry a MatchedTrack keeps the matching metadata: route distance and time, the
+matched/original distances of the map_matching block, and, given the original track, the
+distance from every original point to the snapped route.
+"""
+import json
+
+import numpy as np
+
+from geodistance import haversine_km
+from gpxstream import open_input
+from road_index import RoadIndex, polyline_segments
+from track import Track
+
+POLYLINE_MULTIPLIER = 1e5
+# GraphHopper encodes elevation in centimetres
+ELEVATION_MULTIPLIER = 100.0
+# Original points farther than this from the snapped route get an infinite snap distance
+DEFAULT_SNAP_MAX_M = 200.0
+
+
+def decode_polyline(encoded, dimensions=2, multiplier=POLYLINE_MULTIPLIER):
+    """
+    (k, dimensions) array of an encoded polyline: lat, lon and, for dimensions=3, elevation in
+    meters. Raises ValueError on characters outside the format or a truncated string.
+    """
+    if not encoded:
+        return np.empty((0, dimensions))
+    chars = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if chars.min() < 0 or chars.max() > 63:
+        raise ValueError("Not an encoded polyline")
+    # Every value ends with the first character that has the continuation bit (0x20) clear
+    ends = np.flatnonzero((chars & 0x20) == 0)
+    if not len(ends) or ends[-1] != len(chars) - 1:
+        raise ValueError("Truncated encoded polyline")
+    if len(ends) % dimensions:
+        raise ValueError(f"Encoded polyline does not hold {dimensions}-dimensional points")
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(chars)) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chars & 0x1f) << (5 * position), starts)
+    # Zigzag: the lowest bit is the sign
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1).reshape(-1, dimensions)
+    points = np.cumsum(deltas, axis=0).astype(np.float64)
+    points[:, :2] /= multiplier
+    if dimensions > 2:
+        points[:, 2] /= ELEVATION_MULTIPLIER
+    return points
+
+
+def encode_polyline(points, multiplier=POLYLINE_MULTIPLIER):
+    """
+    Inverse of decode_polyline for a (k, 2) lat/lon or (k, 3) lat/lon/elevation array.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if not len(points):
+        return ''
+    scaled = points * multiplier
+    if points.shape[1] > 2:
+        scaled[:, 2] = points[:, 2] * ELEVATION_MULTIPLIER
+    deltas = np.diff(np.round(scaled).astype(np.int64), axis=0, prepend=0).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    # Up to 7 chunks of 5 bits per value; all but the last carry the continuation bit
+    chunks = (values[:, None] >> (5 * np.arange(7))) & 0x1f
+    count = (np.floor(np.log2(np.maximum(values, 1))).astype(np.int64) + 5) // 5
+    used = np.arange(7) < count[:, None]
+    more = np.arange(7) < count[:, None] - 1
+    chars = (chunks | np.where(more, 0x20, 0)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+def _path_dimensions(path):
+    """
+    2 or 3: whether the encoded points of a path carry elevation. GraphHopper adds the elevation
+    range to the bbox when they do.
+    """
+    return 3 if len(path.get('bbox') or ()) == 6 else 2
+
+
+def _decode_points(points, path, elevation=None):
+    """
+    Track of a points or snapped_waypoints member of a response path, in either encoding.
+    """
+    if isinstance(points, str):
+        dimensions = _path_dimensions(path) if elevation is None else (3 if elevation else 2)
+        latlon = decode_polyline(points, dimensions, path.get('points_encoded_multiplier', POLYLINE_MULTIPLIER))
+        return Track(latlon[:, 0], latlon[:, 1], latlon[:, 2] if dimensions > 2 else None)
+
+    coordinates = np.asarray(points['coordinates'], dtype=np.float64)
+    if coordinates.size == 0:
+        return Track.empty()
+    return Track(coordinates[:, 1], coordinates[:, 0], coordinates[:, 2] if coordinates.shape[1] > 2 else None)
+
+
+def snap_distances_m(original, snapped, max_distance_m=DEFAULT_SNAP_MAX_M):
+    """
+    Distance in meters from every point of original to the snapped route (inf beyond
+    max_distance_m or for points without a position).
+    """
+    if not len(snapped):
+        return np.full(len(original), np.inf)
+    if len(snapped) == 1:
+        distance = haversine_km(original.lat, original.lon, snapped.lat[0], snapped.lon[0]) * 1000.0
+        return np.where(distance <= max_distance_m, distance, np.inf)
+    index = RoadIndex(polyline_segments(np.column_stack((snapped.lat, snapped.lon))), max_distance_m)
+    return index.distances_m(original.lat, original.lon)
+
+
+class MatchedTrack:
+    """
+    A decoded /match response.
+
+    track                 snapped route geometry (for points-only responses: the snapped waypoints)
+    waypoints             snapped input points, if the response has them, else None
+    distance_m, time_s    length and travel time of the route, if given
+    matched_distance_m    map_matching.distance: length of the matched route
+    original_distance_m   map_matching.original_distance: length of the input track
+    snap_distance_m       per original point, distance to the route (needs the original track)
+    """
+    __slots__ = ('track', 'waypoints', 'distance_m', 'time_s', 'matched_distance_m', 'original_distance_m',
+                 'snap_distance_m')
+
+    def __init__(self, track, waypoints=None, distance_m=None, time_s=None, matched_distance_m=None,
+                 original_distance_m=None, snap_distance_m=None):
+        self.track = track
+        self.waypoints = waypoints
+        self.distance_m = distance_m
+        self.time_s = time_s
+        self.matched_distance_m = matched_distance_m
+        self.original_distance_m = original_distance_m
+        self.snap_distance_m = snap_distance_m
+
+    def __repr__(self):
+        return f"MatchedTrack({len(self.track)} points, distance_m={self.distance_m})"
+
+    def metadata(self):
+        """
+        JSON-serializable summary: distances, point counts and snap-distance statistics.
+        """
+        summary = {
+            'points': len(self.track),
+            'waypoints': len(self.waypoints) if self.waypoints is not None else None,
+            'distance_m': self.distance_m,
+            'time_s': self.time_s,
+            'matched_distance_m': self.matched_distance_m,
+            'original_distance_m': self.original_distance_m,
+        }
+        if self.snap_distance_m is not None:
+            snap = self.snap_distance_m
+            near = snap[np.isfinite(snap)]
+            summary['snap_distance_m'] = {
+                'mean': float(near.mean()) if len(near) else None,
+                'p95': float(np.percentile(near, 95)) if len(near) else None,
+                'max': float(near.max()) if len(near) else None,
+                'unmatched': int(len(snap) - len(near)),
+            }
+        return summary
+
+
+def _optional_float(value, scale=1.0):
+    return float(value) * scale if value is not None else None
+
+
+def decode_response(data, original=None, elevation=None, snap_max_m=DEFAULT_SNAP_MAX_M):
+    """
+    MatchedTrack of a /match response, given as parsed JSON or as the raw bytes/text. With the
+    original Track the snap distance of each of its points is computed too. elevation=None
+    infers from the response whether encoded points carry elevation.
+    Raises ValueError for anything that is not a /match response with a path.
+    """
+    if isinstance(data, (bytes, bytearray, str)):
+        data = json.loads(data)
+    try:
+        path = data['paths'][0]
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError("Not a /match response with a path") from e
+
+    waypoints = None
+    if path.get('snapped_waypoints') is not None:
+        waypoints = _decode_points(path['snapped_waypoints'], path, elevation)
+    if path.get('points') is not None:
+        track = _decode_points(path['points'], path, elevation)
+    elif waypoints is not None:
+        track = waypoints
+    else:
+        raise ValueError("/match response path has neither points nor snapped_waypoints")
+
+    info = data.get('map_matching') or {}
+    return MatchedTrack(
+        track,
+        waypoints=waypoints,
+        distance_m=_optional_float(path.get('distance')),
+        time_s=_optional_float(path.get('time'), 1e-3),
+        matched_distance_m=_optional_float(info.get('distance')),
+        original_distance_m=_optional_float(info.get('original_distance')),
+        snap_distance_m=snap_distances_m(original, track, snap_max_m) if original is not None else None,
+    )
+
+
+def _open_bytes(path):
+    f = open_input(path)
+    return open(f, 'rb') if isinstance(f, str) else f
+
+
+def is_match_response(path):
+    """
+    Whether the file at path (optionally gzip-compressed) holds JSON rather than XML, e.g. a
+    /match response saved under a .gpx name by an older run.
+    """
+    with _open_bytes(path) as f:
+        head = f.read(64).lstrip()
+    return head.startswith(b'{')
+
+
+def read_match_response(path, original=None, elevation=None):
+    """
+    MatchedTrack of a /match response file (.json, .json.gz, or JSON under any other name).
+    """
+    with _open_bytes(path) as f:
+        return decode_response(json.load(f), original, elevation)
@@ -0,0 +1,606 @@
+"""
+Map-matching backends behind one interface, selected by configuration.
+
+    GraphHopperBackend  a GraphHopper (or compatible) /match server over HTTP, with connect and
+                        read timeouts, exponential-backoff retries and a circuit breaker
+    OfflineBackend      the local HMM matcher (hmm_matcher) over a road network extract
+    FallbackBackend     a primary backend that hands over to a second one when a request fails
+                        or the primary's circuit is open
+
+Every backend has
+    match(track)                      snapped geometry as a Track; raises MatchError on failure
+    match_file(gpx_file, result_file) match a GPX file and save the response; returns a
+                                      MatchResult instead of raising or printing
+                                      (see save_response for the formats)
+    close()                           release connections (backends are also context managers)
+
+A configuration is a dict, or the path of a JSON file holding one, e.g.
+
+    {"engine": "graphhopper", "url": "http://gh-2:8989/match", "profile": "car",
+     "response_format": "json", "connect_timeout_s": 3, "read_timeout_s": 60, "retries": 3,
+     "backoff_s": 0.5, "failure_threshold": 5, "reset_timeout_s": 30,
+     "fallback": {"engine": "offline", "roads": "delhi.osm"}}
+
+Keys other than engine, fallback, failure_threshold and reset_timeout_s are passed to the
+backend's constructor.
+"""
+import io
+import json
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from hmm_matcher import HmmMatcher, load_road_graph, to_graphhopper_json
+from match_cache import MatchCache
+from match_response import MatchedTrack, decode_response, snap_distances_m
+from track import Track
+from trackio import WRITE_EXTENSIONS, track_extension, write_track
+
+MATCH_URL = 'http://localhost:8989/match'
+
+RESPONSE_FORMATS = ('json', 'gpx')
+DEFAULT_CONNECT_TIMEOUT_S = 3.05
+DEFAULT_READ_TIMEOUT_S = 60.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_S = 0.5
+MAX_BACKOFF_S = 30.0
+DEFAULT_POOL_SIZE = 8
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT_S = 30.0
+
+# Responses worth trying again: rate limiting and overloaded or restarting servers
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Longest server error text kept in a MatchError
+_ERROR_TEXT_CHARS = 500
+
+
+class MatchError(RuntimeError):
+    """
+    A map-matching request that failed. status is the HTTP status (None for connection errors
+    and timeouts); retryable tells whether the same request may succeed later.
+    """
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class CircuitOpenError(MatchError):
+    """
+    The request was not sent because the backend's circuit breaker is open.
+    """
+
+    def __init__(self, message):
+        super().__init__(message, retryable=True)
+
+
+class MatchResult:
+    """
+    Outcome of matching one track or file.
+
+    engine      backend that produced it ('graphhopper', 'offline')
+    body        raw response bytes (JSON or GPX), if any
+    track       snapped Track, if it was decoded
+    attempts    requests sent (0 for cache hits and offline matches)
+    latency_s   wall time including retries and backoff
+    from_cache  answered from the MatchCache
+    error       the MatchError, or None on success
+    result_file where the response was saved, if it was
+    metadata    MatchedTrack.metadata() of the saved response: distances and snap distances
+    """
+    __slots__ = ('engine', 'body', 'track', 'attempts', 'latency_s', 'from_cache', 'error', 'result_file',
+                 'metadata')
+
+    def __init__(self, engine, body=None, track=None, attempts=0, latency_s=0.0, from_cache=False, error=None,
+                 result_file=None, metadata=None):
+        self.engine = engine
+        self.body = body
+        self.track = track
+        self.attempts = attempts
+        self.latency_s = latency_s
+        self.from_cache = from_cache
+        self.error = error
+        self.result_file = result_file
+        self.metadata = metadata
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'error={self.error}'
+        return f"MatchResult({self.engine}, {status}, attempts={self.attempts}, latency_s={self.latency_s:.3f})"
+
+    def to_dict(self):
+        """
+        JSON-serializable summary (without the response body).
+        """
+        return {
+            'engine': self.engine,
+            'ok': self.ok,
+            'attempts': self.attempts,
+            'latency_s': self.latency_s,
+            'from_cache': self.from_cache,
+            'points': len(self.track) if self.track is not None else None,
+            'result_file': self.result_file,
+            'error': str(self.error) if self.error is not None else None,
+            'status': getattr(self.error, 'status', None),
+            'retryable': getattr(self.error, 'retryable', None),
+            'metadata': self.metadata,
+        }
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a server that keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and allow() refuses requests
+    for reset_timeout_s. Then a single trial request is let through: its success closes the
+    circuit, its failure opens it for another reset_timeout_s. Thread-safe.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout_s=DEFAULT_RESET_TIMEOUT_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self.state = 'half_open'
+                return True
+            # Open, or half-open with the trial request still in flight
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+def backoff_delays(retries, backoff_s=DEFAULT_BACKOFF_S, max_backoff_s=MAX_BACKOFF_S):
+    """
+    Seconds to wait before each of 1 + retries attempts: 0 for the first, then exponentially
+    growing delays with jitter (half fixed, half random), so clients that failed together do not
+    retry in lockstep.
+    """
+    yield 0.0
+    for attempt in range(retries):
+        delay = min(max_backoff_s, backoff_s * 2 ** attempt)
+        yield delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_after_s(value):
+    """
+    Seconds of a Retry-After header value, if the server sent one as a number (else 0), capped
+    at MAX_BACKOFF_S.
+    """
+    try:
+        return min(MAX_BACKOFF_S, max(0.0, float(value or '')))
+    except ValueError:
+        return 0.0
+
+
+class RequestAttempts:
+    """
+    The retry loop of one /match request without its I/O, so the blocking GraphHopperBackend and
+    the asyncio batch matcher decide alike: what is retried, how long to wait before the next
+    attempt (the backoff delay or the server's Retry-After, whichever is longer), what the
+    circuit breaker is told and what each attempt records into metrics as 'http_request'.
+
+        attempts = RequestAttempts(url, breaker, retries, backoff_s, metrics, len(body))
+        for wait_s in attempts:
+            sleep(wait_s)
+            if not attempts.begin():
+                break
+            try:
+                status, content, retry_after = post(body)
+            except <connection errors and timeouts> as e:
+                attempts.failed(e)
+                continue
+            if attempts.responded(status, content, retry_after):
+                return content
+        # attempts.error and attempts.count tell what went wrong and how often it was tried
+
+    The iteration ends after the last retry or a response that is not worth retrying.
+    """
+
+    def __init__(self, url, breaker, retries=DEFAULT_RETRIES, backoff_s=DEFAULT_BACKOFF_S, metrics=None,
+                 bytes_written=0):
+        self.url = url
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.metrics = metrics
+        self.bytes_written = bytes_written
+        self.count = 0
+        self.error = None
+        self._wait_s = 0.0
+        self._done = False
+        self._sent = None
+
+    def __iter__(self):
+        for delay in backoff_delays(self.retries, self.backoff_s):
+            if self._done:
+                return
+            yield max(delay, self._wait_s)
+
+    def begin(self):
+        """
+        Called right before sending. False (with error set) if the circuit breaker refuses the
+        request; the caller stops then.
+        """
+        if not self.breaker.allow():
+            self.error = CircuitOpenError(f"Circuit open for {self.url} after repeated failures")
+            self._done = True
+            return False
+        self.count += 1
+        self._wait_s = 0.0
+        self._sent = time.perf_counter()
+        return True
+
+    def _record(self, bytes_read, error):
+        if self.metrics is not None:
+            self.metrics.record('http_request', time.perf_counter() - self._sent, bytes_read=bytes_read,
+                                bytes_written=self.bytes_written, error=error)
+
+    def failed(self, exception):
+        """
+        The attempt got no response (connection error or timeout); it is retried.
+        """
+        self._record(0, True)
+        self.breaker.record_failure()
+        self.error = MatchError(f"{type(exception).__name__}: {exception}", retryable=True)
+
+    def responded(self, status, content, retry_after=None):
+        """
+        The attempt got a response: status, body bytes and the Retry-After header value (if
+        any). True if it succeeded; otherwise error is set and the next attempt, if the status
+        is one of RETRY_STATUSES, waits at least Retry-After.
+        """
+        self._record(len(content), status != 200)
+        if status == 200:
+            self.breaker.record_success()
+            self.error = None
+            self._done = True
+            return True
+
+        retryable = status in RETRY_STATUSES
+        self.error = MatchError(
+            f"GraphHopper returned {status}: {content[:_ERROR_TEXT_CHARS].decode('utf-8', 'replace')}",
+            status=status, retryable=retryable)
+        if retryable:
+            self.breaker.record_failure()
+            self._wait_s = retry_after_s(retry_after)
+        else:
+            # The server is healthy, it rejected this track (e.g. too far from any road)
+            self.breaker.record_success()
+            self._done = True
+        return False
+
+
+def _write_bytes_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_track_atomic(track, path):
+    # Keep the format extension on the temporary name, it selects the writer
+    extension = track_extension(path)
+    tmp = f"{path[:len(path) - len(extension)]}.{os.getpid()}.{threading.get_ident()}.tmp{extension}"
+    try:
+        write_track(track, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _is_json(body):
+    return body.lstrip()[:1] == b'{'
+
+
+def decode_body(body, original=None):
+    """
+    MatchedTrack of a /match response body, JSON (any point encoding, see match_response) or
+    GPX. original, the input as a Track or GPX bytes, adds per-point snap distances.
+    Raises MatchError if the body cannot be decoded.
+    """
+    try:
+        if isinstance(original, (bytes, bytearray)):
+            original = Track.from_gpx(io.BytesIO(original))
+        if _is_json(body):
+            return decode_response(body, original)
+        track = Track.from_gpx(io.BytesIO(body))
+        return MatchedTrack(track, snap_distance_m=snap_distances_m(original, track) if original is not None else None)
+    except (ValueError, KeyError, IndexError, TypeError, SyntaxError) as e:
+        raise MatchError(f"Unreadable /match response: {e!r}") from e
+
+
+def save_response(body, result_file, original=None):
+    """
+    Post-processing stage of a /match response: decode it once and save it in the format of
+    result_file's extension. Track formats (.gpx, .gpx.gz, .npy) get the snapped geometry
+    written straight from the decoded arrays, so a JSON response never lands in a file named
+    .gpx; any other name (.json) gets the body as received, as does a GPX response saved as
+    .gpx. Writes are atomic. Returns the MatchedTrack (see decode_body for original).
+    """
+    matched = decode_body(body, original)
+    extension = track_extension(result_file)
+    if extension in WRITE_EXTENSIONS and (extension != '.gpx' or _is_json(body)):
+        _write_track_atomic(matched.track, result_file)
+    else:
+        _write_bytes_atomic(result_file, body)
+    return matched
+
+
+class MatchBackend(ABC):
+    """
+    Base class of the backends: context management and the shared match/match_file contract.
+    """
+    engine = None
+
+    @abstractmethod
+    def match(self, track):
+        """
+        Snapped Track of track; raises MatchError on failure.
+        """
+
+    @abstractmethod
+    def match_file(self, gpx_file, result_file):
+        """
+        Match a GPX file and save the response to result_file; returns a MatchResult.
+        """
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class GraphHopperBackend(MatchBackend):
+    """
+    A GraphHopper /match endpoint over one pooled requests.Session. Safe to share between threads.
+
+    url                 /match endpoint
+    profile             routing profile, sent as the profile_param query parameter ('vehicle' for
+                        GraphHopper before 1.0, 'profile' after)
+    response_format     'json' (with points_encoded=false) or 'gpx'
+    connect_timeout_s   give up connecting after this long
+    read_timeout_s      give up when the server sends nothing for this long
+    retries             further attempts after connection errors, timeouts and RETRY_STATUSES
+    backoff_s           first retry delay; doubles per retry (with jitter), capped at MAX_BACKOFF_S
+    breaker             CircuitBreaker shared by every request of this backend (default: a new one)
+    cache               MatchCache answering repeated requests from disk
+    pool_size           pooled connections, i.e. requests that can be in flight at once
+    metrics             instrumentation.Metrics that times every HTTP attempt as stage 'http_request'
+    """
+    engine = 'graphhopper'
+
+    def __init__(self, url=MATCH_URL, profile='car', response_format='json', profile_param='vehicle',
+                 connect_timeout_s=DEFAULT_CONNECT_TIMEOUT_S, read_timeout_s=DEFAULT_READ_TIMEOUT_S,
+                 retries=DEFAULT_RETRIES, backoff_s=DEFAULT_BACKOFF_S, breaker=None, cache=None,
+                 pool_size=DEFAULT_POOL_SIZE, metrics=None):
+        if response_format not in RESPONSE_FORMATS:
+            raise ValueError(f"response_format must be one of {RESPONSE_FORMATS}")
+        self.url = url
+        self.response_format = response_format
+        self.params = {profile_param: profile, 'type': response_format}
+        if response_format == 'json':
+            self.params['points_encoded'] = 'false'
+        self.timeout = (connect_timeout_s, read_timeout_s)
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.cache = cache
+        self.metrics = metrics
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __repr__(self):
+        return f"GraphHopperBackend({self.url}, {self.params})"
+
+    def close(self):
+        self.session.close()
+
+    def request(self, body):
+        """
+        POST one GPX body. Returns a MatchResult holding the raw response; failures are in
+        result.error rather than raised.
+        """
+        start = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key = MatchCache.key(body, self.url, self.params)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return MatchResult(self.engine, body=cached, latency_s=time.perf_counter() - start, from_cache=True)
+
+        attempts = RequestAttempts(self.url, self.breaker, self.retries, self.backoff_s, self.metrics, len(body))
+        for wait_s in attempts:
+            time.sleep(wait_s)
+            if not attempts.begin():
+                break
+            try:
+                response = self.session.post(self.url, headers={'Content-Type': 'application/gpx+xml'},
+                                             data=body, params=self.params, timeout=self.timeout)
+            except requests.RequestException as e:
+                attempts.failed(e)
+                continue
+            if attempts.responded(response.status_code, response.content, response.headers.get('Retry-After')):
+                if self.cache is not None:
+                    self.cache.put(key, response.content)
+                return MatchResult(self.engine, body=response.content, attempts=attempts.count,
+                                   latency_s=time.perf_counter() - start)
+
+        return MatchResult(self.engine, attempts=attempts.count, latency_s=time.perf_counter() - start,
+                           error=attempts.error)
+
+    def decode(self, body):
+        """
+        Snapped Track of a response body in this backend's response_format.
+        """
+        return decode_body(body).track
+
+    def match(self, track):
+        result = self.request(track.to_gpx_bytes())
+        if not result.ok:
+            raise result.error
+        return self.decode(result.body)
+
+    def match_file(self, gpx_file, result_file):
+        with open(gpx_file, 'rb') as f:
+            body = f.read()
+        result = self.request(body)
+        if result.ok:
+            try:
+                matched = save_response(result.body, result_file, original=body)
+            except MatchError as e:
+                result.error = e
+                return result
+            result.track = matched.track
+            result.metadata = matched.metadata()
+            result.result_file = result_file
+        return result
+
+
+class OfflineBackend(MatchBackend):
+    """
+    The HMM matcher over a local road network extract (GeoJSON or OSM XML). The graph is built
+    once per process and path. Responses are written GraphHopper-style: JSON (as with
+    points_encoded=false) or GPX.
+    """
+    engine = 'offline'
+
+    def __init__(self, roads, response_format='json', **hmm_options):
+        if response_format not in RESPONSE_FORMATS:
+            raise ValueError(f"response_format must be one of {RESPONSE_FORMATS}")
+        self.roads = roads
+        self.response_format = response_format
+        self.matcher = HmmMatcher(load_road_graph(roads), **hmm_options)
+
+    def __repr__(self):
+        return f"OfflineBackend({self.roads})"
+
+    def match(self, track):
+        snapped = self.matcher.match(track)
+        if not len(snapped):
+            raise MatchError(f"No road within {self.matcher.graph.index.max_distance_m:g} m of the track")
+        return snapped
+
+    def match_file(self, gpx_file, result_file):
+        start = time.perf_counter()
+        track = Track.from_gpx(gpx_file)
+        try:
+            snapped = self.match(track)
+        except MatchError as e:
+            return MatchResult(self.engine, latency_s=time.perf_counter() - start, error=e)
+
+        if self.response_format == 'gpx':
+            body = snapped.to_gpx_bytes()
+        else:
+            body = json.dumps(to_graphhopper_json(snapped)).encode('utf-8')
+        try:
+            matched = save_response(body, result_file, original=track)
+        except MatchError as e:
+            return MatchResult(self.engine, body=body, track=snapped, latency_s=time.perf_counter() - start, error=e)
+        return MatchResult(self.engine, body=body, track=snapped, latency_s=time.perf_counter() - start,
+                           result_file=result_file, metadata=matched.metadata())
+
+
+class FallbackBackend(MatchBackend):
+    """
+    Tries primary first and fallback when primary fails, e.g. GraphHopper backed by the offline
+    matcher. While the primary's circuit is open, requests go straight to the fallback.
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+
+    def __repr__(self):
+        return f"FallbackBackend({self.primary!r}, {self.fallback!r})"
+
+    @property
+    def engine(self):
+        return self.primary.engine
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+    def match(self, track):
+        try:
+            return self.primary.match(track)
+        except MatchError:
+            return self.fallback.match(track)
+
+    def match_file(self, gpx_file, result_file):
+        result = self.primary.match_file(gpx_file, result_file)
+        if result.ok:
+            return result
+        fallback = self.fallback.match_file(gpx_file, result_file)
+        fallback.attempts += result.attempts
+        fallback.latency_s += result.latency_s
+        return fallback
+
+
+def load_backend(config=None, cache=None):
+    """
+    Build a backend from a configuration dict or JSON file (see the module docstring); None
+    gives a GraphHopperBackend for MATCH_URL. cache is used by every GraphHopper backend.
+    """
+    if config is None:
+        config = {}
+    elif isinstance(config, str):
+        with open(config, encoding='utf-8') as f:
+            config = json.load(f)
+    options = dict(config)
+    engine = options.pop('engine', 'graphhopper')
+    fallback = options.pop('fallback', None)
+
+    if engine == 'graphhopper':
+        breaker = CircuitBreaker(options.pop('failure_threshold', DEFAULT_FAILURE_THRESHOLD),
+                                 options.pop('reset_timeout_s', DEFAULT_RESET_TIMEOUT_S))
+        backend = GraphHopperBackend(breaker=breaker, cache=cache, **options)
+    elif engine == 'offline':
+        backend = OfflineBackend(**options)
+    else:
+        raise ValueError(f"Unknown map-matching engine: {engine!r}")
+
+    if fallback:
+        backend = FallbackBackend(backend, load_backend(fallback, cache))
+    return backend
@@ -1,77 +1,192 @@
-import xml.etree.ElementTree as ET
-from datetime import datetime
+import heapq
+import itertools
+import math
+import os
+from collections import deque
+
+import numpy as np
+
+from gpxstream import iter_trackpoints, write_gpx
+from kmlstream import iter_kml_points
+from pos_loader import iter_pos_blocks, load_pos
+from track import Track
 
 def parse_pos_file(pos_file):
     """
     Parse .pos file to extract GPS data points (latitude, longitude, timestamp).
-    Returns a list of tuples (timestamp, lat, lon).
-    """
-    pos_data = []
-    with open(pos_file, 'r') as f:
-        for line in f:
-            parts = line.split()  # Assuming the .pos file is space-separated
-            timestamp = parts[0]  # Assuming the timestamp is the first element
-            lat = float(parts[1])
-            lon = float(parts[2])
-            pos_data.append((timestamp, lat, lon))
-    return pos_data
+    Returns a Track (timestamps converted to epoch seconds, UTC).
+    Any layout pos_loader understands works: RTKLIB, CSV or space-separated ISO timestamps.
+    """
+    return load_pos(pos_file)
 
 def parse_kml_file(kml_file):
     """
     Parse .kml file to extract GPS data points (latitude, longitude, timestamp).
-    Returns a list of tuples (timestamp, lat, lon).
+    Returns a Track, with the real timestamps of gx:Track and TimeStamp data (see kmlstream).
     """
-    kml_data = []
-    tree = ET.parse(kml_file)
-    root = tree.getroot()
+    return Track.from_kml(kml_file)
+
+def _ranks(count, priority):
+    """
+    Quality rank of each source (lower is better); by default the order the sources were given in.
+    """
+    if priority is None:
+        return list(range(count))
+    if len(priority) != count:
+        raise ValueError("priority needs one rank per source")
+    return list(priority)
+
+def _time_key(point):
+    # Points without a timestamp cannot be placed; they sort after every timed point
+    t = point[3]
+    return t if t == t else math.inf
 
-    # Extract all <trkpt> elements that represent track points in KML
-    for trkpt in root.findall('.//{http://www.topografix.com/GPX/1/1}trkpt'):
-        lat = float(trkpt.attrib['lat'])
-        lon = float(trkpt.attrib['lon'])
-        time = trkpt.find('{http://www.topografix.com/GPX/1/1}time').text
-        kml_data.append((time, lat, lon))
-    return kml_data
+def _keyed(source, rank):
+    for point in source:
+        yield _time_key(point), rank, point
 
-def merge_data(pos_data, kml_data):
+def iter_merge(sources, tolerance_s=None, priority=None):
     """
-    Merge data from .pos and .kml files by timestamp.
-    Returns a list of tuples sorted by timestamp.
+    Streaming k-way merge of time-ordered point sources into one time-ordered stream.
+
+    sources      iterables of (lat, lon, ele, time) points (Tracks work too), each already
+                 sorted by time, as receiver logs are
+    tolerance_s  None keeps every point. Otherwise a point is dropped when a point from a
+                 higher-quality source lies within tolerance_s seconds of it, so where several
+                 receivers logged the same moment only the best one is kept
+    priority     quality rank per source, lower is better (default: the order of sources)
+
+    Points of equal time come out in rank order. Only the heads of the sources and the points
+    of the last tolerance_s seconds are held in memory. The merge costs O(n log k); the tolerance
+    check adds O(k) per point, as it looks at the nearest earlier and later point of each better
+    rank only, kept in one short queue of times per rank.
     """
-    merged_data = pos_data + kml_data
-    merged_data.sort(key=lambda x: datetime.strptime(x[0], "%Y-%m-%dT%H:%M:%S.%f"))  # Adjust format if necessary
-    return merged_data
+    ranks = _ranks(len(sources), priority)
+    streams = [_keyed(source, rank) for source, rank in zip(sources, ranks)]
+    merged = heapq.merge(*streams, key=lambda item: item[:2])
 
-def create_gpx(merged_data, output_file):
+    if tolerance_s is None:
+        for _, _, point in merged:
+            yield point
+        return
+
+    better_ranks = {rank: sorted({other for other in ranks if other < rank}) for rank in ranks}
+    # Times of each rank's points from the one before the oldest pending point onwards
+    recent = {rank: deque() for rank in ranks}
+    # Points of the last tolerance_s seconds, as (time, rank, point), in merge order
+    pending = deque()
+
+    def near_better(t, rank):
+        # Pending points leave in time order, so times before t's predecessor are never needed again
+        for other in better_ranks[rank]:
+            times = recent[other]
+            while len(times) > 1 and times[1] <= t:
+                times.popleft()
+            if any(abs(near - t) <= tolerance_s for near in itertools.islice(times, 2)):
+                return True
+        return False
+
+    for t, rank, point in merged:
+        # A pending point is decided once every point within tolerance_s after it has been seen
+        while pending and not t - pending[0][0] <= tolerance_s:
+            done_t, done_rank, done = pending.popleft()
+            if done_t == math.inf or not near_better(done_t, done_rank):
+                yield done
+        if t != math.inf:
+            recent[rank].append(t)
+        pending.append((t, rank, point))
+
+    for done_t, done_rank, done in pending:
+        if done_t == math.inf or not near_better(done_t, done_rank):
+            yield done
+
+def merge_tracks(tracks, tolerance_s=None, priority=None):
     """
-    Create a .gpx file from the merged data (timestamp, lat, lon).
+    Vectorized counterpart of iter_merge for Tracks already in memory; same ordering and
+    near-duplicate rule. The tracks are concatenated in rank order and stably sorted by time
+    (NumPy's stable sort is a timsort for floats, which merges the k sorted runs in close to
+    linear time), so points of equal time keep their rank order.
     """
-    gpx = ET.Element('gpx', version="1.1", creator="Merged GPX")
+    tracks = list(tracks)
+    ranks = _ranks(len(tracks), priority)
+    order = sorted(range(len(tracks)), key=lambda i: ranks[i])
+    tracks = [tracks[i] for i in order]
+    ranks = [ranks[i] for i in order]
+
+    if tolerance_s is not None:
+        kept = []
+        better = np.empty(0)  # Sorted times of every source ranked above the current one
+        same_rank = []
+        for i, track in enumerate(tracks):
+            if i and ranks[i] != ranks[i - 1]:
+                better = np.sort(np.concatenate([better] + same_rank))
+                same_rank = []
+            t = np.asarray(track.time, dtype=np.float64)
+            if better.size:
+                idx = np.searchsorted(better, t)
+                before = np.abs(t - better[np.maximum(idx - 1, 0)])
+                after = np.abs(better[np.minimum(idx, better.size - 1)] - t)
+                track = track.select(~(np.fmin(before, after) <= tolerance_s))
+            kept.append(track)
+            same_rank.append(t)
+        tracks = kept
 
-    trk = ET.SubElement(gpx, 'trk')
-    trkseg = ET.SubElement(trk, 'trkseg')
+    return Track.concatenate(tracks).sorted_by_time()
 
-    for timestamp, lat, lon in merged_data:
-        trkpt = ET.SubElement(trkseg, 'trkpt', lat=str(lat), lon=str(lon))
-        time = ET.SubElement(trkpt, 'time')
-        time.text = timestamp
+def merge_data(pos_data, kml_data, tolerance_s=None):
+    """
+    Merge data from .pos and .kml tracks by timestamp.
+    Returns a single Track sorted by timestamp. With tolerance_s, KML points within that many
+    seconds of a .pos fix are dropped in favour of the (RTK) .pos solution.
+    Both tracks are already in memory, so this uses merge_tracks, the vectorized form of
+    iter_merge with the same result; merge_files streams files through iter_merge instead.
+    """
+    return merge_tracks([pos_data, kml_data], tolerance_s=tolerance_s)
+
+def iter_source(path):
+    """
+    Time-ordered points of one input file, chosen by extension (.pos, .kml or .gpx).
+    All three are streamed; .pos files are parsed a block of lines at a time (see iter_pos_blocks).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gpx':
+        return iter_trackpoints(path)
+    if extension == '.pos':
+        return itertools.chain.from_iterable(iter_pos_blocks(path))
+    if extension == '.kml':
+        return iter_kml_points(path)
+    raise ValueError(f"Unsupported input file: {path}")
 
-    tree = ET.ElementTree(gpx)
-    tree.write(output_file)
+def merge_files(input_files, output_file, tolerance_s=None, priority=None):
+    """
+    Merge any number of receiver logs into one GPX file, streaming the merged points to disk.
+    Returns the number of points written.
+    """
+    merged = iter_merge([iter_source(path) for path in input_files], tolerance_s=tolerance_s, priority=priority)
+    count = write_gpx(merged, output_file, creator="Merged GPX")
+    print(f"GPX file created: {output_file} ({count} points from {len(input_files)} files)")
+    return count
+
+def create_gpx(merged_data, output_file):
+    """
+    Create a .gpx file from the merged Track.
+    """
+    merged_data.to_gpx(output_file, creator="Merged GPX")
 
     print(f"GPX file created: {output_file}")
 
 # Main function to merge the .pos and .kml files and create a .gpx file
-def merge_pos_kml_to_gpx(pos_file, kml_file, output_file):
+def merge_pos_kml_to_gpx(pos_file, kml_file, output_file, tolerance_s=None):
     pos_data = parse_pos_file(pos_file)
     kml_data = parse_kml_file(kml_file)
-    merged_data = merge_data(pos_data, kml_data)
+    merged_data = merge_data(pos_data, kml_data, tolerance_s=tolerance_s)
     create_gpx(merged_data, output_file)
 
 # Example usage:
-pos_file = "/mnt/data/Dataset1 (1).pos"  # Replace with the actual .pos file path
-kml_file = "/mnt/data/Dataset1 (1).kml"  # Replace with the actual .kml file path
-output_file = "/mnt/data/merged_trajectory.gpx"  # Replace with the desired output .gpx file path
+if __name__ == "__main__":
+    pos_file = "/mnt/data/Dataset1 (1).pos"  # Replace with the actual .pos file path
+    kml_file = "/mnt/data/Dataset1 (1).kml"  # Replace with the actual .kml file path
+    output_file = "/mnt/data/merged_trajectory.gpx"  # Replace with the desired output .gpx file path
 
-# Merge .pos and .kml and create .gpx
-merge_pos_kml_to_gpx(pos_file, kml_file, output_file)
+    # Merge .pos and .kml and create .gpx
+    merge_pos_kml_to_gpx(pos_file, kml_file, output_file)
@@ -0,0 +1,329 @@
+"""
+Bulk loader for .pos position logs.
+
+Handles the layouts used in this project:
+    RTKLIB        % header lines, then "2024/01/15 08:30:00.000  lat  lon  height  Q  ns ..."
+                  or "week  tow  lat  lon  height ..." (GPST week / time of week)
+    CSV           "2024-01-01 00:00:00,lat,lon,elevation" with an optional header row
+    ISO columns   "2024-01-01T00:00:00.000 lat lon" (space separated)
+
+The delimiter, header/comment lines and time layout are detected from the file itself.
+Numeric columns are converted with NumPy in bulk and timestamps are parsed vectorized into
+epoch seconds (UTC), so no per-line Python work is done on the data rows.
+"""
+import itertools
+import mmap
+import re
+
+import numpy as np
+
+from gpxstream import parse_time
+from track import Track
+
+COMMENT_PREFIXES = (b'%', b'#', b'//')
+
+# Lines handed to NumPy at a time; bounds the temporary token arrays for very large logs
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+# Data lines per Track yielded by iter_pos_blocks
+DEFAULT_BLOCK_LINES = 64 * 1024
+
+# 1980-01-06T00:00:00 in Unix epoch seconds
+GPS_EPOCH = 315964800
+SECONDS_PER_WEEK = 604800
+
+# GPS - UTC offset (leap seconds), effective from each date
+LEAP_SECONDS = [
+    ('1981-07-01', 1), ('1982-07-01', 2), ('1983-07-01', 3), ('1985-07-01', 4), ('1988-01-01', 5),
+    ('1990-01-01', 6), ('1991-01-01', 7), ('1992-07-01', 8), ('1993-07-01', 9), ('1994-07-01', 10),
+    ('1996-01-01', 11), ('1997-07-01', 12), ('1999-01-01', 13), ('2006-01-01', 14), ('2009-01-01', 15),
+    ('2012-07-01', 16), ('2015-07-01', 17), ('2017-01-01', 18),
+]
+_LEAP_DATES = np.array([np.datetime64(d, 's').astype(np.int64) for d, _ in LEAP_SECONDS], dtype=np.float64)
+_LEAP_OFFSETS = np.array([0] + [s for _, s in LEAP_SECONDS], dtype=np.float64)
+
+_DATE = re.compile(rb'^\d{4}[-/]\d{2}[-/]\d{2}$')
+_ZONE_OFFSET = re.compile(rb'[-+]\d\d:?\d\d$')
+_NUMBER = re.compile(rb'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+
+
+def gpst_to_utc(epoch):
+    """
+    Convert epoch seconds on the GPS time scale to UTC by removing the leap-second offset.
+    """
+    epoch = np.asarray(epoch, dtype=np.float64)
+    return epoch - _LEAP_OFFSETS[np.searchsorted(_LEAP_DATES, epoch, side='right')]
+
+
+class PosLayout:
+    """
+    What load_pos detected about a file: where the data starts, the delimiter and the time columns.
+    """
+
+    def __init__(self, data_offset, delimiter, time_format, time_system, ncols):
+        self.data_offset = data_offset
+        self.delimiter = delimiter      # b',' or None (whitespace)
+        self.time_format = time_format  # 'iso', 'date_time', 'week_tow' or 'epoch'
+        self.time_system = time_system  # 'GPST' or 'UTC'
+        self.ncols = ncols
+
+    @property
+    def time_cols(self):
+        return 1 if self.time_format in ('iso', 'epoch') else 2
+
+    def __repr__(self):
+        return (f"PosLayout(delimiter={self.delimiter!r}, time_format={self.time_format!r}, "
+                f"time_system={self.time_system!r}, ncols={self.ncols})")
+
+
+def _split(line, delimiter):
+    if delimiter is None:
+        return line.split()
+    # "2024-01-01 00:00:00,lat,lon" -> date, time, lat, lon
+    return line.replace(delimiter, b' ').split()
+
+
+def detect_layout(buffer, time_system=None):
+    """
+    Inspect the header and first data line of a .pos buffer.
+    """
+    offset = 0
+    header = []
+    while offset < len(buffer):
+        end = buffer.find(b'\n', offset)
+        end = len(buffer) if end == -1 else end
+        line = bytes(buffer[offset:end]).strip()
+        stripped_at = offset
+        offset = end + 1
+
+        if not line:
+            continue
+        if line.startswith(COMMENT_PREFIXES):
+            header.append(line)
+            continue
+
+        delimiter = b',' if b',' in line else None
+        tokens = _split(line, delimiter)
+        first = tokens[0].rstrip(b'Z')
+        if b'T' in first and _DATE.match(first.split(b'T')[0]):
+            time_format = 'iso'
+        elif _DATE.match(first) and len(tokens) > 1 and b':' in tokens[1]:
+            time_format = 'date_time'
+        elif len(tokens) > 1 and _NUMBER.match(first) and _NUMBER.match(tokens[1]):
+            # "week tow lat lon ..." vs "epoch lat lon ...": a GPS week is a small integer
+            time_format = 'week_tow' if b'.' not in first and int(first) < 10000 else 'epoch'
+        else:
+            header.append(line)  # Column-name row such as "timestamp,latitude,longitude,elevation"
+            continue
+
+        if time_system is None:
+            header_text = b' '.join(header)
+            time_system = 'GPST' if b'GPST' in header_text or time_format == 'week_tow' else 'UTC'
+        return PosLayout(stripped_at, delimiter, time_format, time_system, len(tokens))
+
+    raise ValueError("No position records found")
+
+
+def _iso_stamps(columns, layout):
+    """
+    'YYYY-MM-DDTHH:MM:SS.fff' byte strings for the time columns of one chunk, assembled
+    byte-wise: date and time columns are joined with 'T', '/' becomes '-' and a trailing 'Z'
+    is dropped (NumPy ignores the NUL padding it leaves behind).
+    """
+    parts = columns if layout.time_format == 'date_time' else columns[:1]
+    n = len(parts[0])
+    raw = [np.ascontiguousarray(part).view(np.uint8).reshape(n, part.dtype.itemsize) for part in parts]
+    if len(raw) == 2:
+        # A date is always 10 characters; drop any padding so the 'T' follows it directly
+        raw[0] = raw[0][:, :10]
+    total = sum(r.shape[1] for r in raw) + len(raw) - 1
+
+    buf = np.zeros((n, total), dtype=np.uint8)
+    pos = 0
+    for i, r in enumerate(raw):
+        if i:
+            buf[:, pos] = ord('T')
+            pos += 1
+        buf[:, pos:pos + r.shape[1]] = r
+        pos += r.shape[1]
+
+    date = buf[:, :10]
+    date[date == ord('/')] = ord('-')
+    buf[buf == ord('Z')] = 0
+    return buf.view(f'S{total}').ravel()
+
+
+def _parse_times(columns, layout):
+    """
+    Epoch seconds (UTC) from the time columns of one chunk.
+    """
+    if layout.time_format == 'epoch':
+        epoch = columns[0].astype(np.float64)
+    elif layout.time_format == 'week_tow':
+        seconds = columns[0].astype(np.float64) * SECONDS_PER_WEEK + columns[1].astype(np.float64)
+        epoch = GPS_EPOCH + seconds
+    else:
+        stamps = _iso_stamps(columns, layout)
+        try:
+            if _ZONE_OFFSET.search(stamps[0]):
+                raise ValueError("zone offset")
+            ns = stamps.astype('datetime64[ns]').astype(np.int64)
+            epoch = ns / 1e9
+        except ValueError:
+            # Zone offsets and other forms NumPy cannot parse: fall back to the scalar parser
+            epoch = np.array([parse_time(s.decode()) for s in stamps], dtype=np.float64)
+
+    if layout.time_system == 'GPST':
+        epoch = gpst_to_utc(epoch)
+    return epoch
+
+
+def _needed_columns(layout):
+    """
+    Number of leading columns load_pos uses: time column(s), lat, lon and height.
+    """
+    return min(layout.ncols, layout.time_cols + 3)
+
+
+def _fixed_width_columns(chunk, layout):
+    """
+    Column arrays of a block whose lines all have the same length and aligned fields
+    (RTKLIB writes its solutions this way), sliced straight out of the raw bytes.
+    Returns None if the block is not laid out like that.
+    """
+    width = chunk.find(b'\n') + 1
+    if layout.delimiter is not None or width <= 0 or len(chunk) % width:
+        return None
+    rows = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, width)
+    if not (rows[:, -1] == ord('\n')).all():
+        return None
+
+    # Character positions that are blank (space, tab, CR, LF) on every line separate the fields
+    blank = (rows <= ord(' ')).all(axis=0)
+    edges = np.flatnonzero(np.diff(np.concatenate(([True], blank, [True])).astype(np.int8)))
+    spans = list(zip(edges[0::2], edges[1::2]))
+    if len(spans) != layout.ncols:
+        return None
+    return [np.ascontiguousarray(rows[:, a:b]).view(f'S{b - a}').ravel() for a, b in spans[:_needed_columns(layout)]]
+
+
+def _token_columns(chunk, layout):
+    """
+    Column arrays of a block of delimited lines, via one bytes.split() over the whole block.
+    """
+    if layout.delimiter is not None:
+        chunk = chunk.replace(layout.delimiter, b' ')
+    tokens = chunk.split()
+    if len(tokens) % layout.ncols:
+        raise ValueError(f"Ragged .pos data: expected {layout.ncols} columns on every line")
+    table = np.array(tokens, dtype=np.bytes_).reshape(-1, layout.ncols)
+    return [table[:, i] for i in range(_needed_columns(layout))]
+
+
+def _parse_chunk(chunk, layout):
+    """
+    Parse a block of complete data lines into (lat, lon, ele, time) arrays.
+    """
+    try:
+        columns = _fixed_width_columns(chunk, layout) or _token_columns(chunk, layout)
+        return _convert_columns(columns, layout)
+    except ValueError:
+        # Comment lines inside the data section: drop them and retry (slow path, rare)
+        lines = [line for line in chunk.split(b'\n') if not line.lstrip().startswith(COMMENT_PREFIXES)]
+        if len(lines) == chunk.count(b'\n') + 1:
+            raise
+        return _convert_columns(_token_columns(b'\n'.join(lines), layout), layout)
+
+
+def _convert_columns(columns, layout):
+    tc = layout.time_cols
+    times = _parse_times(columns[:tc], layout)
+    lat = columns[tc].astype(np.float64)
+    lon = columns[tc + 1].astype(np.float64)
+    if len(columns) > tc + 2:
+        ele = columns[tc + 2].astype(np.float64)
+    else:
+        ele = np.full(len(lat), np.nan)
+    return lat, lon, ele, times
+
+
+def _iter_chunks(buffer, start, chunk_bytes):
+    """
+    Slices of buffer[start:] of about chunk_bytes, each ending at a line boundary.
+    """
+    n = len(buffer)
+    while start < n:
+        end = min(start + chunk_bytes, n)
+        if end < n:
+            newline = buffer.find(b'\n', end)
+            end = n if newline == -1 else newline + 1
+        yield bytes(buffer[start:end])
+        start = end
+
+
+def parse_pos_lines(data, layout):
+    """
+    Track of a block of complete data lines (bytes ending in a newline) laid out as layout
+    (see detect_layout), e.g. records of a live stream arriving a few at a time.
+    """
+    if not data.strip():
+        return Track.empty()
+    return Track(*_parse_chunk(data, layout))
+
+
+def load_pos(pos_file, use_mmap=False, chunk_bytes=DEFAULT_CHUNK_BYTES, time_system=None):
+    """
+    Load a .pos file into a Track.
+
+    use_mmap     map the file instead of reading it, so only the chunk being parsed is resident
+    chunk_bytes  size of the blocks handed to NumPy
+    time_system  'GPST' or 'UTC'; by default GPST is assumed when the header says so (RTKLIB)
+                 or the times are GPS week / time of week, and converted to UTC
+    """
+    with open(pos_file, 'rb') as f:
+        if use_mmap:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                buffer = b''
+        else:
+            buffer = f.read()
+
+    try:
+        layout = detect_layout(buffer, time_system)
+        parts = [_parse_chunk(chunk, layout) for chunk in _iter_chunks(buffer, layout.data_offset, chunk_bytes)]
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+
+    if not parts:
+        return Track.empty()
+    lat, lon, ele, times = (np.concatenate(column) for column in zip(*parts))
+    return Track(lat, lon, ele, times)
+
+
+def iter_pos_blocks(pos_file, block_lines=DEFAULT_BLOCK_LINES, time_system=None):
+    """
+    Tracks of successive blocks of at most block_lines records of a .pos file, in file order.
+    Only the header and one block are held at a time, so memory does not grow with the file.
+    """
+    with open(pos_file, 'rb') as f:
+        head = b''
+        for line in f:
+            head += line
+            try:
+                layout = detect_layout(head, time_system)
+            except ValueError:  # Only header lines so far
+                continue
+            break
+        else:
+            layout = detect_layout(head, time_system)  # Raises: no position records
+
+        block = head[layout.data_offset:]  # The first record
+        while True:
+            block += b''.join(itertools.islice(f, block_lines - 1 if block else block_lines))
+            if not block:
+                return
+            if not block.endswith(b'\n'):
+                block += b'\n'  # Last line of a file without a trailing newline
+            yield parse_pos_lines(block, layout)
+            block = b''
@@ -1,100 +1,192 @@
-// This file will handle the preprocessing steps: speed calculation, outlier removal, and interpolation.
+# This file will handle the preprocessing steps: speed calculation, outlier removal, and interpolation.
 
-import xml.etree.ElementTree as ET
-from geopy.distance import geodesic
+from itertools import islice
 
-def remove_outliers(gpx_file, threshold_km=0.1):
-    """
-    Remove outliers by calculating the distance between consecutive points. If the distance
-    between points exceeds the threshold, it's considered an outlier.
-    """
-    tree = ET.parse(gpx_file)
-    root = tree.getroot()
+import numpy as np
 
-    valid_trkpts = []
-    prev_point = None
+from geodistance import interpolate_positions, outlier_mask
+from gpxstream import iter_trackpoints, write_gpx
+from track import Track
+from trackio import read_track, write_track
+
+# Points handed to the vectorized distance kernel at a time by the streaming stages
+CHUNK_SIZE = 65536
 
-    for trkpt in root.findall(".//trkpt"):
-        lat = float(trkpt.attrib['lat'])
-        lon = float(trkpt.attrib['lon'])
-        timestamp = trkpt.find("time").text
 
-        if prev_point:
-            distance = geodesic((prev_point['lat'], prev_point['lon']), (lat, lon)).km
-            if distance <= threshold_km:
-                valid_trkpts.append(trkpt)
-        else:
-            valid_trkpts.append(trkpt)
+def iter_chunks(points, size=CHUNK_SIZE):
+    """
+    Group an iterable of points into lists of at most `size` points.
+    """
+    points = iter(points)
+    while True:
+        chunk = list(islice(points, size))
+        if not chunk:
+            return
+        yield chunk
 
-        prev_point = {'lat': lat, 'lon': lon, 'timestamp': timestamp}
-    
-    # Remove all trkpt elements and re-add valid ones
-    trkseg = root.find(".//trkseg")
-    for trkpt in trkseg.findall("trkpt"):
-        trkseg.remove(trkpt)
 
-    for trkpt in valid_trkpts:
-        trkseg.append(trkpt)
+def iter_remove_outliers(points, threshold_km=0.1, method='haversine', chunk_size=CHUNK_SIZE):
+    """
+    Streaming outlier removal over (lat, lon, ele, time) points.
+    Points are filtered chunk by chunk with the vectorized kernel; only the last raw point
+    is carried over between chunks, so memory is bounded by chunk_size.
+    """
+    prev_point = None
+    for chunk in iter_chunks(points, chunk_size):
+        window = chunk if prev_point is None else [prev_point] + chunk
+        lat = np.fromiter((p[0] for p in window), dtype=np.float64, count=len(window))
+        lon = np.fromiter((p[1] for p in window), dtype=np.float64, count=len(window))
+        keep = outlier_mask(lat, lon, threshold_km=threshold_km, method=method)
+        if prev_point is not None:
+            keep = keep[1:]
 
-    # Save the cleaned gpx file
-    tree.write("cleaned_" + gpx_file)
-    print(f"Outliers removed and saved as cleaned_{gpx_file}")
+        for point, ok in zip(chunk, keep):
+            if ok:
+                yield point
+        prev_point = chunk[-1]
 
 
-def interpolate_gpx(gpx_file):
+def filter_outliers(track, threshold_km=0.1, method='haversine'):
     """
-    Interpolate missing points in the GPX file to fill gaps between valid points.
+    Drop outliers from a Track in one vectorized pass and return the cleaned Track.
     """
-    tree = ET.parse(gpx_file)
-    root = tree.getroot()
-    trkseg = root.find(".//trkseg")
+    return track.select(outlier_mask(track.lat, track.lon, threshold_km=threshold_km, method=method))
 
-    points = []
-    for trkpt in trkseg.findall("trkpt"):
-        lat = float(trkpt.attrib['lat'])
-        lon = float(trkpt.attrib['lon'])
-        timestamp = trkpt.find("time").text
-        points.append((lat, lon, timestamp))
 
-    # Interpolate between points if there are gaps
-    interpolated_points = []
-    for i in range(1, len(points)):
-        point1 = points[i-1]
-        point2 = points[i]
+def remove_outliers(gpx_file, threshold_km=0.1, method='haversine'):
+    """
+    Remove outliers by calculating the distance between consecutive points. If the distance
+    between points exceeds the threshold, it's considered an outlier.
+    Distances are computed with the vectorized kernel (see geodistance.outlier_mask);
+    use method='ellipsoidal' to reproduce geopy's WGS-84 geodesic decisions at the threshold.
+    The file is streamed in and out, so memory use does not depend on its size.
+    """
+    points = iter_trackpoints(gpx_file)
+    count = write_gpx(iter_remove_outliers(points, threshold_km, method), "cleaned_" + gpx_file)
+    print(f"Outliers removed and saved as cleaned_{gpx_file} ({count} points kept)")
 
-        interpolated_points.append(point1)
 
-        # Linear interpolation between lat, lon and timestamp
-        lat1, lon1, time1 = point1
-        lat2, lon2, time2 = point2
+def interpolate_track(track, interval_s=1.0, max_gap_s=30.0, mode='linear', downsample=True):
+    """
+    Interpolate a time-ordered Track from its timestamps, resampling it towards one point
+    every interval_s seconds. Fully vectorized over the track.
 
-        # You can add logic for interpolating time here if necessary
+    - Dense stretches are thinned (downsample=True): only the first point of every
+      interval_s time slot (aligned to the epoch) is kept.
+    - Gaps of 1.5 interval_s or more but no longer than max_gap_s are filled with
+      round(gap / interval_s) - 1 evenly spaced points, interpolated in time, position
+      (mode='linear' or 'great_circle') and elevation. Receiver jitter around interval_s adds nothing.
+      Longer gaps are treated as breaks in the recording and left alone (max_gap_s=None fills all).
 
-        interpolated_points.append((lat2, lon2, time2))
+    Tracks without complete timestamps are returned unchanged.
+    """
+    time = np.asarray(track.time, dtype=np.float64)
+    if len(track) < 2 or not np.all(np.isfinite(time)):
+        return track
+
+    # Step 1: Downsample, keeping the first point of each time slot
+    if downsample:
+        slots = np.floor(time / interval_s)
+        keep = np.ones(len(track), dtype=bool)
+        keep[1:] = slots[1:] != slots[:-1]
+        if not keep.all():
+            track = track.select(keep)
+            time = track.time
+
+    # Step 2: Work out how many points go into each gap
+    dt = np.diff(time)
+    # Rounded, so receiver jitter (a 1.001 s step at 1 Hz) adds nothing; a gap gets a point
+    # once it is at least 1.5 intervals long
+    counts = np.maximum(np.round(dt / interval_s).astype(np.int64) - 1, 0)
+    if max_gap_s is not None:
+        counts[dt > max_gap_s] = 0
+    total = int(counts.sum())
+    if total == 0:
+        return track
+
+    # Gap index and position (1..k) of every new point within its gap
+    gap = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    step = np.arange(total) - np.repeat(starts, counts) + 1
+    fraction = step / (counts[gap] + 1)
+
+    new_lat, new_lon = interpolate_positions(track.lat[gap], track.lon[gap],
+                                             track.lat[gap + 1], track.lon[gap + 1], fraction, mode=mode)
+    new_ele = track.ele[gap] + fraction * (track.ele[gap + 1] - track.ele[gap])
+    new_time = time[gap] + fraction * dt[gap]
+
+    # Step 3: Interleave original and new points
+    n = len(track) + total
+    original_pos = np.arange(len(track)) + np.concatenate(([0], np.cumsum(counts)))
+    is_new = np.ones(n, dtype=bool)
+    is_new[original_pos] = False
+
+    columns = []
+    for old, new in ((track.lat, new_lat), (track.lon, new_lon), (track.ele, new_ele), (time, new_time)):
+        column = np.empty(n, dtype=np.float64)
+        column[original_pos] = old
+        column[is_new] = new
+        columns.append(column)
+    return Track(*columns)
+
+
+def iter_interpolate(points, interval_s=1.0, max_gap_s=30.0, mode='linear', downsample=True,
+                     chunk_size=CHUNK_SIZE):
+    """
+    Streaming version of interpolate_track over (lat, lon, ele, time) points.
+    The last emitted point is carried into the next chunk, so time slots and gaps that
+    straddle a chunk boundary are handled exactly as in the whole-track version.
+    """
+    carry = None
+    for chunk in iter_chunks(points, chunk_size):
+        window = Track.from_points(chunk if carry is None else [carry] + chunk)
+        resampled = interpolate_track(window, interval_s, max_gap_s, mode, downsample)
+        out = iter(resampled)
+        if carry is not None:
+            next(out)  # The carried point was already emitted with the previous chunk
+        for point in out:
+            yield point
+            carry = point
+
+
+def interpolate_gpx(gpx_file, interval_s=1.0, max_gap_s=30.0, mode='linear', downsample=True):
+    """
+    Interpolate missing points in the GPX file to fill gaps between valid points,
+    resampling the track to roughly one point every interval_s seconds.
+    """
+    points = iter_interpolate(iter_trackpoints(gpx_file), interval_s, max_gap_s, mode, downsample)
+    count = write_gpx(points, "interpolated_" + gpx_file)
+    print(f"Interpolation completed. Saved as interpolated_{gpx_file} ({count} points)")
 
-    # Rebuild the GPX file with interpolated points
-    trkseg.clear()
-    for lat, lon, timestamp in interpolated_points:
-        trkpt = ET.SubElement(trkseg, "trkpt", lat=str(lat), lon=str(lon))
-        time = ET.SubElement(trkpt, "time")
-        time.text = timestamp
 
-    # Save the interpolated GPX file
-    tree.write("interpolated_" + gpx_file)
-    print(f"Interpolation completed. Saved as interpolated_{gpx_file}")
+def preprocess_track(track, threshold_km=0.1, interval_s=1.0, max_gap_s=30.0, mode='linear'):
+    """
+    Outlier removal followed by interpolation, entirely in memory.
+    Returns (cleaned, interpolated) Tracks.
+    """
+    cleaned = filter_outliers(track, threshold_km=threshold_km)
+    return cleaned, interpolate_track(cleaned, interval_s=interval_s, max_gap_s=max_gap_s, mode=mode)
 
 
 def process_gpx_file(input_gpx_file):
     """
     Complete preprocessing workflow: outlier removal and interpolation.
+    The input is parsed once; both stages run on the in-memory Track.
+    .npy and .gpx.gz inputs work too, and the outputs are written in the same format.
     """
-    # Step 1: Remove outliers
-    remove_outliers(input_gpx_file)
+    track = read_track(input_gpx_file)
+
+    # Step 1 and 2: Remove outliers, then interpolate missing points
+    cleaned, interpolated = preprocess_track(track)
+    write_track(cleaned, "cleaned_" + input_gpx_file)
+    print(f"Outliers removed and saved as cleaned_{input_gpx_file} ({len(cleaned)} points kept)")
 
-    # Step 2: Interpolate missing points
-    interpolate_gpx("cleaned_" + input_gpx_file)
+    write_track(interpolated, "interpolated_cleaned_" + input_gpx_file)
+    print(f"Interpolation completed. Saved as interpolated_cleaned_{input_gpx_file} ({len(interpolated)} points)")
+    return interpolated
 
 
 # Example usage
-input_gpx_file = "merged_trajectory.gpx"  # Path to the merged GPX file
-process_gpx_file(input_gpx_file)
+if __name__ == "__main__":
+    input_gpx_file = "merged_trajectory.gpx"  # Path to the merged GPX file
+    process_gpx_file(input_gpx_file)
@@ -0,0 +1,405 @@
+"""
+Offline road-proximity checks for snapped tracks.
+
+A RoadIndex holds the segments of a local road network extract (GeoJSON lines or an OSM XML
+file) in a uniform grid and answers "how far is each point from the nearest road" for whole
+arrays of points at once, with no per-point Python work:
+
+- Road segments are cut into pieces no longer than half a grid cell and each piece is filed
+  under the cell of its midpoint (a CSR layout: pieces sorted by cell key).
+- A batch of points looks up its own cell and the eight around it with searchsorted, expands
+  the candidate (point, piece) pairs with np.repeat and computes all point-to-segment
+  distances in one vectorized pass, in a local equirectangular projection.
+
+Distances are exact up to max_distance_m; points with no road that close get inf.
+"""
+import functools
+import json
+import math
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from gpxstream import _local_name
+
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 6371008.8 * math.pi / 180
+
+DEFAULT_MAX_DISTANCE_M = 30.0
+# Snapped points farther than this from every road count as off-road
+DEFAULT_OFF_ROAD_M = 20.0
+# Points per vectorized query; bounds the temporary candidate-pair arrays
+DEFAULT_BATCH_POINTS = 262144
+
+_CELL_OFFSET = 1 << 31
+
+
+def _cell_keys(i, j):
+    return ((i + _CELL_OFFSET) << 32) | (j + _CELL_OFFSET)
+
+
+def _squared_distance_deg(lat, lon, scale, lat1, lon1, dlat, dlon, with_fraction=False):
+    """
+    Squared distance (in degrees of latitude) from points to segments, element-wise, in an
+    equirectangular projection centred on each point; scale is cos(lat) of the point.
+    Segments start at (lat1, lon1) and have a non-zero extent (dlat, dlon).
+    with_fraction=True also returns where along each segment (0..1) the nearest point lies.
+    """
+    ax = lon1 - lon
+    ax *= scale
+    ay = lat1 - lat
+    vx = dlon * scale
+    t = ax * vx
+    t += ay * dlat
+    vv = vx * vx
+    vv += dlat * dlat
+    t /= vv
+    np.negative(t, out=t)
+    np.clip(t, 0.0, 1.0, out=t)
+    fraction = t.copy() if with_fraction else None
+    vx *= t
+    ax += vx
+    t *= dlat
+    ay += t
+    ax *= ax
+    ay *= ay
+    ax += ay
+    return (ax, fraction) if with_fraction else ax
+
+
+def point_segment_distance_m(lat, lon, lat1, lon1, lat2, lon2):
+    """
+    Distance in meters from points to segments (element-wise, NumPy-broadcast).
+    """
+    arrays = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (lat, lon, lat1, lon1, lat2, lon2)))
+    shape = arrays[0].shape
+    lat, lon, lat1, lon1, lat2, lon2 = (a.ravel() for a in arrays)
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    # A zero-length segment is its start point; any non-zero direction gives the same distance
+    dlat[(dlat == 0) & (dlon == 0)] = 1e-12
+    d2 = _squared_distance_deg(lat, lon, np.cos(np.radians(lat)), lat1, lon1, dlat, dlon)
+    return (np.sqrt(d2) * METERS_PER_DEGREE).reshape(shape)
+
+
+def segment_lengths_m(segments):
+    """
+    Lengths in meters of (lat1, lon1, lat2, lon2) segments.
+    """
+    lat1, lon1, lat2, lon2 = segments.T
+    mid_lat = np.radians((lat1 + lat2) / 2)
+    return np.hypot((lat2 - lat1) * METERS_PER_DEGREE, (lon2 - lon1) * METERS_PER_DEGREE * np.cos(mid_lat))
+
+
+def _subdivide(segments, max_length_m):
+    """
+    Cut (lat1, lon1, lat2, lon2) segments into pieces no longer than max_length_m.
+    Returns the pieces, the segment each piece belongs to, and where along that segment
+    (as fractions of its length) each piece starts and how much of it it spans.
+    """
+    lat1, lon1, lat2, lon2 = segments.T
+    pieces = np.maximum(np.ceil(segment_lengths_m(segments) / max_length_m).astype(np.int64), 1)
+    seg = np.repeat(np.arange(len(segments)), pieces)
+    starts = np.cumsum(pieces) - pieces
+    k = np.arange(len(seg)) - np.repeat(starts, pieces)
+    f1 = k / pieces[seg]
+    f2 = (k + 1) / pieces[seg]
+    dlat = (lat2 - lat1)[seg]
+    dlon = (lon2 - lon1)[seg]
+    split = np.column_stack((lat1[seg] + f1 * dlat, lon1[seg] + f1 * dlon,
+                             lat1[seg] + f2 * dlat, lon1[seg] + f2 * dlon))
+    return split, seg, f1, f2 - f1
+
+
+def polyline_segments(latlon):
+    """
+    Consecutive vertex pairs of an (k, 2) lat/lon polyline as (lat1, lon1, lat2, lon2) rows.
+    """
+    return np.column_stack((latlon[:-1], latlon[1:]))
+
+
+def _iter_geojson_lines(geometry):
+    if geometry is None:
+        return
+    kind = geometry.get('type')
+    if kind == 'LineString':
+        yield geometry['coordinates']
+    elif kind in ('MultiLineString', 'Polygon'):
+        yield from geometry['coordinates']
+    elif kind == 'MultiPolygon':
+        for polygon in geometry['coordinates']:
+            yield from polygon
+    elif kind == 'GeometryCollection':
+        for part in geometry['geometries']:
+            yield from _iter_geojson_lines(part)
+
+
+def read_geojson_polylines(geojson_file):
+    """
+    Road polylines of a GeoJSON file (FeatureCollection, Feature or bare geometry) as (k, 2)
+    lat/lon arrays.
+    """
+    with open(geojson_file, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('type') == 'FeatureCollection':
+        geometries = [feature.get('geometry') for feature in data['features']]
+    elif data.get('type') == 'Feature':
+        geometries = [data.get('geometry')]
+    else:
+        geometries = [data]
+    polylines = []
+    for geometry in geometries:
+        for line in _iter_geojson_lines(geometry):
+            coords = np.asarray(line, dtype=np.float64)
+            if coords.ndim == 2 and len(coords) > 1:
+                polylines.append(coords[:, [1, 0]])
+    return polylines
+
+
+def read_osm_polylines(osm_file):
+    """
+    Polylines of every way with a highway tag in an OSM XML extract, streamed with iterparse.
+    """
+    nodes = {}
+    polylines = []
+    root = None
+    for event, elem in ET.iterparse(osm_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+
+        name = _local_name(elem.tag)
+        if name == 'node':
+            nodes[elem.attrib['id']] = (float(elem.attrib['lat']), float(elem.attrib['lon']))
+        elif name == 'way':
+            if any(tag.attrib.get('k') == 'highway' for tag in elem.iter('tag')):
+                refs = [nodes[nd.attrib['ref']] for nd in elem.iter('nd') if nd.attrib['ref'] in nodes]
+                if len(refs) > 1:
+                    polylines.append(np.asarray(refs, dtype=np.float64))
+        else:
+            continue
+        # Finished nodes and ways are not needed as elements any more
+        root.clear()
+    return polylines
+
+
+def read_polylines(path):
+    """
+    Road polylines of a GeoJSON (.geojson/.json) or OSM XML (.osm) road network extract.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.geojson', '.json'):
+        return read_geojson_polylines(path)
+    if extension == '.osm':
+        return read_osm_polylines(path)
+    raise ValueError(f"Unsupported road network file: {path}")
+
+
+def read_segments(path):
+    """
+    All road segments of a network extract as (lat1, lon1, lat2, lon2) rows.
+    """
+    parts = [polyline_segments(line) for line in read_polylines(path)]
+    return np.concatenate(parts) if parts else np.empty((0, 4))
+
+
+class RoadIndex:
+    """
+    Grid index over road segments for vectorized nearest-road distance queries.
+
+    segments        (m, 4) array of (lat1, lon1, lat2, lon2) rows
+    max_distance_m  distances up to this are exact; anything farther is reported as inf
+    """
+
+    def __init__(self, segments, max_distance_m=DEFAULT_MAX_DISTANCE_M):
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        self.max_distance_m = max_distance_m
+        self.segment_count = len(segments)
+
+        # A 3 x 3 block of cells reaches at least one cell size past the point's own cell; pieces
+        # of half a cell then guarantee every piece within 3/4 of a cell is among the candidates
+        cell_m = max_distance_m * 4 / 3
+        lat_extent = np.abs(segments[:, [0, 2]]).max() if len(segments) else 0.0
+        self.cell_lat = cell_m / METERS_PER_DEGREE
+        self.cell_lon = cell_m / (METERS_PER_DEGREE * max(math.cos(math.radians(min(lat_extent, 89.0))), 1e-6))
+
+        # Zero-length segments (repeated vertices) add nothing their neighbours do not cover
+        kept = np.flatnonzero((segments[:, 0] != segments[:, 2]) | (segments[:, 1] != segments[:, 3]))
+        pieces, seg, start, span = _subdivide(segments[kept], cell_m / 2)
+        keys = self._keys((pieces[:, 0] + pieces[:, 2]) / 2, (pieces[:, 1] + pieces[:, 3]) / 2)
+        order = np.argsort(keys, kind='stable')
+        pieces = pieces[order]
+        # Rows: start lat, start lon, lat extent, lon extent
+        self.pieces = np.ascontiguousarray(np.column_stack((pieces[:, :2], pieces[:, 2:] - pieces[:, :2])).T)
+        # Segment (row of segments) each piece was cut from, and the piece's place along it
+        self.piece_segment = kept[seg[order]]
+        self.piece_start = start[order]
+        self.piece_span = span[order]
+        self.cell_keys, cell_start = np.unique(keys[order], return_index=True)
+        # Pieces of cell_keys[k] are pieces[:, cell_bounds[k]:cell_bounds[k + 1]]
+        self.cell_bounds = np.append(cell_start, len(keys))
+
+    def __len__(self):
+        return self.pieces.shape[1]
+
+    def __repr__(self):
+        return (f"RoadIndex({self.segment_count} segments, {len(self)} pieces in {len(self.cell_keys)} cells, "
+                f"max_distance_m={self.max_distance_m})")
+
+    @classmethod
+    def from_file(cls, path, max_distance_m=DEFAULT_MAX_DISTANCE_M):
+        """
+        Build an index from a GeoJSON (.geojson/.json) or OSM XML (.osm) road network extract.
+        """
+        return cls(read_segments(path), max_distance_m)
+
+    def _cells(self, lat, lon):
+        return (np.floor(lat / self.cell_lat).astype(np.int64),
+                np.floor(lon / self.cell_lon).astype(np.int64))
+
+    def _keys(self, lat, lon):
+        return _cell_keys(*self._cells(lat, lon))
+
+    def _iter_candidates(self, lat, lon, with_fraction=False):
+        """
+        Candidate (point, piece) pairs of a batch of points sorted by cell, one block per row of
+        neighbouring cells. Cells (i + di, j - 1 .. j + 1) have consecutive keys, so their pieces
+        are one contiguous run of the sorted piece table.
+        Yields (hit, counts, first, piece, squared distance, fraction): the points with any
+        candidates, how many each has and where its run starts in the block.
+        """
+        ci, cj = self._cells(lat, lon)
+        scale = np.cos(np.radians(lat))
+        for di in (-1, 0, 1):
+            keys = _cell_keys(ci + di, cj)
+            lo = np.searchsorted(self.cell_keys, keys - 1, side='left')
+            hi = np.searchsorted(self.cell_keys, keys + 1, side='right')
+            start = self.cell_bounds[lo]
+            counts = self.cell_bounds[hi] - start
+            hit = counts > 0
+            if not hit.any():
+                continue
+
+            counts = counts[hit]
+            first = np.cumsum(counts) - counts
+            piece = np.repeat(start[hit] - first, counts) + np.arange(first[-1] + counts[-1])
+
+            lat1, lon1, dlat, dlon = self.pieces[:, piece]
+            result = _squared_distance_deg(np.repeat(lat[hit], counts), np.repeat(lon[hit], counts),
+                                           np.repeat(scale[hit], counts), lat1, lon1, dlat, dlon, with_fraction)
+            d2, fraction = result if with_fraction else (result, None)
+            yield hit, counts, first, piece, d2, fraction
+
+    def _sorted_batch(self, lat, lon):
+        order = np.argsort(self._keys(lat, lon), kind='stable')
+        return order, lat[order], lon[order]
+
+    def _query(self, lat, lon):
+        """
+        Nearest-road distances of one batch of points, sorted by cell so the lookups walk
+        the cell table in order.
+        """
+        order, lat, lon = self._sorted_batch(lat, lon)
+        best = np.full(len(lat), np.inf)
+        for hit, _, first, _, d2, _ in self._iter_candidates(lat, lon):
+            # Candidates are grouped by point, so the minimum per point is one reduceat
+            best[hit] = np.minimum(best[hit], np.minimum.reduceat(d2, first))
+
+        best = np.sqrt(best) * METERS_PER_DEGREE
+        best[best > self.max_distance_m] = np.inf
+        result = np.empty_like(best)
+        result[order] = best
+        return result
+
+    def nearest_segments(self, lat, lon, k=5, radius_m=None):
+        """
+        Up to k nearest segments of every point within radius_m (default: max_distance_m).
+        Returns flat arrays (point, segment, distance_m, fraction) ordered by point and then
+        distance; fraction is where along the segment (0..1) the nearest position lies.
+        """
+        radius_m = self.max_distance_m if radius_m is None else radius_m
+        if radius_m > self.max_distance_m:
+            raise ValueError("radius_m cannot exceed the index's max_distance_m")
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        order, lat, lon = self._sorted_batch(lat[valid], lon[valid])
+        points = valid[order]
+
+        parts = []
+        for hit, counts, _, piece, d2, fraction in self._iter_candidates(lat, lon, with_fraction=True):
+            distance = np.sqrt(d2) * METERS_PER_DEGREE
+            near = distance <= radius_m
+            parts.append((np.repeat(points[hit], counts)[near], self.piece_segment[piece[near]], distance[near],
+                          self.piece_start[piece[near]] + fraction[near] * self.piece_span[piece[near]]))
+        if not parts:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty.astype(np.int64), empty, empty
+        point, segment, distance, fraction = (np.concatenate(column) for column in zip(*parts))
+
+        # Best piece per (point, segment), then the k closest segments per point
+        by_pair = np.lexsort((distance, segment, point))
+        point, segment, distance, fraction = point[by_pair], segment[by_pair], distance[by_pair], fraction[by_pair]
+        first = np.ones(len(point), dtype=bool)
+        first[1:] = (point[1:] != point[:-1]) | (segment[1:] != segment[:-1])
+        point, segment, distance, fraction = point[first], segment[first], distance[first], fraction[first]
+
+        by_distance = np.lexsort((distance, point))
+        point, segment, distance, fraction = (point[by_distance], segment[by_distance], distance[by_distance],
+                                              fraction[by_distance])
+        group_start = np.flatnonzero(np.r_[True, point[1:] != point[:-1]])
+        rank = np.arange(len(point)) - np.repeat(group_start, np.diff(np.r_[group_start, len(point)]))
+        keep = rank < k
+        return point[keep], segment[keep], distance[keep], fraction[keep]
+
+    def distances_m(self, lat, lon, batch_points=DEFAULT_BATCH_POINTS):
+        """
+        Distance in meters from each point to the nearest road segment (inf beyond max_distance_m).
+        Points without a position (NaN) get inf.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        result = np.full(len(lat), np.inf)
+        if not len(self.cell_keys):
+            return result
+        valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        for start in range(0, len(valid), batch_points):
+            idx = valid[start:start + batch_points]
+            result[idx] = self._query(lat[idx], lon[idx])
+        return result
+
+    def off_road_mask(self, lat, lon, threshold_m=DEFAULT_OFF_ROAD_M):
+        """
+        True for points farther than threshold_m from every road.
+        """
+        if threshold_m > self.max_distance_m:
+            raise ValueError("threshold_m cannot exceed the index's max_distance_m")
+        return self.distances_m(lat, lon) > threshold_m
+
+    def proximity_report(self, track, threshold_m=DEFAULT_OFF_ROAD_M):
+        """
+        Road-proximity summary of a Track: point count, off-road count and fraction, and the
+        median / 95th percentile distance of the points within max_distance_m of a road.
+        """
+        if threshold_m > self.max_distance_m:
+            raise ValueError("threshold_m cannot exceed the index's max_distance_m")
+        d = self.distances_m(track.lat, track.lon)
+        near = d[np.isfinite(d)]
+        off_road = int((d > threshold_m).sum())
+        return {
+            'points': len(d),
+            'off_road': off_road,
+            'off_road_fraction': off_road / len(d) if len(d) else 0.0,
+            'distance_p50_m': float(np.percentile(near, 50)) if near.size else math.inf,
+            'distance_p95_m': float(np.percentile(near, 95)) if near.size else math.inf,
+        }
+
+
+@functools.lru_cache(maxsize=4)
+def load_road_index(path, max_distance_m=DEFAULT_MAX_DISTANCE_M):
+    """
+    RoadIndex.from_file, built once per process and path (worker processes reuse their copy).
+    """
+    return RoadIndex.from_file(path, max_distance_m)
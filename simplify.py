@@ -0,0 +1,129 @@
+"""
+Vectorized polyline simplification for rendering long or high-rate tracks.
+
+    rdp_mask          Ramer-Douglas-Peucker: keeps the points needed so that no dropped point is
+                      farther than tolerance_m from the simplified line
+    visvalingam_mask  Visvalingam-Whyatt: drops points whose triangle with their neighbours has an
+                      area below min_area_m2, smallest first
+
+Both work on a local equirectangular projection in meters and process all pending pieces of a
+track in one NumPy pass per round instead of one Python call per point: RDP splits every range
+whose farthest point is out of tolerance at once; Visvalingam removes every point whose area is
+below the threshold and smaller than both neighbours' at once (a round-based variant of the
+sequential heap algorithm, so results can differ slightly where areas are close).
+"""
+import numpy as np
+
+from road_index import METERS_PER_DEGREE
+
+SIMPLIFY_METHODS = ('rdp', 'visvalingam')
+
+
+def _project_m(lat, lon):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    scale = np.cos(np.radians(np.mean(lat))) if len(lat) else 1.0
+    return lon * METERS_PER_DEGREE * scale, lat * METERS_PER_DEGREE
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    """
+    Distance from points p to segments a-b (all arrays of the same shape), in projected units.
+    """
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip(((px - ax) * dx + (py - ay) * dy) / length2, 0.0, 1.0)
+    t = np.where(length2 > 0, t, 0.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def rdp_mask(lat, lon, tolerance_m):
+    """
+    Boolean mask of the points Ramer-Douglas-Peucker keeps at tolerance_m. The end points are
+    always kept.
+    """
+    n = len(lat)
+    keep = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+    x, y = _project_m(lat, lon)
+
+    starts = np.array([0])
+    ends = np.array([n - 1])
+    while len(starts):
+        interior = ends - starts - 1
+        pending = interior > 0
+        starts, ends, interior = starts[pending], ends[pending], interior[pending]
+        if not len(starts):
+            break
+
+        # Interior point indices of every pending range, flattened, with the range each belongs to
+        first = np.cumsum(interior) - interior
+        piece = np.repeat(np.arange(len(starts)), interior)
+        index = np.repeat(starts + 1 - first, interior) + np.arange(interior.sum())
+        a, b = starts[piece], ends[piece]
+        distance = _segment_distance(x[index], y[index], x[a], y[a], x[b], y[b])
+
+        farthest = np.maximum.reduceat(distance, first)
+        split = farthest > tolerance_m
+        # Position of the (first) farthest point of each range
+        at_max = np.flatnonzero(distance == farthest[piece])
+        _, first_max = np.unique(piece[at_max], return_index=True)
+        split_index = index[at_max[first_max]][split]
+
+        keep[split_index] = True
+        starts = np.concatenate((starts[split], split_index))
+        ends = np.concatenate((split_index, ends[split]))
+    return keep
+
+
+def visvalingam_mask(lat, lon, min_area_m2):
+    """
+    Boolean mask of the points Visvalingam-Whyatt keeps with effective areas of at least
+    min_area_m2. The end points are always kept.
+    """
+    n = len(lat)
+    keep = np.ones(n, dtype=bool)
+    if n <= 2:
+        return keep
+    x, y = _project_m(lat, lon)
+
+    while True:
+        index = np.flatnonzero(keep)
+        if len(index) <= 2:
+            break
+        left, middle, right = index[:-2], index[1:-1], index[2:]
+        area = 0.5 * np.abs((x[middle] - x[left]) * (y[right] - y[left])
+                            - (x[right] - x[left]) * (y[middle] - y[left]))
+        small = area < min_area_m2
+        if not small.any():
+            break
+        # Only local minima go in one round, so no two neighbours are removed together
+        padded = np.concatenate(([np.inf], area, [np.inf]))
+        remove = small & (area <= padded[:-2]) & (area < padded[2:])
+        keep[middle[remove]] = False
+    return keep
+
+
+def simplify_mask(lat, lon, tolerance_m, method='rdp'):
+    """
+    Mask of the points kept by method at tolerance_m. For Visvalingam the area threshold is
+    tolerance_m squared.
+    """
+    if method == 'rdp':
+        return rdp_mask(lat, lon, tolerance_m)
+    if method == 'visvalingam':
+        return visvalingam_mask(lat, lon, tolerance_m ** 2)
+    raise ValueError(f"method must be one of {SIMPLIFY_METHODS}")
+
+
+def simplify_track(track, tolerance_m, method='rdp'):
+    """
+    New Track with only the points method keeps at tolerance_m.
+    """
+    if not len(track):
+        return track
+    return track.select(simplify_mask(track.lat, track.lon, tolerance_m, method))
@@ -0,0 +1,178 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # Parsers and writers still work without NumPy, on array('d') columns
+    np = None
+
+from gpxstream import gpx_bytes, read_columns, write_gpx
+from kmlstream import read_kml_columns
+
+NAN = float('nan')
+
+COLUMNS = ('lat', 'lon', 'ele', 'time')
+
+
+def _column(values, n=None):
+    """
+    Turn values into a float64 column: a NumPy array when NumPy is available, array('d') otherwise.
+    None gives a column of n NaNs.
+    """
+    if values is None:
+        values = [NAN] * n
+    if np is not None:
+        if isinstance(values, array):
+            return np.frombuffer(values, dtype=np.float64) if len(values) else np.empty(0, dtype=np.float64)
+        return np.asarray(values, dtype=np.float64)
+    if isinstance(values, array) and values.typecode == 'd':
+        return values
+    return array('d', values)
+
+
+class Track:
+    """
+    Columnar GPS track: lat, lon, ele (m) and time (epoch seconds, UTC) as float64 columns.
+    Missing elevations/timestamps are NaN. Columns are NumPy arrays, or array('d') if NumPy
+    is not installed. Stages take a Track and return a new one; the columns are never
+    turned into per-point objects unless a caller iterates over the track.
+    """
+    __slots__ = COLUMNS
+
+    def __init__(self, lat, lon, ele=None, time=None):
+        self.lat = _column(lat)
+        self.lon = _column(lon)
+        n = len(self.lat)
+        self.ele = _column(ele, n)
+        self.time = _column(time, n)
+        if not (len(self.lon) == len(self.ele) == len(self.time) == n):
+            raise ValueError("Track columns must all have the same length")
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __iter__(self):
+        """
+        Iterate as (lat, lon, ele, time) tuples, the point format of the streaming stages.
+        """
+        if np is not None:
+            return zip(self.lat.tolist(), self.lon.tolist(), self.ele.tolist(), self.time.tolist())
+        return zip(self.lat, self.lon, self.ele, self.time)
+
+    def __repr__(self):
+        return f"Track({len(self)} points)"
+
+    @classmethod
+    def empty(cls):
+        return cls([], [])
+
+    @classmethod
+    def from_points(cls, points):
+        """
+        Build a track from an iterable of (lat, lon, ele, time) tuples, e.g. a streaming stage.
+        """
+        lat, lon, ele, times = array('d'), array('d'), array('d'), array('d')
+        for point in points:
+            lat.append(point[0])
+            lon.append(point[1])
+            ele.append(point[2])
+            times.append(point[3])
+        return cls(lat, lon, ele, times)
+
+    @classmethod
+    def from_gpx(cls, gpx_file):
+        """
+        Parse the track points of a GPX file once into columns.
+        """
+        return cls(*read_columns(gpx_file))
+
+    @classmethod
+    def from_kml(cls, kml_file):
+        """
+        Parse the points of a KML file (gx:Track, Point and LineString geometry) into columns.
+        """
+        return cls(*read_kml_columns(kml_file))
+
+    def to_gpx(self, gpx_file, creator="SIH2024 GPS Pipeline", name=None):
+        """
+        Write the track as GPX and return the number of points written.
+        """
+        return write_gpx(self, gpx_file, creator=creator, name=name)
+
+    @classmethod
+    def from_npy(cls, npy_file, mmap=True):
+        """
+        Load a track saved with to_npy. With mmap=True the file is memory-mapped and the columns
+        are read-only views into it, so loading costs no parsing and no copy.
+        """
+        data = np.load(npy_file, mmap_mode='r' if mmap else None, allow_pickle=False)
+        if data.ndim != 2 or data.shape[0] != len(COLUMNS) or data.dtype != np.float64:
+            raise ValueError(f"{npy_file} is not a track file (expected a 4 x n float64 array)")
+        return cls(*data)
+
+    def to_npy(self, npy_file):
+        """
+        Save the track in the binary columnar format: a .npy file holding one 4 x n float64 array
+        whose rows are lat, lon, ele and time, each stored contiguously. Requires NumPy.
+        """
+        if np is None:
+            raise RuntimeError("Writing .npy tracks requires NumPy")
+        np.save(npy_file, np.stack([np.asarray(getattr(self, c)) for c in COLUMNS]), allow_pickle=False)
+
+    def to_gpx_bytes(self, creator="SIH2024 GPS Pipeline"):
+        """
+        The track as GPX bytes, ready to send as a request body.
+        """
+        return gpx_bytes(self, creator=creator)
+
+    def slice(self, start, stop):
+        """
+        New track with points start..stop-1 (a view of the columns when NumPy is available).
+        """
+        return Track(self.lat[start:stop], self.lon[start:stop], self.ele[start:stop], self.time[start:stop])
+
+    def select(self, mask):
+        """
+        New track with the points where mask is true.
+        """
+        if np is not None:
+            mask = np.asarray(mask, dtype=bool)
+            return Track(self.lat[mask], self.lon[mask], self.ele[mask], self.time[mask])
+        mask = list(mask)
+        return Track(*(array('d', (v for v, ok in zip(getattr(self, c), mask) if ok)) for c in COLUMNS))
+
+    def take(self, indices):
+        """
+        New track with the points at the given indices, in that order.
+        """
+        if np is not None:
+            indices = np.asarray(indices, dtype=np.intp)
+            return Track(self.lat[indices], self.lon[indices], self.ele[indices], self.time[indices])
+        indices = list(indices)
+        return Track(*(array('d', (getattr(self, c)[i] for i in indices)) for c in COLUMNS))
+
+    def sorted_by_time(self):
+        """
+        New track ordered by timestamp (stable, points without a time go last).
+        """
+        if np is not None:
+            return self.take(np.argsort(self.time, kind='stable'))
+        order = sorted(range(len(self)), key=lambda i: (self.time[i] != self.time[i], self.time[i]))
+        return self.take(order)
+
+    @classmethod
+    def concatenate(cls, tracks):
+        """
+        Join several tracks end to end.
+        """
+        tracks = list(tracks)
+        if not tracks:
+            return cls.empty()
+        if np is not None:
+            return cls(*(np.concatenate([getattr(t, c) for t in tracks]) for c in COLUMNS))
+        columns = []
+        for c in COLUMNS:
+            column = array('d')
+            for t in tracks:
+                column.extend(getattr(t, c))
+            columns.append(column)
+        return cls(*columns)
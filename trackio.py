@@ -0,0 +1,89 @@
+"""
+Format-independent track reading and writing, chosen by file extension.
+
+    .gpx, .gpx.gz   GPX XML (streamed, optionally gzip-compressed)
+    .kml, .kml.gz   KML, read only (see kmlstream)
+    .pos            position logs, read only (see pos_loader)
+    .npy            binary columnar tracks (Track.to_npy): a 4 x n float64 array,
+                    memory-mapped on load, a quarter or less of the size of the GPX
+    .json, .json.gz GraphHopper /match responses, read only (see match_response)
+
+GPX files that actually hold a /match JSON response (as older runs of the matchers saved them)
+are recognised by their first byte and decoded as responses.
+
+The .npy format is meant for intermediates and archives that are read again and again:
+loading one is a header read and an mmap instead of an XML parse.
+"""
+import os
+
+from match_response import is_match_response, read_match_response
+from pos_loader import load_pos
+from track import Track
+
+READ_EXTENSIONS = ('.gpx', '.gpx.gz', '.kml', '.kml.gz', '.pos', '.npy', '.json', '.json.gz')
+WRITE_EXTENSIONS = ('.gpx', '.gpx.gz', '.npy')
+# Names the pipelines give their results and intermediates, which directory scans must skip
+OUTPUT_SUFFIXES = ('_snapped', '_matched')
+INTERMEDIATE_PREFIXES = ('cleaned_', 'interpolated_')
+
+
+def track_extension(path):
+    """
+    The track format extension of path ('.gpx.gz', '.npy', ...), or '' if it has none.
+    """
+    name = os.path.basename(path).lower()
+    for extension in sorted(READ_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(extension):
+            return extension
+    return ''
+
+
+def with_suffix(path, suffix):
+    """
+    path with suffix inserted before its track extension: ("a.gpx.gz", "_matched") -> "a_matched.gpx.gz".
+    """
+    extension = track_extension(path)
+    return path[:len(path) - len(extension)] + suffix + path[len(path) - len(extension):]
+
+
+def is_output_file(path):
+    """
+    Whether path is a result (<name>_snapped, <name>_matched) or an intermediate (cleaned_<name>,
+    interpolated_<name>) written by the pipelines rather than an input.
+    """
+    name = os.path.basename(path)
+    extension = track_extension(name)
+    return name[:len(name) - len(extension)].endswith(OUTPUT_SUFFIXES) or name.startswith(INTERMEDIATE_PREFIXES)
+
+
+def read_track(path, mmap=True):
+    """
+    Load a track from any supported format into a Track.
+    """
+    extension = track_extension(path)
+    if extension == '.npy':
+        return Track.from_npy(path, mmap=mmap)
+    if extension in ('.json', '.json.gz'):
+        return read_match_response(path).track
+    if extension in ('.gpx', '.gpx.gz'):
+        if is_match_response(path):
+            return read_match_response(path).track
+        return Track.from_gpx(path)
+    if extension in ('.kml', '.kml.gz'):
+        return Track.from_kml(path)
+    if extension == '.pos':
+        return load_pos(path, use_mmap=mmap)
+    raise ValueError(f"Unsupported track file: {path}")
+
+
+def write_track(track, path, creator="SIH2024 GPS Pipeline", name=None):
+    """
+    Save a Track as GPX, gzip-compressed GPX or .npy, depending on the extension of path.
+    """
+    extension = track_extension(path)
+    if extension == '.npy':
+        track.to_npy(path)
+    elif extension in ('.gpx', '.gpx.gz'):
+        track.to_gpx(path, creator=creator, name=name)
+    else:
+        raise ValueError(f"Cannot write tracks as {path}; use one of {WRITE_EXTENSIONS}")
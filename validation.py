@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+
+from gpxstream import iter_trackpoints
+from match_response import is_match_response
+from preprocessing import iter_chunks
+from road_index import DEFAULT_OFF_ROAD_M
+from trackio import WRITE_EXTENSIONS, read_track, track_extension
+
+# Snapped files with more off-road points than this fraction fail validation
+DEFAULT_MAX_OFF_ROAD_FRACTION = 0.05
+# Out-of-range points printed per check; the rest are only counted
+MAX_REPORTED_POINTS = 10
+
+def _coordinates_ok(lat, lon):
+    """
+    Vectorized range check of coordinate arrays; prints the first out-of-range points and says
+    whether there were none.
+    """
+    bad = (lat < -90) | (lat > 90) | (lon < -180) | (lon > 180)
+    count = int(bad.sum())
+    if count:
+        for lat_bad, lon_bad in zip(lat[bad][:MAX_REPORTED_POINTS].tolist(), lon[bad][:MAX_REPORTED_POINTS].tolist()):
+            print(f"Invalid coordinates: {lat_bad}, {lon_bad}")
+        if count > MAX_REPORTED_POINTS:
+            print(f"... and {count - MAX_REPORTED_POINTS} more invalid coordinates")
+    return not count
+
+def _off_road_ok(off_road, total, threshold_m, max_off_road_fraction):
+    """
+    Print the off-road share of a track and say whether it is acceptable.
+    """
+    fraction = off_road / total if total else 0.0
+    print(f"{off_road} of {total} points ({fraction:.1%}) are more than {threshold_m:g} m from a road")
+    return fraction <= max_off_road_fraction
+
+# Optional: Validate snapped data
+def validate_snapped_data(gpx_file, road_index=None, threshold_m=DEFAULT_OFF_ROAD_M,
+                          max_off_road_fraction=DEFAULT_MAX_OFF_ROAD_FRACTION):
+    """
+    Validate the snapped data by checking if the points are within reasonable proximity to a road.
+    Coordinates are always range-checked. With a RoadIndex (see road_index) the distance of every
+    point to the nearest road is computed too, chunk by chunk as the file streams in, and the file
+    fails if more than max_off_road_fraction of its points are over threshold_m from a road.
+    A /match JSON response saved under a GPX name is decoded and validated as a Track instead.
+    """
+    if is_match_response(gpx_file):
+        return validate_track(read_track(gpx_file), road_index, threshold_m, max_off_road_fraction)
+    valid = True
+    off_road = total = 0
+    for chunk in iter_chunks(iter_trackpoints(gpx_file)):
+        lat = np.fromiter((p[0] for p in chunk), dtype=np.float64, count=len(chunk))
+        lon = np.fromiter((p[1] for p in chunk), dtype=np.float64, count=len(chunk))
+        valid &= _coordinates_ok(lat, lon)
+        if road_index is not None:
+            off_road += int(road_index.off_road_mask(lat, lon, threshold_m).sum())
+            total += len(chunk)
+
+    if road_index is not None:
+        valid &= _off_road_ok(off_road, total, threshold_m, max_off_road_fraction)
+    return valid
+
+def validate_track(track, road_index=None, threshold_m=DEFAULT_OFF_ROAD_M,
+                   max_off_road_fraction=DEFAULT_MAX_OFF_ROAD_FRACTION):
+    """
+    Vectorized validation of an in-memory Track; True if every point is valid.
+    Same checks as validate_snapped_data: coordinate ranges, plus road proximity with a RoadIndex.
+    """
+    valid = _coordinates_ok(np.asarray(track.lat), np.asarray(track.lon))
+
+    if road_index is not None:
+        report = road_index.proximity_report(track, threshold_m)
+        valid &= _off_road_ok(report['off_road'], report['points'], threshold_m, max_off_road_fraction)
+    return valid
+
+def validate_all_files(directory, road_index=None, threshold_m=DEFAULT_OFF_ROAD_M):
+    """
+    Validate all snapped track files (GPX, .gpx.gz or binary .npy) in the directory.
+    GPX is streamed; .npy tracks are memory-mapped and checked in one vectorized pass.
+    Pass a RoadIndex to report the fraction of off-road points of every file.
+    """
+    for root, _, files in os.walk(directory):
+        for file in files:
+            extension = track_extension(file)
+            if extension in WRITE_EXTENSIONS and file[:len(file) - len(extension)].endswith('_snapped'):
+                gpx_file = os.path.join(root, file)
+                if extension == '.npy':
+                    valid = validate_track(read_track(gpx_file), road_index, threshold_m)
+                else:
+                    valid = validate_snapped_data(gpx_file, road_index, threshold_m)
+                if valid:
+                    print(f"Valid snapped data in {gpx_file}")
+                else:
+                    print(f"Invalid snapped data in {gpx_file}")
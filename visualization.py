@@ -0,0 +1,174 @@
+"""
+Folium maps of tracks.
+
+Every polyline is simplified before it is embedded (see simplify: Ramer-Douglas-Peucker by
+default, or Visvalingam-Whyatt) and coordinates are rounded to COORDINATE_DECIMALS, so the HTML
+grows with the shape of the route instead of the sampling rate. If all tracks together still
+have more than max_points points the tolerance is doubled until they fit, which bounds file
+size and browser render time however much data goes in.
+
+Many tracks can share one map (one toggleable layer each), and dense point clouds can be
+pre-aggregated on a grid into a heatmap layer: one weighted point per occupied cell instead of
+one per GPS fix.
+
+Usage:
+    python visualization.py a.gpx b.gpx c.npy --output tracks.html --tolerance-m 2 --heatmap
+"""
+import argparse
+import itertools
+
+import folium
+import numpy as np
+from folium.plugins import HeatMap
+
+from road_index import METERS_PER_DEGREE
+from simplify import SIMPLIFY_METHODS, simplify_mask
+from trackio import read_track
+
+# Visually lossless at street zoom levels
+DEFAULT_TOLERANCE_M = 1.0
+# Points of all polylines on one map, after simplification
+DEFAULT_MAX_POINTS = 100_000
+# Bounds the search for a tolerance that meets max_points: 2**30 m is beyond any track
+MAX_TOLERANCE_DOUBLINGS = 30
+DEFAULT_HEATMAP_CELL_M = 25.0
+# 6 decimals of a degree is about 0.1 m
+COORDINATE_DECIMALS = 6
+TRACK_COLORS = ('blue', 'red', 'green', 'purple', 'orange', 'darkred', 'cadetblue', 'darkgreen', 'black', 'pink')
+
+
+def _polyline_points(track, mask):
+    lat = np.round(track.lat[mask], COORDINATE_DECIMALS)
+    lon = np.round(track.lon[mask], COORDINATE_DECIMALS)
+    return np.column_stack((lat, lon)).tolist()
+
+
+def simplified_masks(tracks, tolerance_m=DEFAULT_TOLERANCE_M, method='rdp', max_points=DEFAULT_MAX_POINTS):
+    """
+    Simplification masks of tracks at tolerance_m, with the tolerance doubled until the tracks
+    have at most max_points points together. Both methods keep the end points of every track, so
+    max_points is raised to their count if it is lower: once only end points are left no doubling
+    can drop more, and the loop ends there (or after MAX_TOLERANCE_DOUBLINGS). A doubling that
+    drops nothing is not a stop on its own, since noisy tracks plateau before their shape does.
+    Returns (masks, tolerance used).
+    """
+    if not tolerance_m:
+        return [np.ones(len(track), dtype=bool) for track in tracks], 0.0
+    if max_points is not None:
+        max_points = max(max_points, sum(min(len(track), 2) for track in tracks))
+    for doublings in range(MAX_TOLERANCE_DOUBLINGS + 1):
+        masks = [simplify_mask(track.lat, track.lon, tolerance_m, method) for track in tracks]
+        if (max_points is None or doublings == MAX_TOLERANCE_DOUBLINGS
+                or sum(int(mask.sum()) for mask in masks) <= max_points):
+            return masks, tolerance_m
+        tolerance_m *= 2
+
+
+def heatmap_cells(tracks, cell_m=DEFAULT_HEATMAP_CELL_M):
+    """
+    Points of all tracks binned on a cell_m grid: [[lat, lon, count], ...] with one entry per
+    occupied cell, at the cell's mean position.
+    """
+    tracks = [track for track in tracks if len(track)]
+    if not tracks:
+        return []
+    lat = np.concatenate([track.lat for track in tracks])
+    lon = np.concatenate([track.lon for track in tracks])
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon = lat[valid], lon[valid]
+    cell_deg = cell_m / METERS_PER_DEGREE
+    scale = np.cos(np.radians(np.mean(lat))) if len(lat) else 1.0
+    cells = np.column_stack((np.floor(lat / cell_deg), np.floor(lon * scale / cell_deg))).astype(np.int64)
+    _, cell, count = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cell = cell.ravel()
+    mean_lat = np.bincount(cell, lat) / count
+    mean_lon = np.bincount(cell, lon) / count
+    return np.column_stack((np.round(mean_lat, COORDINATE_DECIMALS), np.round(mean_lon, COORDINATE_DECIMALS),
+                            count)).tolist()
+
+
+def visualize_tracks(tracks, names=None, tolerance_m=DEFAULT_TOLERANCE_M, method='rdp', max_points=DEFAULT_MAX_POINTS,
+                     heatmap=False, heatmap_cell_m=DEFAULT_HEATMAP_CELL_M, show_tracks=True):
+    """
+    One Folium map with a simplified polyline per track (each its own layer, named after names)
+    and, with heatmap=True, a grid-aggregated heatmap of all points. tolerance_m=0 disables
+    simplification. The map is fitted to the bounds of all tracks.
+    """
+    if method not in SIMPLIFY_METHODS:
+        raise ValueError(f"method must be one of {SIMPLIFY_METHODS}")
+    tracks = list(tracks)
+    names = list(names) if names is not None else [f"Track {i + 1}" for i in range(len(tracks))]
+    non_empty = [track for track in tracks if len(track)]
+    if not non_empty:
+        return folium.Map(location=[0, 0], zoom_start=2)
+
+    lat = np.concatenate([track.lat for track in non_empty])
+    lon = np.concatenate([track.lon for track in non_empty])
+    m = folium.Map(location=[float(np.nanmean(lat)), float(np.nanmean(lon))], zoom_start=12)
+    m.fit_bounds([[float(np.nanmin(lat)), float(np.nanmin(lon))], [float(np.nanmax(lat)), float(np.nanmax(lon))]])
+
+    if show_tracks:
+        masks, _ = simplified_masks(tracks, tolerance_m, method, max_points)
+        for track, mask, name, color in zip(tracks, masks, names, itertools.cycle(TRACK_COLORS)):
+            if len(track):
+                layer = folium.FeatureGroup(name=name)
+                folium.PolyLine(_polyline_points(track, mask), color=color, weight=2.5, opacity=1).add_to(layer)
+                layer.add_to(m)
+
+    if heatmap:
+        HeatMap(heatmap_cells(tracks, heatmap_cell_m), name="Density", radius=12).add_to(m)
+    if len(tracks) > 1 or heatmap:
+        folium.LayerControl().add_to(m)
+    return m
+
+
+# Optional: Visualize snapped data on a map
+def visualize_gpx_on_map(gpx_file, tolerance_m=DEFAULT_TOLERANCE_M, method='rdp'):
+    """
+    Visualize the GPX file (or any other track file trackio reads) on a map using Folium.
+    """
+    return visualize_track(read_track(gpx_file), tolerance_m, method)
+
+def visualize_track(track, tolerance_m=DEFAULT_TOLERANCE_M, method='rdp'):
+    """
+    Visualize an in-memory Track on a map using Folium, simplified at tolerance_m (0 keeps every
+    point).
+    """
+    return visualize_tracks([track], tolerance_m=tolerance_m, method=method)
+
+def save_map_as_html(gpx_file, output_html, tolerance_m=DEFAULT_TOLERANCE_M, method='rdp'):
+    """
+    Save the visualization as an HTML file.
+    """
+    m = visualize_gpx_on_map(gpx_file, tolerance_m, method)
+    m.save(output_html)
+    print(f"Map saved as {output_html}")
+
+def save_tracks_map(track_files, output_html, **options):
+    """
+    Render several track files into one HTML map; options are passed to visualize_tracks.
+    """
+    m = visualize_tracks([read_track(path) for path in track_files], names=track_files, **options)
+    m.save(output_html)
+    print(f"Map of {len(track_files)} tracks saved as {output_html}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('tracks', nargs='+', help="Track files (.gpx, .gpx.gz, .kml, .pos, .npy)")
+    parser.add_argument('--output', default='tracks_map.html')
+    parser.add_argument('--tolerance-m', type=float, default=DEFAULT_TOLERANCE_M, help="0 disables simplification")
+    parser.add_argument('--method', choices=SIMPLIFY_METHODS, default='rdp')
+    parser.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS)
+    parser.add_argument('--heatmap', action='store_true', help="Add a grid-aggregated density layer")
+    parser.add_argument('--heatmap-cell-m', type=float, default=DEFAULT_HEATMAP_CELL_M)
+    parser.add_argument('--no-tracks', action='store_true', help="Only the heatmap, no polylines")
+    args = parser.parse_args()
+
+    save_tracks_map(args.tracks, args.output, tolerance_m=args.tolerance_m, method=args.method,
+                    max_points=args.max_points, heatmap=args.heatmap, heatmap_cell_m=args.heatmap_cell_m,
+                    show_tracks=not args.no_tracks)
+
+
+if __name__ == "__main__":
+    main()